@@ -0,0 +1,354 @@
+"""Benchmarks of the LinoSPAD2 data analysis functions.
+
+Synthetic data files of firmware version 2212 are generated with
+'generate_data' in a temporary folder and the main analysis functions
+are run on them. Each benchmark is timed with 'time.perf_counter' over
+several repeats and memory-profiled with 'tracemalloc' in a separate
+run, so that the profiling does not slow down the timed runs. Results
+are printed as a table and can be saved as a '.json' file and compared
+with an earlier run, so that regressions and improvements show up in
+numbers.
+
+Usage (from the root of the repository):
+
+    python benchmarks/bench_functions.py --cycles 200 --files 2
+    python benchmarks/bench_functions.py --save new.json --compare old.json
+
+This file contains the following functions:
+
+    * run_benchmarks - generate the data, run the benchmarks and return
+    the results.
+
+    * main - command line interface.
+
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+from LinoSPAD2.functions import calc_diff as cd
+from LinoSPAD2.functions import unpack as f_up
+from LinoSPAD2.functions.calibrate import calibrate_save
+from LinoSPAD2.functions.cross_talk import collect_ct
+from LinoSPAD2.functions.delta_t import deltas_save
+from LinoSPAD2.functions.plot_tmsp import plot_sen_pop
+from LinoSPAD2.functions.synthetic import generate_data
+
+
+def _measure(func, setup=None, repeat: int = 3):
+    """Time a function and measure its peak memory.
+
+    Parameters
+    ----------
+    func : callable
+        Function to benchmark, called without arguments.
+    setup : callable, optional
+        Function called before each run, not timed. The default is
+        None.
+    repeat : int, optional
+        Number of timed runs. The default is 3.
+
+    Returns
+    -------
+    result : dict
+        Minimum and median time in seconds and peak memory in MB.
+
+    """
+    times = []
+    # output of the functions (prints and progress bars) is discarded
+    sink = io.StringIO()
+    with contextlib.redirect_stdout(sink), contextlib.redirect_stderr(sink):
+        for _ in range(repeat):
+            if setup is not None:
+                setup()
+            start = time.perf_counter()
+            func()
+            times.append(time.perf_counter() - start)
+
+        if setup is not None:
+            setup()
+        tracemalloc.start()
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+    return {
+        "time_min": min(times),
+        "time_median": float(np.median(times)),
+        "memory_peak": peak / 1e6,
+    }
+
+
+def _import_time():
+    """Time importing the core modules in a new interpreter.
+
+    Returns
+    -------
+    result : dict
+        Time in seconds, with no memory measured.
+
+    """
+    code = (
+        "import time\n"
+        "start = time.perf_counter()\n"
+        "import LinoSPAD2.functions.unpack\n"
+        "import LinoSPAD2.functions.calc_diff\n"
+        "print(time.perf_counter() - start)\n"
+    )
+    times = [
+        float(
+            subprocess.run(
+                [sys.executable, "-c", code],
+                capture_output=True,
+                text=True,
+                check=True,
+            ).stdout
+        )
+        for _ in range(3)
+    ]
+
+    return {
+        "time_min": min(times),
+        "time_median": float(np.median(times)),
+        "memory_peak": float("nan"),
+    }
+
+
+def run_benchmarks(
+    fw_ver: str = "2212b",
+    files: int = 2,
+    cycles: int = 200,
+    timestamps: int = 512,
+    dark_rate: float = 1e4,
+    pair_rate: float = 1e3,
+    pixels: int = 20,
+    repeat: int = 3,
+):
+    """Generate synthetic data and run the benchmarks.
+
+    Parameters
+    ----------
+    fw_ver : str, optional
+        LinoSPAD2 firmware version, "2212b" or "2212s". The default is
+        "2212b".
+    files : int, optional
+        Number of data files. The default is 2.
+    cycles : int, optional
+        Number of acquisition cycles per file. The default is 200.
+    timestamps : int, optional
+        Number of timestamps per TDC per acquisition cycle. The default
+        is 512.
+    dark_rate : float, optional
+        Rate of dark counts in each pixel in Hz. The default is 1e4.
+    pair_rate : float, optional
+        Rate of correlated pairs of photons in Hz in the first and the
+        last of the 'pixels'. The default is 1e3.
+    pixels : int, optional
+        Number of pixels used for timestamp differences and cross-talk.
+        The default is 20.
+    repeat : int, optional
+        Number of timed runs of each benchmark. The default is 3.
+
+    Returns
+    -------
+    results : dict
+        Results of each benchmark, see '_measure'.
+
+    """
+    # figures are only saved, never shown
+    os.environ.setdefault("MPLBACKEND", "Agg")
+
+    board_number = "A5"
+    pix = list(range(pixels))
+    results = {"import": _import_time()}
+
+    path = tempfile.mkdtemp()
+    try:
+        for i in range(files):
+            generate_data(
+                os.path.join(path, "{:010d}.dat".format(i)),
+                fw_ver,
+                cycles,
+                timestamps,
+                dark_rate=dark_rate,
+                pairs=[[0, pixels - 1]],
+                pair_rate=pair_rate,
+                pair_offset=2e3,
+                seed=i,
+            )
+        file = os.path.join(path, "{:010d}.dat".format(0))
+        path_out = os.path.join(path, "output")
+
+        def clean():
+            shutil.rmtree(path_out, ignore_errors=True)
+
+        results["unpack_bin"] = _measure(
+            lambda: f_up.unpack_bin(
+                file, board_number, timestamps, fw_ver=fw_ver
+            ),
+            repeat=repeat,
+        )
+        results["unpack_bin_sparse"] = _measure(
+            lambda: f_up.unpack_bin_sparse(
+                file, board_number, fw_ver, timestamps
+            ),
+            repeat=repeat,
+        )
+
+        results["count_valid"] = _measure(
+            lambda: f_up.count_valid(file, fw_ver, timestamps),
+            repeat=repeat,
+        )
+
+        tmsp, offsets = f_up.unpack_bin_sparse(
+            file, board_number, fw_ver, timestamps
+        )
+        results["calc_diff_2212"] = _measure(
+            lambda: cd.calc_diff_2212(
+                tmsp, tmsp, offsets[0], 10e3, cycle_ends2=offsets[1]
+            ),
+            repeat=repeat,
+        )
+        results["calc_diff_2212_pairs"] = _measure(
+            lambda: cd.calc_diff_2212_pairs(tmsp, offsets, pix, 10e3),
+            repeat=repeat,
+        )
+        del tmsp, offsets
+
+        results["calibrate_save"] = _measure(
+            lambda: calibrate_save(path, timestamps, fw_ver),
+            repeat=repeat,
+        )
+        results["deltas_save"] = _measure(
+            lambda: deltas_save(
+                path,
+                pix,
+                False,
+                board_number,
+                fw_ver,
+                timestamps,
+                10e3,
+                path_out=path_out,
+            ),
+            setup=clean,
+            repeat=repeat,
+        )
+        # cross-talk is calculated with firmware version '2212b' only
+        results["collect_ct"] = _measure(
+            lambda: collect_ct(
+                path, pix, board_number, timestamps, path_out=path_out
+            ),
+            setup=clean,
+            repeat=repeat,
+        )
+        results["plot_sen_pop"] = _measure(
+            lambda: plot_sen_pop(
+                path, board_number, fw_ver, timestamps, path_out=path_out
+            ),
+            setup=clean,
+            repeat=repeat,
+        )
+    finally:
+        shutil.rmtree(path, ignore_errors=True)
+
+    return results
+
+
+def main(argv=None):
+    """Run the benchmarks from the command line.
+
+    Parameters
+    ----------
+    argv : list, optional
+        Command line arguments. The default is None, in which case
+        'sys.argv' is used.
+
+    Returns
+    -------
+    None.
+
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument(
+        "--fw-ver", default="2212b", choices=["2212b", "2212s"]
+    )
+    parser.add_argument("--files", type=int, default=2)
+    parser.add_argument("--cycles", type=int, default=200)
+    parser.add_argument("--timestamps", type=int, default=512)
+    parser.add_argument("--dark-rate", type=float, default=1e4)
+    parser.add_argument("--pair-rate", type=float, default=1e3)
+    parser.add_argument("--pixels", type=int, default=20)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--save", help="save the results as a '.json' file")
+    parser.add_argument(
+        "--compare", help="'.json' file with results to compare with"
+    )
+    args = parser.parse_args(argv)
+
+    params = {
+        "fw_ver": args.fw_ver,
+        "files": args.files,
+        "cycles": args.cycles,
+        "timestamps": args.timestamps,
+        "dark_rate": args.dark_rate,
+        "pair_rate": args.pair_rate,
+        "pixels": args.pixels,
+        "repeat": args.repeat,
+    }
+    results = run_benchmarks(**params)
+
+    reference = {}
+    if args.compare is not None:
+        with open(args.compare) as f:
+            reference = json.load(f)["results"]
+
+    print(
+        "{:<22}{:>12}{:>12}{:>12}{:>10}".format(
+            "benchmark", "min [s]", "median [s]", "peak [MB]", "ratio"
+        )
+    )
+    for name, result in results.items():
+        # ratio of the median times to the compared run
+        ratio = ""
+        if name in reference:
+            ratio = "{:.2f}".format(
+                result["time_median"] / reference[name]["time_median"]
+            )
+        print(
+            "{:<22}{:>12.4f}{:>12.4f}{:>12.1f}{:>10}".format(
+                name,
+                result["time_min"],
+                result["time_median"],
+                result["memory_peak"],
+                ratio,
+            )
+        )
+
+    if args.save is not None:
+        with open(args.save, "w") as f:
+            json.dump(
+                {
+                    "params": params,
+                    "python": platform.python_version(),
+                    "numpy": np.__version__,
+                    "results": results,
+                },
+                f,
+                indent=4,
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -2,7 +2,7 @@
 
 Compares all timestamps from the same cycle for the given pair of pixels
 against a given value (delta_window). Differences in that window are saved
-and returned as a list.
+and returned as an array.
 
 This file can also be imported as a module and contains the following
 functions:
@@ -10,16 +10,30 @@ functions:
     * calc_diff_2212 - calculate timestamp differences for the given
     pair of pixels. Works only with firmware version '2212'.
 
+    * calc_diff_2212_pairs - calculate timestamp differences for all
+    pairs of the given pixels in a single pass. Works with the output
+    of 'unpack_bin_sparse'.
+
+    * calc_hist_2212 - histogram timestamp differences into bins of the
+    average LinoSPAD2 TDC bin width (17.857 ps).
+
+    * rebin_hist_2212 - cut a histogram from 'calc_hist_2212' to the
+    given range and merge its bins into coarser ones.
+
 """
 
 import numpy as np
 
 
-def calc_diff_2212(data1, data2, cycle_ends, delta_window: float = 10e3):
+def calc_diff_2212(
+    data1, data2, cycle_ends, delta_window: float = 10e3, cycle_ends2=None
+):
     """Calculate timestamp differences for firmware 2212.
 
     Calculate timestamp differences for two given pixels and LinoSPAD2
-    firmware version 2212.
+    firmware version 2212. Timestamps of the second pixel are sorted
+    within each cycle, and windows around each timestamp of the first
+    pixel are found with a binary search for all cycles at once.
 
     Parameters
     ----------
@@ -34,28 +48,274 @@ def calc_diff_2212(data1, data2, cycle_ends, delta_window: float = 10e3):
     delta_window : float, optional
         A width of a window in which the number of timestamp differences
         are counted. The default value is 10 ns. The default is 10e3.
+    cycle_ends2 : array-like, optional
+        Array of positions of ends of cycles in the data of the second
+        pixel, if different from 'cycle_ends', e.g., offsets of the
+        second pixel from 'unpack_bin_sparse'. The default is None, in
+        which case 'cycle_ends' is used for both pixels.
 
     Returns
     -------
-    deltas_out : list
+    deltas_out : ndarray
         All timestamp differences found in a given time window for a
         given pair of pixels.
 
     """
-    deltas_out = []
-
-    for cyc in range(len(cycle_ends) - 1):
-        data1_cycle = data1[cycle_ends[cyc] : cycle_ends[cyc + 1]]
-        data2_cycle = data2[cycle_ends[cyc] : cycle_ends[cyc + 1]]
-
-        # calculate delta t
-        tmsp1 = data1_cycle[np.where(data1_cycle > 0)[0]]
-        tmsp2 = data2_cycle[np.where(data2_cycle > 0)[0]]
-        for t1 in tmsp1:
-            # calculate all timestamp differences in the given cycle
-            deltas = tmsp2 - t1
-            # take values in the given delta t window only
-            ind = np.where(np.abs(deltas) < delta_window)[0]
-            deltas_out.extend(deltas[ind])
+    if cycle_ends2 is None:
+        cycle_ends2 = cycle_ends
+
+    cycle1, tmsp1 = _cycle_tmsp(data1, cycle_ends)
+    cycle2, tmsp2 = _cycle_tmsp(data2, cycle_ends2)
+
+    if not len(tmsp1) or not len(tmsp2):
+        return np.array([], dtype=np.result_type(tmsp1, tmsp2))
+
+    # sort the second pixel by cycle, then by timestamp
+    order = np.lexsort((tmsp2, cycle2))
+    cycle2, tmsp2 = cycle2[order], tmsp2[order]
+
+    # single key for cycle and timestamp; cycles are far enough from
+    # each other so that windows do not overlap
+    t_min = min(tmsp1.min(), tmsp2.min())
+    span = max(tmsp1.max(), tmsp2.max()) - t_min + 2 * delta_window + 1
+    key1 = cycle1 * span + (tmsp1 - t_min)
+    key2 = cycle2 * span + (tmsp2 - t_min)
+
+    # slightly wider windows, differences are checked exactly below
+    lower = np.searchsorted(key2, key1 - delta_window - 1, side="left")
+    upper = np.searchsorted(key2, key1 + delta_window + 1, side="right")
+
+    counts = upper - lower
+    ind1 = np.repeat(np.arange(len(tmsp1)), counts)
+    ind2 = np.arange(counts.sum()) + np.repeat(
+        lower - np.cumsum(counts) + counts, counts
+    )
+
+    deltas = tmsp2[ind2] - tmsp1[ind1]
+    # take values in the given delta t window only
+    ind = (np.abs(deltas) < delta_window) & (cycle2[ind2] == cycle1[ind1])
+
+    return deltas[ind]
+
+
+def calc_diff_2212_pairs(tmsp, offsets, pixels, delta_window: float = 10e3):
+    """Calculate timestamp differences for all pairs of pixels.
+
+    Timestamps of all given pixels are merged, together with pixel
+    labels, and sorted within each cycle once. Differences for every
+    pair of pixels are then collected in a single sweep over the sorted
+    timestamps, instead of comparing each pair separately.
+
+    Parameters
+    ----------
+    tmsp : array-like
+        Valid timestamps grouped by pixel and cycle, output of
+        'unpack_bin_sparse'.
+    offsets : array-like
+        Offsets of pixels and cycles in 'tmsp', output of
+        'unpack_bin_sparse'.
+    pixels : array-like
+        Pixel numbers. Timestamp differences are calculated for all
+        pairs where the first pixel number is lower than the second.
+    delta_window : float, optional
+        A width of a window in which the number of timestamp differences
+        are counted. The default is 10e3 (10 ns).
+
+    Returns
+    -------
+    deltas_out : dict
+        Timestamp differences (second pixel minus first) in the given
+        time window for each pair of pixels, where keys are tuples of
+        pixel numbers.
+
+    """
+    tmsp = np.asarray(tmsp)
+    offsets = np.asarray(offsets)
+    pix_sorted = np.unique(pixels)
+
+    # merge timestamps of all pixels with pixel labels and cycle numbers
+    cycles = np.arange(offsets.shape[1] - 1)
+    labels = np.concatenate(
+        [
+            np.full(offsets[p, -1] - offsets[p, 0], i)
+            for i, p in enumerate(pix_sorted)
+        ]
+    )
+    cycle = np.concatenate(
+        [np.repeat(cycles, np.diff(offsets[p])) for p in pix_sorted]
+    )
+    tmsp_all = np.concatenate(
+        [tmsp[offsets[p, 0] : offsets[p, -1]] for p in pix_sorted]
+    )
+
+    deltas_pair = {}
+    if len(tmsp_all):
+        order = np.lexsort((tmsp_all, cycle))
+        labels, cycle, tmsp_all = labels[order], cycle[order], tmsp_all[order]
+
+        # single key for cycle and timestamp, see 'calc_diff_2212'
+        t_min = tmsp_all.min()
+        span = tmsp_all.max() - t_min + 2 * delta_window + 1
+        key = cycle * span + (tmsp_all - t_min)
+
+        # each timestamp is paired with the following ones in the window;
+        # slightly wider windows, differences are checked exactly below
+        first = np.arange(len(key))
+        upper = np.searchsorted(key, key + delta_window + 1, side="right")
+        counts = upper - first - 1
+        ind1 = np.repeat(first, counts)
+        ind2 = (
+            ind1
+            + 1
+            + np.arange(counts.sum())
+            - np.repeat(np.cumsum(counts) - counts, counts)
+        )
+
+        ind = (
+            (labels[ind1] != labels[ind2])
+            & (cycle[ind1] == cycle[ind2])
+            & (tmsp_all[ind2] - tmsp_all[ind1] < delta_window)
+        )
+        ind1, ind2 = ind1[ind], ind2[ind]
+
+        # differences are always second pixel minus first pixel
+        swap = labels[ind1] > labels[ind2]
+        ind1[swap], ind2[swap] = ind2[swap], ind1[swap]
+        pair = labels[ind1] * len(pix_sorted) + labels[ind2]
+        deltas = tmsp_all[ind2] - tmsp_all[ind1]
+
+        order = np.argsort(pair, kind="stable")
+        bounds = np.cumsum(np.bincount(pair, minlength=len(pix_sorted) ** 2))
+        deltas = np.split(deltas[order], bounds[:-1])
+        for i, q in enumerate(pix_sorted):
+            for j, w in enumerate(pix_sorted):
+                deltas_pair[(q, w)] = deltas[i * len(pix_sorted) + j]
+
+    deltas_out = {}
+    for q in pixels:
+        for w in pixels:
+            if w <= q:
+                continue
+            deltas_out[(q, w)] = deltas_pair.get(
+                (q, w), np.array([], dtype=tmsp.dtype)
+            )
 
     return deltas_out
+
+
+def calc_hist_2212(deltas, delta_window: float = 10e3):
+    """Histogram timestamp differences in bins of the TDC bin width.
+
+    Timestamp differences are counted in bins of 17.857 ps (average
+    LinoSPAD2 TDC bin width), symmetric around zero and covering the
+    whole delta t window. As the bins depend only on the window,
+    histograms from different data files can be summed directly.
+
+    Parameters
+    ----------
+    deltas : array-like
+        Timestamp differences in the given window.
+    delta_window : float, optional
+        A width of a window in which the timestamp differences were
+        collected. The default is 10e3 (10 ns).
+
+    Returns
+    -------
+    counts : ndarray
+        Number of timestamp differences in each bin.
+    bin_edges : ndarray
+        Edges of the bins in ps.
+
+    """
+    half = int(np.ceil(delta_window / 17.857))
+    bin_edges = np.arange(-half, half + 1) * 17.857
+
+    ind = np.floor(np.asarray(deltas) / 17.857).astype(np.longlong) + half
+    ind = ind[(ind >= 0) & (ind < 2 * half)]
+    counts = np.bincount(ind, minlength=2 * half)
+
+    return counts, bin_edges
+
+
+def rebin_hist_2212(counts, bin_edges, step: int = 1, hist_range=None):
+    """Rebin a histogram of timestamp differences into coarser bins.
+
+    Bins that are fully inside 'hist_range' are kept and merged in
+    groups of 'step' consecutive bins, so that histograms with any bin
+    width in units of 17.857 ps and any range can be derived from a
+    single histogram of 'calc_hist_2212' without the timestamp
+    differences themselves. Bins at the end that do not fill a whole
+    group are dropped.
+
+    Parameters
+    ----------
+    counts : array-like
+        Number of timestamp differences in each bin.
+    bin_edges : array-like
+        Edges of the bins in ps.
+    step : int, optional
+        Number of bins merged into one. The default is 1.
+    hist_range : tuple, optional
+        Lower and upper limits of the histogram in ps. The default is
+        None, in which case all bins are used.
+
+    Returns
+    -------
+    counts : ndarray
+        Number of timestamp differences in each of the new bins.
+    bin_edges : ndarray
+        Edges of the new bins in ps.
+
+    """
+    counts = np.asarray(counts)
+    bin_edges = np.asarray(bin_edges)
+
+    if hist_range is not None:
+        inside = np.nonzero(
+            (bin_edges[:-1] >= hist_range[0])
+            & (bin_edges[1:] <= hist_range[1])
+        )[0]
+        if len(inside) == 0:
+            return counts[:0], bin_edges[:1]
+        counts = counts[inside[0] : inside[-1] + 1]
+        bin_edges = bin_edges[inside[0] : inside[-1] + 2]
+
+    bins = len(counts) // step * step
+    counts = counts[:bins].reshape(-1, step).sum(axis=1)
+    bin_edges = bin_edges[: bins + 1 : step]
+
+    return counts, bin_edges
+
+
+def _cycle_tmsp(data, cycle_ends):
+    """Collect valid timestamps and their cycle numbers.
+
+    Parameters
+    ----------
+    data : array-like
+        Array of data from a single pixel.
+    cycle_ends : array-like
+        Array of positions of ends of cycles in 'data'.
+
+    Returns
+    -------
+    cycles : ndarray
+        Cycle number of each valid timestamp.
+    tmsp : ndarray
+        Valid (positive) timestamps that are inside the cycles.
+
+    """
+    data = np.asarray(data)
+    cycle_ends = np.asarray(cycle_ends).ravel()
+    if len(cycle_ends) < 2:
+        return np.array([], dtype=np.longlong), data[:0]
+
+    positions = np.arange(
+        max(cycle_ends[0], 0), min(cycle_ends[-1], len(data))
+    )
+    cycles = np.searchsorted(cycle_ends, positions, side="right") - 1
+    tmsp = data[positions]
+
+    ind = tmsp > 0
+
+    return cycles[ind], tmsp[ind]
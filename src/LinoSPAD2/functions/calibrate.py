@@ -6,69 +6,318 @@ functions:
     * calibrate_save - calculate a calibration matrix and save it as
     a '.csv' table.
 
+    * calibrate_update - update populations of TDC codes of a board
+    with new data and save a new version of the calibration matrix
+    when enough data are collected.
+
     * calibrate_load - load the calibration matrix from a '.csv' table.
+    Loaded matrices are kept in memory, so that each table is parsed
+    only once per process.
 """
 import glob
 import os
 
 import numpy as np
-import pandas as pd
+
+# Calibration matrices loaded in this process, with modification times
+# of the files they were loaded from
+_cal_mats = {}
 
 
-def calibrate_save(path, timestamps: int = 512):
+def calibrate_save(
+    path,
+    timestamps: int = 512,
+    fw_ver: str = "2208",
+    chunk_cycles: int = 100,
+):
     """Calculate and save calibration data.
 
     Function for calculating the calibration matrix and saving it into a
-    '.csv' file. The data file used for the calculation should be taken
-    with the sensor uniformly illuminated by ambient light.
+    '.csv' file in the same folder. The data files used for the
+    calculation should be taken with the sensor uniformly illuminated
+    by ambient light. All data files in the folder are used; each is
+    memory-mapped and read in chunks of acquisition cycles, so that the
+    amount of data is not limited by memory. Populations of the 140 TDC
+    codes in all pixels are collected with a single 'np.bincount' per
+    chunk.
 
     Parameters
     ----------
     path : str
-        Path to the data file.
+        Path to the data files.
     timestamps : int, optional
         Number of timestamps per acquisition cycle per pixel. The
         default is 512.
+    fw_ver : str, optional
+        LinoSPAD2 firmware version. For "2208", data are 256 pixels x
+        timestamps per cycle. For "2212b" and "2212s", data are 65 TDCs
+        x timestamps per cycle, with pixel coordinates in the TDC in
+        each word; the calibration matrix is then indexed by
+        4 * TDC + pixel coordinate, as in 'unpack_bin'. The default is
+        "2208".
+    chunk_cycles : int, optional
+        Number of acquisition cycles read at once. The default is 100.
+
+    Raises
+    ------
+    TypeError
+        Raised when 'fw_ver' is not a string.
+    ValueError
+        Raised when the firmware version is not recognized.
+    FileNotFoundError
+        Raised when no data files are found.
 
     Returns
     -------
     None.
 
     """
-    os.chdir(path)
-    filename = glob.glob("*.dat*")[0]
+    # parameter type check
+    if isinstance(fw_ver, str) is not True:
+        raise TypeError("'fw_ver' should be string, '2208' or '2212b'")
+    if fw_ver not in ("2208", "2212b", "2212s"):
+        raise ValueError("Firmware version is not recognized.")
 
-    # read data by 32 bit words
-    rawFile = np.fromfile(filename, dtype=np.uint32)
-    # lowest 28 bits are the timestamp; convert to ps
-    data = (rawFile & 0xFFFFFFF).astype(int) % 140
-    # mask nonvalid data with '-1'; 0x80000000 - the 31st, validity bin
-    data[np.where(rawFile < 0x80000000)] = -1
-    # number of acquisition cycles
-    cycles = int(len(data) / timestamps / 256)
+    files = glob.glob(os.path.join(path, "*.dat*"))
+    if files == []:
+        raise FileNotFoundError("No data files found in {}".format(path))
+
+    counts = np.zeros(256 * 140, dtype=np.longlong)
+    for file in files:
+        counts += _code_counts(file, timestamps, fw_ver, chunk_cycles)
+
+    _save_cal_mat(_cal_mat(counts), os.path.join(path, "Calibration_data"))
+
+
+def calibrate_update(
+    path,
+    path_state,
+    board_number: str,
+    timestamps: int = 512,
+    fw_ver: str = "2212b",
+    threshold: float = 1e7,
+    chunk_cycles: int = 100,
+):
+    """Update calibration data of a board with new data.
+
+    Populations of the 140 TDC codes in each pixel are kept for the
+    board in the 'path_state' folder and updated with valid timestamps
+    from the data files in 'path', so that any acquisition, not only a
+    dedicated one with ambient light, adds to the calibration. Data
+    files that were already used are skipped. Once the number of
+    timestamps collected since the last saved calibration matrix
+    reaches 'threshold', a new matrix is calculated from all the
+    collected data and saved in 'path_state' as a new version,
+    'Calibration_data_{board_number}_v{version}.csv', together with a
+    '.npy' copy. Comparing the versions shows the drift of the
+    calibration in time; 'calibrate_load' with 'path_state' loads the
+    latest version.
+
+    Parameters
+    ----------
+    path : str
+        Path to the data files.
+    path_state : str
+        Path to the folder with the populations of the TDC codes and
+        the versions of the calibration matrix. Created if it does not
+        exist.
+    board_number : str
+        The LinoSPAD2 board number.
+    timestamps : int, optional
+        Number of timestamps per acquisition cycle per pixel. The
+        default is 512.
+    fw_ver : str, optional
+        LinoSPAD2 firmware version, see 'calibrate_save'. The default is
+        "2212b".
+    threshold : float, optional
+        Number of new timestamps after which a new version of the
+        calibration matrix is saved. The default is 1e7.
+    chunk_cycles : int, optional
+        Number of acquisition cycles read at once. The default is 100.
+
+    Raises
+    ------
+    TypeError
+        Raised when 'board_number' or 'fw_ver' is not a string.
+    ValueError
+        Raised when the firmware version is not recognized.
 
-    data_matrix = (
-        data.reshape(cycles, 256, timestamps)
-        .transpose((1, 0, 2))
-        .reshape(256, timestamps * cycles)
+    Returns
+    -------
+    file_cal_mat : str or None
+        Path to the '.csv' file with the new version of the calibration
+        matrix, None if no new version was saved.
+
+    """
+    # parameter type check
+    if isinstance(board_number, str) is not True:
+        raise TypeError("'board_number' should be string, 'NL11' or 'A5'")
+    if isinstance(fw_ver, str) is not True:
+        raise TypeError("'fw_ver' should be string, '2208' or '2212b'")
+    if fw_ver not in ("2208", "2212b", "2212s"):
+        raise ValueError("Firmware version is not recognized.")
+
+    os.makedirs(path_state, exist_ok=True)
+    file_state = os.path.join(
+        path_state, "Calibration_state_{}.npz".format(board_number)
+    )
+
+    # populations of the TDC codes, number of timestamps at the last
+    # saved version, and data files that were already used
+    if os.path.isfile(file_state):
+        with np.load(file_state) as state:
+            counts = state["counts"]
+            counts_saved = int(state["counts_saved"])
+            version = int(state["version"])
+            files_used = list(state["files_used"])
+    else:
+        counts = np.zeros(256 * 140, dtype=np.longlong)
+        counts_saved = 0
+        version = 0
+        files_used = []
+
+    for file in sorted(glob.glob(os.path.join(path, "*.dat*"))):
+        stat = os.stat(file)
+        file_id = "{}:{}:{}".format(
+            os.path.abspath(file), stat.st_size, stat.st_mtime_ns
+        )
+        if file_id in files_used:
+            continue
+        counts += _code_counts(file, timestamps, fw_ver, chunk_cycles)
+        files_used.append(file_id)
+
+    file_cal_mat = None
+    if counts.sum() - counts_saved >= threshold:
+        version += 1
+        file_cal_mat = os.path.join(
+            path_state,
+            "Calibration_data_{}_v{:04d}".format(board_number, version),
+        )
+        _save_cal_mat(_cal_mat(counts), file_cal_mat)
+        file_cal_mat += ".csv"
+        counts_saved = counts.sum()
+
+    # state is replaced at once, so that it is not lost if interrupted
+    file_tmp = os.path.join(
+        path_state, "Calibration_state_{}.tmp.npz".format(board_number)
+    )
+    np.savez(
+        file_tmp,
+        counts=counts,
+        counts_saved=counts_saved,
+        version=version,
+        files_used=np.array(files_used, dtype=str),
     )
+    os.replace(file_tmp, file_state)
+
+    return file_cal_mat
 
-    # calibration matrix
-    cal_mat = np.zeros((256, 140))
-    bins = np.arange(0, 141, 1)
 
-    for i in range(256):
-        # sort the data into 140 bins
-        counts, bin_edges = np.histogram(data_matrix[i], bins=bins)
-        # redefine the bin edges using the bin population from above
-        cal_mat[i] = np.cumsum(counts) / np.cumsum(counts).max() * 2500
+def _cal_mat(counts):
+    """Calculate the calibration matrix from populations of TDC codes.
+
+    Parameters
+    ----------
+    counts : ndarray
+        Flat array of populations of 256 pixels x 140 TDC codes.
+
+    Returns
+    -------
+    cal_mat : ndarray
+        Matrix of 256x140 with the calibrated data.
+
+    """
+    # redefine the bin edges using the bin population
+    counts = np.cumsum(counts.reshape(256, 140), axis=1)
+
+    return counts / counts.max(axis=1, keepdims=True) * 2500
+
+
+def _save_cal_mat(cal_mat, file_name: str):
+    """Save the calibration matrix as a '.csv' table and a '.npy' file.
+
+    Parameters
+    ----------
+    cal_mat : ndarray
+        Matrix of 256x140 with the calibrated data.
+    file_name : str
+        Path to the output files without the extension.
+
+    Returns
+    -------
+    None.
+
+    """
+    # imported here, so that importing 'unpack' does not load pandas
+    import pandas as pd
+
     cal_mat_df = pd.DataFrame(cal_mat)
-    cal_mat_df.to_csv("Calibration_data.csv")
+    cal_mat_df.to_csv("{}.csv".format(file_name))
+    # binary copy for fast loading
+    np.save("{}.npy".format(file_name), cal_mat)
+
+
+def _code_counts(file, timestamps: int, fw_ver: str, chunk_cycles: int):
+    """Count valid timestamps of each TDC code in each pixel.
+
+    Parameters
+    ----------
+    file : str
+        '.dat' data file.
+    timestamps : int
+        Number of timestamps per acquisition cycle per pixel.
+    fw_ver : str
+        LinoSPAD2 firmware version, "2208", "2212b" or "2212s".
+    chunk_cycles : int
+        Number of acquisition cycles read at once.
+
+    Returns
+    -------
+    counts : ndarray
+        Flat array of populations of 256 pixels x 140 TDC codes.
+
+    """
+    rows = 256 if fw_ver == "2208" else 65
+
+    # read data by 32 bit words
+    rawFile = np.memmap(file, dtype=np.uint32, mode="r")
+    # number of acquisition cycles
+    cycles = int(len(rawFile) / timestamps / rows)
+    rawFile = rawFile[: cycles * rows * timestamps].reshape(
+        cycles, rows, timestamps
+    )
+
+    counts = np.zeros(256 * 140, dtype=np.longlong)
+    for start in range(0, cycles, chunk_cycles):
+        raw = np.asarray(rawFile[start : start + chunk_cycles])
+        if fw_ver == "2208":
+            pixels = np.arange(256).reshape(1, -1, 1)
+        else:
+            # cut the 65th TDC that does not hold any actual data from
+            # pixels; pix adress in the given TDC is 2 bits above
+            # timestamp
+            raw = raw[:, :-1]
+            pixels = np.arange(64).reshape(1, -1, 1) * 4 + (raw >> 28 & 0x3)
+        # 0x80000000 - the 31st, validity bit
+        valid = raw >= 0x80000000
+        # lowest 28 bits are the timestamp, 140 codes per clock cycle
+        codes = (raw & 0xFFFFFFF) % 140
+        counts += np.bincount(
+            (pixels * 140 + codes)[valid], minlength=256 * 140
+        )
+
+    return counts
 
 
 def calibrate_load(path, board_number: str):
     """Load the calibration data.
 
+    The matrix is parsed from the '.csv' table once per process and
+    then reused, until the table is modified. If a '.npy' file with the
+    same name as the table (e.g., saved by 'calibrate_save') is present
+    and not older than the table, the matrix is loaded from it instead
+    of parsing the table.
+
     Parameters
     ----------
     path : str
@@ -79,17 +328,35 @@ def calibrate_load(path, board_number: str):
     Returns
     -------
     data_matrix : ndarray
-        Matrix of 256x140 with the calibrated data.
+        Matrix of 256x140 with the calibrated data. The matrix is shared
+        between calls and is read-only.
 
     """
-    path_to_back = os.getcwd()
-    os.chdir(path)
+    # latest version, if there are several
+    file = sorted(
+        glob.glob(os.path.join(path, "*{}*.csv".format(board_number)))
+    )
+    if file == []:
+        raise FileNotFoundError(
+            "No calibration data for the board {} found in {}".format(
+                board_number, path
+            )
+        )
+    file = os.path.abspath(file[-1])
+    mtime = os.path.getmtime(file)
 
-    file = glob.glob("*{}*".format(board_number))[0]
+    key = (file, board_number)
+    if key in _cal_mats and _cal_mats[key][0] == mtime:
+        return _cal_mats[key][1]
 
-    data_matrix = np.genfromtxt(file, delimiter=",", skip_header=1)
-    data_matrix = np.delete(data_matrix, 0, axis=1)
+    file_npy = os.path.splitext(file)[0] + ".npy"
+    if os.path.isfile(file_npy) and os.path.getmtime(file_npy) >= mtime:
+        data_matrix = np.load(file_npy)
+    else:
+        data_matrix = np.genfromtxt(file, delimiter=",", skip_header=1)
+        data_matrix = np.delete(data_matrix, 0, axis=1)
 
-    os.chdir(path_to_back)
+    data_matrix.setflags(write=False)
+    _cal_mats[key] = (mtime, data_matrix)
 
     return data_matrix
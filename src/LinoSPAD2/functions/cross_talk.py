@@ -17,13 +17,11 @@ functions:
 
 import glob
 import os
+from functools import partial
 
 import numpy as np
-import pandas as pd
-from matplotlib import pyplot as plt
-from scipy.stats import sem
-from tqdm import tqdm
 
+# pandas, matplotlib, scipy and tqdm are imported on first use
 from LinoSPAD2.functions import calc_diff as cd
 from LinoSPAD2.functions import unpack as f_up
 
@@ -35,6 +33,9 @@ def collect_ct(
     board_number: str,
     timestamps: int = 512,
     delta_window: float = 10e3,
+    workers: int = 1,
+    cache_dir: str = None,
+    path_out: str = None,
 ):
     """Calculate cross-talk and save it to a '.csv' file.
 
@@ -42,8 +43,7 @@ def collect_ct(
     where all timestamp differences are calculated for the first pixel
     in the range. Works with firmware version "2212b". The
     output is saved as a '.csv' file in the folder "/cross_talk_data",
-    which is created if it does not exist, in the same folder where
-    datafiles are located.
+    which is created if it does not exist, in 'path_out'.
 
     Parameters
     ----------
@@ -59,12 +59,31 @@ def collect_ct(
     delta_window : float, optional
         A width of a window in which the number of timestamp differences
         are counted. The default value is 10e3 (10ns).
+    workers : int, optional
+        Number of processes for processing data files in parallel. The
+        default is 1.
+    cache_dir : str, optional
+        Folder for caching unpacked data files, see 'unpack_bin_sparse'.
+        The default is None, in which case no cache is used.
+    path_out : str, optional
+        Path to the folder where the output is saved. The default is
+        None, in which case 'path' is used.
+
+    Raises
+    ------
+    TypeError
+        Raised when 'board_number' is not a string.
+    FileNotFoundError
+        Raised when no data files are found.
 
     Returns
     -------
     None.
 
     """
+    import pandas as pd
+    from tqdm import tqdm
+
     # parameter type check
     if isinstance(board_number, str) is not True:
         raise TypeError(
@@ -80,51 +99,47 @@ def collect_ct(
     deltas_list = []
     ct_list = []
 
-    os.chdir(path)
-
-    files = glob.glob("*.dat*")
-
-    pix_coor = np.arange(256).reshape(64, 4)
-    for i, file in enumerate(tqdm(files)):
-        data_all = f_up.unpack_bin(file, board_number, timestamps)
-
-        tdc1, pix_c1 = np.argwhere(pix_coor == pixels[0])[0]
-        pix1 = np.where(data_all[tdc1].T[0] == pix_c1)[0]
-        data1 = data_all[tdc1].T[1][pix1]
-
-        cycle_ends = np.argwhere(data_all[0].T[0] == -2)
-        cycle_ends = np.insert(cycle_ends, 0, 0)
-        for j in range(1, len(pixels)):
-            if pixels[j] <= pixels[0]:
-                continue
-
-            tdc2, pix_c2 = np.argwhere(pix_coor == pixels[j])[0]
-            pix2 = np.where(data_all[tdc2].T[0] == pix_c2)[0]
-
-            data2 = data_all[tdc2].T[1][pix2]
-
-            deltas = cd.calc_diff_2212(data1, data2, cycle_ends, delta_window)
-
-            timestamps_pix1 = len(np.where(data1 > 0)[0])
-            if timestamps_pix1 == 0:
-                continue
-            timestamps_pix2 = len(np.where(data2 > 0)[0])
-
-            ct = len(deltas) * 100 / (timestamps_pix1 + timestamps_pix2)
+    if path_out is None:
+        path_out = path
+
+    files = glob.glob(os.path.join(path, "*.dat*"))
+    if files == []:
+        raise FileNotFoundError("No data files found in {}".format(path))
+    file_names = [os.path.basename(file) for file in files]
+
+    # Files are processed in a pool of processes if requested, results
+    # come back in the order of the files
+    ct_files = f_up.map_files(
+        partial(
+            _ct_file,
+            pixels=pixels,
+            board_number=board_number,
+            timestamps=timestamps,
+            delta_window=delta_window,
+            cache_dir=cache_dir,
+        ),
+        files,
+        workers,
+    )
 
+    for file, ct_rows in tqdm(zip(file_names, ct_files), total=len(files)):
+        for pix2, timestamps_pix1, timestamps_pix2, deltas, ct in ct_rows:
             file_name_list.append(file)
             pix1_list.append(pixels[0])
-            pix2_list.append(pixels[j])
+            pix2_list.append(pix2)
             timestamps_list1.append(timestamps_pix1)
             timestamps_list2.append(timestamps_pix2)
-            deltas_list.append(len(deltas))
+            deltas_list.append(deltas)
             ct_list.append(ct)
 
+    path_ct = os.path.join(path_out, "cross_talk_data")
+    ct_file = os.path.join(
+        path_ct, "CT_data_{}-{}.csv".format(file_names[0], file_names[-1])
+    )
+
     print(
         "\n> > > Saving data as 'CT_data_{}-{}.csv' in"
-        " {path} < < <\n".format(
-            files[0], files[-1], path=path + "/cross_talk_data"
-        )
+        " {path} < < <\n".format(file_names[0], file_names[-1], path=path_ct)
     )
 
     dic = {
@@ -139,36 +154,98 @@ def collect_ct(
 
     ct_data = pd.DataFrame(dic)
 
-    try:
-        # os.chdir(path + "/cross_talk_data")
-        os.chdir("cross_talk_data")
-    except FileNotFoundError:
-        # os.makedirs("{}".format(path + "/cross_talk_data"))
-        os.makedirs("{}".format("cross_talk_data"))
-        # os.chdir(path + "/cross_talk_data")
-        os.chdir("cross_talk_data")
+    os.makedirs(path_ct, exist_ok=True)
 
-    if glob.glob("*CT_data_{}-{}.csv*".format(files[0], files[-1])) == []:
-        ct_data.to_csv(
-            "CT_data_{}-{}.csv".format(files[0], files[-1]),
-            index=False,
-        )
+    if not os.path.isfile(ct_file):
+        ct_data.to_csv(ct_file, index=False)
     else:
         ct_data.to_csv(
-            "CT_data_{}-{}.csv".format(files[0], files[-1]),
+            ct_file,
             # mode="a",
             index=False,
             # header=False,
         )
 
 
-def plot_ct(path, pix1, scale: str = "linear"):
+def _ct_file(
+    file,
+    pixels,
+    board_number: str,
+    timestamps: int,
+    delta_window: float,
+    cache_dir: str = None,
+):
+    """Calculate cross-talk for a single data file.
+
+    Parameters
+    ----------
+    file : str
+        Path to the data file.
+    pixels : array-like
+        Array of pixel numbers.
+    board_number : str
+        The LinoSPAD2 daughterboard number.
+    timestamps : int
+        Number of timestamps per pixel per cycle.
+    delta_window : float
+        A width of a window in which the number of timestamp differences
+        are counted.
+    cache_dir : str, optional
+        Folder for caching unpacked data files. The default is None, in
+        which case no cache is used.
+
+    Returns
+    -------
+    ct_rows : list
+        For each pixel compared to the first one: pixel number, number
+        of timestamps in the first and in the second pixel, number of
+        timestamp differences and the cross-talk.
+
+    """
+    tmsp, offsets = f_up.unpack_bin_sparse(
+        file,
+        board_number,
+        "2212b",
+        timestamps,
+        pixels=pixels,
+        cache_dir=cache_dir,
+    )
+
+    ct_rows = []
+    timestamps_pix1 = offsets[pixels[0], -1] - offsets[pixels[0], 0]
+    for j in range(1, len(pixels)):
+        if pixels[j] <= pixels[0]:
+            continue
+
+        if timestamps_pix1 == 0:
+            continue
+
+        deltas = cd.calc_diff_2212(
+            tmsp,
+            tmsp,
+            offsets[pixels[0]],
+            delta_window,
+            cycle_ends2=offsets[pixels[j]],
+        )
+
+        timestamps_pix2 = offsets[pixels[j], -1] - offsets[pixels[j], 0]
+
+        ct = len(deltas) * 100 / (timestamps_pix1 + timestamps_pix2)
+
+        ct_rows.append(
+            (pixels[j], timestamps_pix1, timestamps_pix2, len(deltas), ct)
+        )
+
+    return ct_rows
+
+
+def plot_ct(path, pix1, scale: str = "linear", path_out: str = None):
     """Plot cross-talk data from a '.csv' file.
 
     Plots cross-talk data from a '.csv' file as cross-talk values (in %)
     vs distance in pixels from the given pixel to the right. The plot is
     saved in the folder "/results/cross_talk", which is created if it
-    does not exist, in the same folder where data are located.
+    does not exist, in 'path_out'.
 
     Parameters
     ----------
@@ -180,22 +257,47 @@ def plot_ct(path, pix1, scale: str = "linear"):
         plotted.
     scale : str, optional
         Switch for plot scale: logarithmic or linear. Default is "linear".
+    path_out : str, optional
+        Path to the folder with the "/cross_talk_data" folder, where the
+        plot is saved as well. The default is None, in which case 'path'
+        is used.
+
+    Raises
+    ------
+    FileNotFoundError
+        Raised when no data files or no '.csv' file with the cross-talk
+        data are found.
 
     Returns
     -------
     None.
 
     """
-    print("\n> > > Plotting cross-talk vs distance in pixels < < <\n")
-    os.chdir(path)
-
-    files = glob.glob("*.dat*")
-
-    # os.chdir(path + "/cross_talk_data")
+    import pandas as pd
+    from matplotlib import pyplot as plt
+    from scipy.stats import sem
 
-    os.chdir("cross_talk_data")
-
-    file = glob.glob("*CT_data_{}-{}.csv*".format(files[0], files[-1]))[0]
+    print("\n> > > Plotting cross-talk vs distance in pixels < < <\n")
+    if path_out is None:
+        path_out = path
+
+    files = glob.glob(os.path.join(path, "*.dat*"))
+    if files == []:
+        raise FileNotFoundError("No data files found in {}".format(path))
+    files = [os.path.basename(file) for file in files]
+
+    file = glob.glob(
+        os.path.join(
+            path_out,
+            "cross_talk_data",
+            "*CT_data_{}-{}.csv*".format(files[0], files[-1]),
+        )
+    )
+    if file == []:
+        raise FileNotFoundError(
+            "No cross-talk data found in {}".format(path_out)
+        )
+    file = file[0]
 
     plot_name = "{}_{}".format(files[0], files[-1])
 
@@ -245,10 +347,11 @@ def plot_ct(path, pix1, scale: str = "linear"):
     ax1.set_title("Pixel {}".format(pix1))
     ax1.set_xticks(xticks)
 
-    try:
-        os.chdir("../results/cross_talk")
-    except FileNotFoundError:
-        os.makedirs("../results/cross_talk")
-        os.chdir("../results/cross_talk")
+    path_plot = os.path.join(path_out, "results", "cross_talk")
+    os.makedirs(path_plot, exist_ok=True)
 
-    plt.savefig("{plot}_{pix}.png".format(plot=plot_name, pix=pix1))
+    plt.savefig(
+        os.path.join(
+            path_plot, "{plot}_{pix}.png".format(plot=plot_name, pix=pix1)
+        )
+    )
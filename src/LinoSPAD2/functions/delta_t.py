@@ -8,7 +8,19 @@ functions:
 
     * deltas_save_numpy - unpacks the binary data, calculates timestamp
     differences and saves into a .csv file. Works with firmware versions
-    '2208' and '2212b'.
+    '2208' and '2212b'. Alternatively, only histograms of the timestamp
+    differences are accumulated and saved into a .npz file.
+
+    * deltas_load - load timestamp differences for a single pair of
+    pixels from a .npz file written by 'deltas_save'.
+
+    * hist_update - make sure a '_hist_cache.npz' file with histograms
+    of the timestamp differences in bins of 17.857 ps is up to date,
+    building it from the saved differences if needed.
+
+    * hist_load - load the histogram of timestamp differences for a
+    single pair of pixels from a '_hist_cache.npz' or a '_hist.npz'
+    file.
 
     * delta_cp - collect timestamps from a .csv file and plot them in
     a grid.
@@ -17,13 +29,14 @@ import glob
 import os
 import sys
 import time
-from math import ceil
+import zipfile
+from functools import partial
 
 import numpy as np
-import pandas as pd
-from matplotlib import pyplot as plt
-from tqdm import tqdm
 
+# pandas, matplotlib and tqdm are imported in the functions that use
+# them, so that worker processes and 'deltas_load' start quickly
+from LinoSPAD2.functions import calc_diff as cd
 from LinoSPAD2.functions import unpack as f_up
 
 
@@ -35,14 +48,32 @@ def deltas_save(
     fw_ver: str,
     timestamps: int = 512,
     delta_window: float = 50e3,
+    save_hist: bool = False,
+    reservoir: int = 0,
+    save_npz: bool = False,
+    workers: int = 1,
+    cache_dir: str = None,
+    path_out: str = None,
 ):
     """Calculate and save timestamp differences into '.csv' file.
 
     Unpacks data into a dictionary, calculates timestamp differences for
     the requested pixels, and saves them into a '.csv' table. Works with
-    firmware version 2212. The plot is saved
-    in the 'results' folder, which is created (if it does not already
-    exist) in the same folder where data are.
+    firmware version 2212. The table is saved in the 'delta_ts_data'
+    folder, which is created (if it does not already exist) in
+    'path_out'.
+
+    With 'save_hist', the timestamp differences are not saved. Instead,
+    they are histogrammed on the fly in bins of 17.857 ps for each pair
+    of pixels, and only the counts (and, optionally, a bounded random
+    sample of the differences) are saved into a '_hist.npz' file, so
+    that the output size does not grow with the number of coincidences.
+
+    With 'save_npz', the timestamp differences are saved into a binary
+    '.npz' file instead, where differences from each data file are
+    appended as a separate array for each pair of pixels. Differences
+    for a single pair can be loaded with 'deltas_load' without reading
+    the whole file.
 
     Parameters
     ----------
@@ -64,6 +95,26 @@ def deltas_save(
     delta_window : float, optional
         Size of a window to which timestamp differences are compared.
         Differences in that window are saved. The default is 50e3 (50 ns).
+    save_hist : bool, optional
+        Switch for saving histograms of the timestamp differences into
+        a '.npz' file instead of the differences themselves. The
+        default is False.
+    reservoir : int, optional
+        Maximum number of timestamp differences per pair of pixels that
+        are randomly sampled and saved together with the histograms,
+        used only with 'save_hist'. The default is 0.
+    save_npz : bool, optional
+        Switch for saving the timestamp differences into a binary '.npz'
+        file instead of a '.csv' one. The default is False.
+    workers : int, optional
+        Number of processes for processing data files in parallel. The
+        default is 1.
+    cache_dir : str, optional
+        Folder for caching unpacked data files, see 'unpack_bin_sparse'.
+        The default is None, in which case no cache is used.
+    path_out : str, optional
+        Path to the folder where the output is saved. The default is
+        None, in which case 'path' is used.
 
     Raises
     ------
@@ -72,11 +123,16 @@ def deltas_save(
         are accepted. First error is raised so that the plot does not
         accidentally gets rewritten in the case no clear input was
         given.
+    FileNotFoundError
+        Raised when no data files are found.
 
     Returns
     -------
     None.
     """
+    import pandas as pd
+    from tqdm import tqdm
+
     # parameter type check
     if isinstance(fw_ver, str) is not True:
         raise TypeError("'fw_ver' should be string, '2212b' or '2208'")
@@ -86,133 +142,403 @@ def deltas_save(
         raise TypeError(
             "'board_number' should be string, either 'NL11' or 'A5'"
         )
-    os.chdir(path)
+    if path_out is None:
+        path_out = path
 
-    files_all = glob.glob("*.dat*")
+    files_all = glob.glob(os.path.join(path, "*.dat*"))
+    if files_all == []:
+        raise FileNotFoundError("No data files found in {}".format(path))
 
-    out_file_name = files_all[0][:-4] + "-" + files_all[-1][:-4]
+    out_file_name = (
+        os.path.basename(files_all[0])[:-4]
+        + "-"
+        + os.path.basename(files_all[-1])[:-4]
+    )
+    if save_hist is True:
+        out_file = "{}_hist.npz".format(out_file_name)
+    elif save_npz is True:
+        out_file = "{}.npz".format(out_file_name)
+    else:
+        out_file = "{}.csv".format(out_file_name)
+    path_deltas = os.path.join(path_out, "delta_ts_data")
+    out_file = os.path.join(path_deltas, out_file)
 
     # check if csv file exists and if it should be rewrited
-    try:
-        os.chdir("delta_ts_data")
-        if os.path.isfile("{name}.csv".format(name=out_file_name)):
-            if rewrite is True:
-                print(
-                    "\n! ! ! csv file with timestamps differences already "
-                    "exists and will be rewritten ! ! !\n"
-                )
-                for i in range(5):
-                    print(
-                        "\n! ! ! Deleting the file in {} ! ! !\n".format(5 - i)
-                    )
-                    time.sleep(1)
-                os.remove("{}.csv".format(out_file_name))
-            else:
-                sys.exit(
-                    "\n csv file already exists, 'rewrite' set to"
-                    "'False', exiting."
-                )
-        os.chdir("..")
-    except FileNotFoundError:
-        pass
+    if os.path.isfile(out_file):
+        if rewrite is True:
+            print(
+                "\n! ! ! csv file with timestamps differences already "
+                "exists and will be rewritten ! ! !\n"
+            )
+            for i in range(5):
+                print("\n! ! ! Deleting the file in {} ! ! !\n".format(5 - i))
+                time.sleep(1)
+            os.remove(out_file)
+        else:
+            sys.exit(
+                "\n csv file already exists, 'rewrite' set to"
+                "'False', exiting."
+            )
 
     # Collect the data for the required pixels
     print(
         "\n> > > Collecting data for delta t plot for the requested "
         "pixels and saving it to .csv in a cycle < < <\n"
     )
-    if fw_ver == "2212s":
-        # for transforming pixel number into TDC number + pixel
-        # coordinates in that TDC
-        pix_coor = np.arange(256).reshape(4, 64).T
-    elif fw_ver == "2212b":
-        pix_coor = np.arange(256).reshape(64, 4)
-    else:
+    if fw_ver not in ("2212s", "2212b"):
         print("\nFirmware version is not recognized.")
         sys.exit()
 
-    for i in tqdm(range(ceil(len(files_all))), desc="Collecting data"):
-        file = files_all[i]
+    # Histograms and random samples of timestamp differences, collected
+    # over all files
+    hist_all = {}
+    sample_all = {}
+    rng = np.random.default_rng()
+    # bins depend on the window only, and are saved even if there are
+    # no pairs of pixels
+    _, bin_edges = cd.calc_hist_2212([], delta_window)
+
+    # Files are processed in a pool of processes if requested, results
+    # come back in the order of the files
+    deltas_files = f_up.map_files(
+        partial(
+            _deltas_file,
+            pixels=pixels,
+            board_number=board_number,
+            fw_ver=fw_ver,
+            timestamps=timestamps,
+            delta_window=delta_window,
+            cache_dir=cache_dir,
+        ),
+        files_all,
+        workers,
+    )
 
-        # Prepare a dictionary for output
-        deltas_all = {}
+    for i, deltas_all in enumerate(
+        tqdm(deltas_files, total=len(files_all), desc="Collecting data")
+    ):
+
+        if save_hist is True:
+            for pair, deltas in deltas_all.items():
+                counts = cd.calc_hist_2212(deltas, delta_window)[0]
+                if pair in hist_all:
+                    hist_all[pair] += counts
+                else:
+                    hist_all[pair] = counts
+                # differences seen before are taken from the histogram,
+                # as all differences in the window are in its range
+                if reservoir > 0:
+                    sample_all["{}_sample".format(pair)] = _sample_update(
+                        sample_all.get("{}_sample".format(pair)),
+                        deltas,
+                        hist_all[pair].sum() - len(deltas),
+                        reservoir,
+                        rng,
+                    )
+            # Save the histograms after each file so data is not lost
+            # in the case of failure close to the end
+            os.makedirs(path_deltas, exist_ok=True)
+            np.savez(
+                out_file,
+                bin_edges=bin_edges,
+                **hist_all,
+                **sample_all,
+            )
+            continue
+
+        if save_npz is True:
+            # Append arrays of the current file so data is not lost in
+            # the case of failure close to the end
+            os.makedirs(path_deltas, exist_ok=True)
+            with zipfile.ZipFile(out_file, mode="a") as store:
+                for pair, deltas in deltas_all.items():
+                    with store.open(
+                        "{}/{}.npy".format(pair, i), mode="w", force_zip64=True
+                    ) as member:
+                        np.lib.format.write_array(member, deltas)
+            continue
 
-        # Unpack data for the requested pixels into dictionary
-        data_all = f_up.unpack_bin(file, board_number, timestamps)
-
-        # Calculate and collect timestamp differences
-        for q in pixels:
-            for w in pixels:
-                if w <= q:
-                    continue
-                deltas_all["{},{}".format(q, w)] = []
-                # find end of cycles
-                cycler = np.argwhere(data_all[0].T[0] == -2)
-                cycler = np.insert(cycler, 0, 0)
-                # first pixel in the pair
-                tdc1, pix_c1 = np.argwhere(pix_coor == q)[0]
-                pix1 = np.where(data_all[tdc1].T[0] == pix_c1)[0]
-                # second pixel in the pair
-                tdc2, pix_c2 = np.argwhere(pix_coor == w)[0]
-                pix2 = np.where(data_all[tdc2].T[0] == pix_c2)[0]
-                # get timestamp for both pixels in the given cycle
-                for cyc in range(len(cycler) - 1):
-                    pix1_ = pix1[
-                        np.logical_and(
-                            pix1 > cycler[cyc], pix1 < cycler[cyc + 1]
-                        )
-                    ]
-                    if not np.any(pix1_):
-                        continue
-                    pix2_ = pix2[
-                        np.logical_and(
-                            pix2 > cycler[cyc], pix2 < cycler[cyc + 1]
-                        )
-                    ]
-                    if not np.any(pix2_):
-                        continue
-                    # calculate delta t
-                    tmsp1 = data_all[tdc1].T[1][
-                        pix1_[np.where(data_all[tdc1].T[1][pix1_] > 0)[0]]
-                    ]
-                    tmsp2 = data_all[tdc2].T[1][
-                        pix2_[np.where(data_all[tdc2].T[1][pix2_] > 0)[0]]
-                    ]
-                    for t1 in tmsp1:
-                        deltas = tmsp2 - t1
-                        ind = np.where(np.abs(deltas) < delta_window)[0]
-                        deltas_all["{},{}".format(q, w)].extend(deltas[ind])
         # Save data as a .csv file in a cycle so data is not lost
         # in the case of failure close to the end
         data_for_plot_df = pd.DataFrame.from_dict(deltas_all, orient="index")
         del deltas_all
         data_for_plot_df = data_for_plot_df.T
-        try:
-            os.chdir("delta_ts_data")
-        except FileNotFoundError:
-            os.mkdir("delta_ts_data")
-            os.chdir("delta_ts_data")
-        csv_file = glob.glob("*{}.csv*".format(out_file_name))
-        if csv_file != []:
+        os.makedirs(path_deltas, exist_ok=True)
+        if os.path.isfile(out_file):
             data_for_plot_df.to_csv(
-                "{}.csv".format(out_file_name),
+                out_file,
                 mode="a",
                 index=False,
                 header=False,
             )
         else:
-            data_for_plot_df.to_csv(
-                "{}.csv".format(out_file_name), index=False
-            )
-        os.chdir("..")
+            data_for_plot_df.to_csv(out_file, index=False)
 
     print(
-        "\n> > > Timestamp differences are saved as {file}.csv in "
+        "\n> > > Timestamp differences are saved as {file} in "
         "{path} < < <".format(
-            file=out_file_name,
-            path=path + "\delta_ts_data",
+            file=os.path.basename(out_file),
+            path=path_deltas,
+        )
+    )
+
+
+def _deltas_file(
+    file,
+    pixels,
+    board_number: str,
+    fw_ver: str,
+    timestamps: int,
+    delta_window: float,
+    cache_dir: str = None,
+):
+    """Calculate timestamp differences for all pairs of pixels in a file.
+
+    Parameters
+    ----------
+    file : str
+        Path to the data file.
+    pixels : list
+        List of pixel numbers.
+    board_number : str
+        The LinoSPAD2 daughterboard number.
+    fw_ver : str
+        LinoSPAD2 firmware version.
+    timestamps : int
+        Number of timestamps per acquisition cycle per pixel.
+    delta_window : float
+        Size of a window to which timestamp differences are compared.
+    cache_dir : str, optional
+        Folder for caching unpacked data files. The default is None, in
+        which case no cache is used.
+
+    Returns
+    -------
+    deltas_all : dict
+        Timestamp differences for each pair of pixels, where keys are
+        "q,w" strings.
+
+    """
+    # Unpack data for the requested pixels into a per-pixel index
+    tmsp, offsets = f_up.unpack_bin_sparse(
+        file,
+        board_number,
+        fw_ver,
+        timestamps,
+        pixels=pixels,
+        cache_dir=cache_dir,
+    )
+
+    # Calculate and collect timestamp differences for all pairs of
+    # pixels in a single pass
+    deltas_pairs = cd.calc_diff_2212_pairs(tmsp, offsets, pixels, delta_window)
+
+    return {
+        "{},{}".format(q, w): deltas for (q, w), deltas in deltas_pairs.items()
+    }
+
+
+def deltas_load(file_name: str, pix_pair: list):
+    """Load timestamp differences for a pair of pixels from '.npz' file.
+
+    Only the arrays of the requested pair of pixels are read from the
+    file written by 'deltas_save' with 'save_npz'.
+
+    Parameters
+    ----------
+    file_name : str
+        Path to the '.npz' file with timestamp differences.
+    pix_pair : list
+        Two pixel numbers for which timestamp differences are loaded.
+
+    Raises
+    ------
+    ValueError
+        Raised when no data for the requested pair of pixels was found
+        in the file.
+
+    Returns
+    -------
+    deltas : ndarray
+        Timestamp differences for the pair of pixels from all data
+        files.
+
+    """
+    pair = "{},{}".format(pix_pair[0], pix_pair[1])
+
+    with zipfile.ZipFile(file_name) as store:
+        # arrays are named 'pair/file_index.npy'
+        names = [
+            name for name in store.namelist() if name.split("/")[0] == pair
+        ]
+        if names == []:
+            raise ValueError(
+                "No data for the pixel pair {} in {}".format(pair, file_name)
+            )
+        names.sort(key=lambda name: int(name.split("/")[1][:-4]))
+
+        deltas = []
+        for name in names:
+            with store.open(name) as member:
+                deltas.append(np.lib.format.read_array(member))
+
+    return np.concatenate(deltas)
+
+
+def hist_update(path_deltas, file_name: str):
+    """Update the histograms of timestamp differences.
+
+    Histograms of the timestamp differences of all pairs of pixels in
+    bins of 17.857 ps (average LinoSPAD2 TDC bin width) are kept in the
+    '_hist_cache.npz' file. If the file does not exist or is older than
+    the '.npz' or the '.csv' file with the timestamp differences, the
+    differences are read once from the newer of these files and the
+    histograms are calculated and saved. Histograms with coarser bins
+    or a narrower range are then derived with 'rebin_hist_2212',
+    without reading the differences again. If there are no timestamp
+    differences, the '_hist.npz' file saved by 'deltas_save' with
+    'save_hist' is used instead; that file is never modified.
+
+    Parameters
+    ----------
+    path_deltas : str
+        Path to the folder with timestamp differences.
+    file_name : str
+        Name of the file with timestamp differences without the
+        extension.
+
+    Raises
+    ------
+    FileNotFoundError
+        Raised when neither the histograms nor the timestamp differences
+        are found.
+
+    Returns
+    -------
+    hist_file : str
+        Path to the '_hist_cache.npz' or the '_hist.npz' file.
+
+    """
+    hist_file = os.path.join(
+        path_deltas, "{}_hist_cache.npz".format(file_name)
+    )
+
+    # if both the '.npz' and the '.csv' files exist, the differences
+    # are taken from the one saved last
+    sources = [
+        os.path.join(path_deltas, "{}.{}".format(file_name, ext))
+        for ext in ("npz", "csv")
+    ]
+    sources = [source for source in sources if os.path.isfile(source)]
+    if sources == []:
+        hist_saved = os.path.join(path_deltas, "{}_hist.npz".format(file_name))
+        if os.path.isfile(hist_saved):
+            return hist_saved
+        raise FileNotFoundError(
+            "No timestamp differences found in {}".format(path_deltas)
         )
+    source = max(sources, key=os.path.getmtime)
+    if os.path.isfile(hist_file) and os.path.getmtime(
+        hist_file
+    ) >= os.path.getmtime(source):
+        return hist_file
+
+    deltas_all = _deltas_read(source, None)
+
+    # same bins for all pairs, wide enough for all differences
+    delta_max = [np.max(np.abs(d)) for d in deltas_all.values() if len(d)]
+    delta_window = max(delta_max, default=0) + 17.857
+    _, bin_edges = cd.calc_hist_2212([], delta_window)
+    hist_all = {
+        pair: cd.calc_hist_2212(deltas, delta_window)[0]
+        for pair, deltas in deltas_all.items()
+    }
+
+    # file is replaced at once, so that it is never read half-written
+    hist_tmp = os.path.join(
+        path_deltas, "{}_hist_cache.tmp.npz".format(file_name)
     )
+    np.savez(hist_tmp, bin_edges=bin_edges, **hist_all)
+    os.replace(hist_tmp, hist_file)
+
+    return hist_file
+
+
+def hist_load(file_name: str, pix_pair: list):
+    """Load the histogram of timestamp differences for a pair of pixels.
+
+    Parameters
+    ----------
+    file_name : str
+        Path to the '_hist_cache.npz' or the '_hist.npz' file, see
+        'hist_update'.
+    pix_pair : list
+        Two pixel numbers for which the histogram is loaded.
+
+    Raises
+    ------
+    ValueError
+        Raised when no histogram for the requested pair of pixels was
+        found in the file.
+
+    Returns
+    -------
+    counts : ndarray
+        Number of timestamp differences in each bin.
+    bin_edges : ndarray
+        Edges of the bins in ps.
+
+    """
+    pair = "{},{}".format(pix_pair[0], pix_pair[1])
+
+    with np.load(file_name) as hist:
+        if pair not in hist.files:
+            raise ValueError(
+                "No data for the pixel pair {} in {}".format(pair, file_name)
+            )
+        return hist[pair], hist["bin_edges"]
+
+
+def _sample_update(sample, deltas, seen: int, size: int, rng):
+    """Update a bounded random sample of timestamp differences.
+
+    Reservoir sampling: after the update, each timestamp difference seen
+    so far is in the sample with equal probability.
+
+    Parameters
+    ----------
+    sample : array-like or None
+        Current sample, None if empty.
+    deltas : array-like
+        New timestamp differences.
+    seen : int
+        Number of timestamp differences seen before 'deltas'.
+    size : int
+        Maximum size of the sample.
+    rng : numpy.random.Generator
+        Random number generator.
+
+    Returns
+    -------
+    sample : ndarray
+        Updated sample.
+
+    """
+    if sample is None:
+        sample = np.array([], dtype=np.asarray(deltas).dtype)
+
+    # fill the sample first
+    fill = min(size - len(sample), len(deltas))
+    sample = np.concatenate((sample, deltas[:fill]))
+
+    # then replace random elements; the n-th difference replaces an
+    # element with probability size/n
+    rest = deltas[fill:]
+    ind = rng.integers(0, seen + fill + np.arange(1, len(rest) + 1))
+    keep = ind < size
+    sample[ind[keep]] = rest[keep]
+
+    return sample
 
 
 def delta_cp(
@@ -222,11 +548,17 @@ def delta_cp(
     range_left: int = -10e3,
     range_right: int = 10e3,
     same_y: bool = False,
+    path_out: str = None,
 ):
     """Collect and plot timestamp differences from a '.csv' file.
 
     Plots timestamp differences from a '.csv' file as a grid of histograms
-    and as a single plot.
+    and as a single plot. The timestamp differences are taken from the
+    'delta_ts_data' folder and the plot is saved in the 'results/delta_t'
+    folder, both in 'path_out'. Histograms are derived from the
+    histograms in bins of 17.857 ps kept by 'hist_update', so that the
+    differences are read only when they change, and the figure is
+    rendered and saved once at the end.
 
     Parameters
     ----------
@@ -244,51 +576,107 @@ def delta_cp(
         Upper limit for timestamp differences, higher values are not used.
         The default is 10e3.
     same_y : bool, optional
-        Switch for plotting the histograms with the same y-axis.
+        Switch for plotting all histograms with the same y-axis limits.
         The default is False.
+    path_out : str, optional
+        Path to the folder with the timestamp differences, where the
+        plot is saved as well. The default is None, in which case 'path'
+        is used.
 
     Raises
     ------
     TypeError
         Only boolean values of 'rewrite' are accepted. The error is
         raised so that the plot does not accidentally gets rewritten.
+    FileNotFoundError
+        Raised when no data files or no timestamp differences are
+        found.
 
     Returns
     -------
     None.
     """
+    from matplotlib import pyplot as plt
+
     # parameter type check
     if isinstance(rewrite, bool) is not True:
         raise TypeError("'rewrite' should be boolean")
+    if path_out is None:
+        path_out = path
     plt.ioff()
-    os.chdir(path)
 
-    files_all = glob.glob("*.dat*")
-    csv_file_name = files_all[0][:-4] + "-" + files_all[-1][:-4]
+    files_all = glob.glob(os.path.join(path, "*.dat*"))
+    if files_all == []:
+        raise FileNotFoundError("No data files found in {}".format(path))
+    csv_file_name = (
+        os.path.basename(files_all[0])[:-4]
+        + "-"
+        + os.path.basename(files_all[-1])[:-4]
+    )
+    path_deltas = os.path.join(path_out, "delta_ts_data")
+    path_plot = os.path.join(path_out, "results", "delta_t")
+    plot_file = os.path.join(
+        path_plot, "{name}_delta_t_grid.png".format(name=csv_file_name)
+    )
 
     # check if plot exists and if it should be rewrited
-    try:
-        os.chdir("results/delta_t")
-        if os.path.isfile(
-            "{name}_delta_t_grid.png".format(name=csv_file_name)
-        ):
-            if rewrite is True:
-                print(
-                    "\n! ! ! Plot of timestamp differences already"
-                    "exists and will be rewritten ! ! !\n"
-                )
-            else:
-                sys.exit(
-                    "\nPlot already exists, 'rewrite' set to 'False', exiting."
-                )
-        os.chdir("../..")
-    except FileNotFoundError:
-        pass
+    if os.path.isfile(plot_file):
+        if rewrite is True:
+            print(
+                "\n! ! ! Plot of timestamp differences already"
+                "exists and will be rewritten ! ! !\n"
+            )
+        else:
+            sys.exit(
+                "\nPlot already exists, 'rewrite' set to 'False', exiting."
+            )
 
     print(
         "\n> > > Plotting timestamps differences as a grid of histograms < < <"
     )
 
+    # Histograms in bins of 17.857 ps are calculated once and reused,
+    # here they are cut to the range and merged into about 100 bins
+    hist_file = hist_update(path_deltas, csv_file_name)
+
+    hists = {}
+    for q in range(len(pixels)):
+        for w in range(q + 1, len(pixels)):
+            pair = "{},{}".format(pixels[q], pixels[w])
+            try:
+                counts, bin_edges = hist_load(
+                    hist_file, [pixels[q], pixels[w]]
+                )
+            except ValueError:
+                continue
+            counts, bin_edges = cd.rebin_hist_2212(
+                counts, bin_edges, hist_range=(range_left, range_right)
+            )
+            step = max(1, int(np.ceil(len(counts) / 100)))
+            counts, bin_edges = cd.rebin_hist_2212(counts, bin_edges, step)
+            if counts.sum() == 0:
+                print(
+                    "\nCouldn't calculate bins for {} pair: probably not"
+                    "enough delta ts.".format(pair)
+                )
+                continue
+            hists[pair] = (counts, bin_edges)
+
+    # check if the y limits of all plots should be the same
+    if same_y is True:
+        y_max_all = max([n.max() for n, _ in hists.values()], default=0)
+
+    if "Ne" and "540" in path:
+        chosen_color = "seagreen"
+    elif "Ne" and "656" in path:
+        chosen_color = "orangered"
+    elif "Ne" and "585" in path:
+        chosen_color = "goldenrod"
+    elif "Ar" in path:
+        chosen_color = "mediumslateblue"
+    else:
+        chosen_color = "salmon"
+
     plt.rcParams.update({"font.size": 22})
 
     if len(pixels) > 2:
@@ -302,121 +690,115 @@ def delta_cp(
                 x.axes.set_axis_off()
     else:
         fig = plt.figure(figsize=(14, 14))
+        ax = fig.gca()
 
-    # check if the y limits of all plots should be the same
-    if same_y is True:
-        y_max_all = 0
-
-    for q in tqdm(range(len(pixels)), desc="Row in plot"):
+    for q in range(len(pixels)):
         for w in range(len(pixels)):
             if w <= q:
                 continue
             if len(pixels) > 2:
-                axs[q][w - 1].axes.set_axis_on()
-            try:
-                # keep only the required column in memory
-                data_to_plot = pd.read_csv(
-                    "delta_ts_data/{}.csv".format(csv_file_name),
-                    usecols=["{},{}".format(pixels[q], pixels[w])],
-                ).dropna()
-            except ValueError:
-                continue
+                ax = axs[q][w - 1]
+                ax.axes.set_axis_on()
 
-            # prepare the data for plot
-            data_to_plot = np.array(data_to_plot)
-            data_to_plot = np.delete(
-                data_to_plot, np.argwhere(data_to_plot < range_left)
-            )
-            data_to_plot = np.delete(
-                data_to_plot, np.argwhere(data_to_plot > range_right)
-            )
-
-            try:
-                bins = np.linspace(
-                    np.min(data_to_plot),
-                    np.max(data_to_plot),
-                    100,
-                )
-            except ValueError:
-                print(
-                    "\nCouldn't calculate bins for {q}-{w} pair: probably not"
-                    "enough delta ts.".format(q=q, w=w)
-                )
+            pair = "{},{}".format(pixels[q], pixels[w])
+            if pair not in hists:
                 continue
+            n, b = hists[pair]
 
-            if "Ne" and "540" in path:
-                chosen_color = "seagreen"
-            elif "Ne" and "656" in path:
-                chosen_color = "orangered"
-            elif "Ne" and "585" in path:
-                chosen_color = "goldenrod"
-            elif "Ar" in path:
-                chosen_color = "mediumslateblue"
-            else:
-                chosen_color = "salmon"
-
-            if len(pixels) > 2:
-                axs[q][w - 1].set_xlabel("\u0394t [ps]")
-                axs[q][w - 1].set_ylabel("# of coincidences [-]")
-                n, b, p = axs[q][w - 1].hist(
-                    data_to_plot,
-                    bins=bins,
-                    color=chosen_color,
-                )
-            else:
-                plt.xlabel("\u0394t [ps]")
-                plt.ylabel("# of coincidences [-]")
-                n, b, p = plt.hist(
-                    data_to_plot,
-                    bins=bins,
-                    color=chosen_color,
-                )
+            ax.set_xlabel("\u0394t [ps]")
+            ax.set_ylabel("# of coincidences [-]")
+            # precalculated histogram, drawn as the bars of 'hist'
+            ax.hist(b[:-1], bins=b, weights=n, color=chosen_color)
 
             try:
                 peak_max_pos = np.argmax(n).astype(np.intc)
                 # 2 ns window around peak
-                win = int(1000 / ((range_right - range_left) / 100))
-                peak_max = np.sum(n[peak_max_pos - win : peak_max_pos + win])
+                win = int(1000 / (b[1] - b[0]))
+                peak_max = np.sum(
+                    n[max(0, peak_max_pos - win) : peak_max_pos + win]
+                )
             except ValueError:
                 peak_max = None
 
             if same_y is True:
-                try:
-                    y_max = np.max(n)
-                except ValueError:
-                    y_max = 0
-                    print("\nCould not find maximum y value\n")
-                if y_max_all < y_max:
-                    y_max_all = y_max
-                if len(pixels) > 2:
-                    axs[q][w - 1].set_ylim(0, y_max + 4)
-                else:
-                    plt.ylim(0, y_max + 4)
+                ax.set_ylim(0, y_max_all + 4)
 
+            ax.set_xlim(range_left - 100, range_right + 100)
             if len(pixels) > 2:
-                axs[q][w - 1].set_xlim(range_left - 100, range_right + 100)
-                axs[q][w - 1].set_title(
+                ax.set_title(
                     "Pixels {p1},{p2}\nPeak in 2 ns window: {pp}".format(
                         p1=pixels[q], p2=pixels[w], pp=int(peak_max)
                     )
                 )
             else:
-                plt.xlim(range_left - 100, range_right + 100)
-                plt.title(
+                ax.set_title(
                     "Pixels {p1},{p2}".format(p1=pixels[q], p2=pixels[w])
                 )
 
-            try:
-                os.chdir("results/delta_t")
-            except FileNotFoundError:
-                os.makedirs("results/delta_t")
-                os.chdir("results/delta_t")
-            fig.tight_layout()  # for perfect spacing between the plots
-            plt.savefig("{name}_delta_t_grid.png".format(name=csv_file_name))
-            os.chdir("../..")
+    os.makedirs(path_plot, exist_ok=True)
+    fig.tight_layout()  # for perfect spacing between the plots
+    plt.savefig(plot_file)
     print(
         "\n> > > Plot is saved as {file}.png in {path}< < <".format(
             file=csv_file_name + "_delta_t_grid.png",
-            path=path + "results/delta_t",
+            path=path_plot,
         )
     )
+
+
+def _deltas_read(deltas_file, pixels):
+    """Read timestamp differences of all pairs of pixels at once.
+
+    Differences are taken from the '.npz' file written by
+    'deltas_save', or from the '.csv' table, which is then parsed once
+    for all pairs.
+
+    Parameters
+    ----------
+    deltas_file : str
+        Path to the '.npz' or '.csv' file with timestamp differences.
+    pixels : list or None
+        List of pixel numbers. If None, all pairs of pixels in the file
+        are read.
+
+    Returns
+    -------
+    deltas_all : dict
+        Timestamp differences of each pair of pixels that is found,
+        where keys are "q,w" strings.
+
+    """
+    import pandas as pd
+
+    if pixels is not None:
+        pairs = [
+            "{},{}".format(pixels[q], pixels[w])
+            for q in range(len(pixels))
+            for w in range(q + 1, len(pixels))
+        ]
+
+    if deltas_file.endswith(".npz"):
+        if pixels is None:
+            with zipfile.ZipFile(deltas_file) as store:
+                pairs = list(
+                    dict.fromkeys(
+                        name.split("/")[0] for name in store.namelist()
+                    )
+                )
+        deltas_all = {}
+        for pair in pairs:
+            try:
+                deltas_all[pair] = deltas_load(deltas_file, pair.split(","))
+            except ValueError:
+                continue
+        return deltas_all
+
+    columns = pd.read_csv(deltas_file, nrows=0).columns
+    if pixels is None:
+        pairs = list(columns)
+    pairs = [pair for pair in pairs if pair in columns]
+    if pairs == []:
+        return {}
+    data = pd.read_csv(deltas_file, usecols=pairs)
+
+    return {pair: data[pair].dropna().to_numpy() for pair in pairs}
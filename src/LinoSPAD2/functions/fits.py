@@ -7,24 +7,50 @@ functions:
     gaussian function and plot both a histogram of timestamp
     differences and the fit in a single figure.
 
+    * fit_wg_all - fit timestamp differences of many pairs of pixels
+    with a gaussian function in a pool of processes and collect the
+    fit parameters in a single table, optionally plotting each fit.
+
+    * fit_wg_track - follow the position, width and visibility of the
+    peak of timestamp differences in time, fitting histograms of each
+    data file or each chunk of acquisition cycles.
+
 """
 
 import glob
 import os
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
 
 import numpy as np
-import pandas as pd
-from matplotlib import pyplot as plt
-from scipy.optimize import curve_fit
 
-
-def fit_wg(path, pix_pair: list, window: float = 5e3, step: int = 1):
+# pandas, matplotlib and scipy are imported on first use
+from LinoSPAD2.functions import unpack as f_up
+from LinoSPAD2.functions.calc_diff import (
+    calc_diff_2212_pairs,
+    calc_hist_2212,
+    rebin_hist_2212,
+)
+from LinoSPAD2.functions.delta_t import hist_load, hist_update
+
+
+def fit_wg(
+    path,
+    pix_pair: list,
+    window: float = 5e3,
+    step: int = 1,
+    path_out: str = None,
+    fit_mode: str = "ls",
+):
     """Fit with Gaussian function and plot it.
 
     Fits timestamp differences of a pair of pixels with Gaussian
     function and plots it next to the histogram of the differences.
-    Timestamp differences are collected from a '.csv' file with those if
-    such exists.
+    The histogram is derived from the histograms in bins of 17.857 ps
+    kept by 'hist_update' in the 'delta_ts_data' folder, which are
+    calculated from a '.npz' or a '.csv' file with timestamp
+    differences only when those change. The plot is saved in the
+    'results/fits' folder.
 
     Parameters
     ----------
@@ -38,109 +64,829 @@ def fit_wg(path, pix_pair: list, window: float = 5e3, step: int = 1):
     step : int, optional
         Bins of delta t histogram should be in units of 17.857 (average
         LinoSPAD2 TDC bin width). Default is 1.
+    path_out : str, optional
+        Path to the folder with the timestamp differences, where the
+        plot is saved as well. The default is None, in which case 'path'
+        is used.
+    fit_mode : str, optional
+        Fitting method: "ls" for least squares or "poisson" for the
+        maximum likelihood fit of Poisson-distributed counts, which is
+        more accurate for bins with few counts. The default is "ls".
 
     Raises
     ------
+    TypeError
+        Raised when 'fit_mode' is not a string.
+    ValueError
+        Raised when 'fit_mode' is not recognized.
     FileNotFoundError
         Raised when no '.dat' data files are found.
     FileNotFoundError
-        Raised when no '.csv' file with timestamp differences is found.
+        Raised when no '.npz' or '.csv' file with timestamp differences
+        is found.
     ValueError
         Raised when no data for the requested pair of pixels was found
-        in the '.csv' file.
+        in the '.npz' or '.csv' file.
+    ValueError
+        Raised when the fit window holds fewer than 2 bins.
 
     Returns
     -------
     None.
 
     """
+    from matplotlib import pyplot as plt
+
+    # parameter type check
+    if isinstance(fit_mode, str) is not True:
+        raise TypeError("'fit_mode' should be string, 'ls' or 'poisson'")
+    if fit_mode not in ("ls", "poisson"):
+        raise ValueError("Fitting method is not recognized.")
+
     plt.ion()
 
-    def gauss(x, A, x0, sigma, C):
-        return A * np.exp(-((x - x0) ** 2) / (2 * sigma**2)) + C
+    if path_out is None:
+        path_out = path
 
-    os.chdir(path)
+    file_name = _deltas_name(path)
+    path_deltas = os.path.join(path_out, "delta_ts_data")
 
-    files = glob.glob("*.dat*")
-    file_name = files[0][:-4] + "-" + files[-1][:-4]
+    counts, bin_edges = hist_load(
+        hist_update(path_deltas, file_name), pix_pair
+    )
 
-    try:
-        os.chdir("delta_ts_data")
-    except FileNotFoundError:
-        raise ("\nFile with data not found")
+    par, perr, n, b = _fit_hist(counts, bin_edges, window, step, fit_mode)
 
-    csv_file_name = glob.glob("*{}*".format(file_name))[0]
-    if csv_file_name == []:
-        raise FileNotFoundError("\nFile with data not found")
+    _fit_plot(path, n, b, par, perr)
 
-    data = pd.read_csv(
-        "{}".format(csv_file_name),
-        usecols=["{},{}".format(pix_pair[0], pix_pair[1])],
+    path_plot = os.path.join(path_out, "results", "fits")
+    os.makedirs(path_plot, exist_ok=True)
+
+    plt.savefig(
+        os.path.join(
+            path_plot,
+            "{file}_pixels_"
+            "{pix1},{pix2}_fit.png".format(
+                file=file_name, pix1=pix_pair[0], pix2=pix_pair[1]
+            ),
+        )
     )
-    try:
-        data_to_plot = data["{},{}".format(pix_pair[0], pix_pair[1])]
-    except KeyError:
-        print("\nThe requested pixel pair is not found")
-    del data
-    # Check if there any finite values
-    if not np.any(~np.isnan(data_to_plot)):
-        raise ValueError("\nNo data for the requested pixel pair available")
 
-    data_to_plot = data_to_plot.dropna()
-    data_to_plot = np.array(data_to_plot)
-    # Use window of 40 ns for calculating histogram data
-    data_to_plot = np.delete(data_to_plot, np.argwhere(data_to_plot < -20e3))
-    data_to_plot = np.delete(data_to_plot, np.argwhere(data_to_plot > 20e3))
+    plt.pause(0.1)
 
-    os.chdir("..")
-    plt.rcParams.update({"font.size": 22})
 
-    # bins must be in units of 17.857 ps
-    bins = np.arange(np.min(data_to_plot), np.max(data_to_plot), 17.857 * step)
+def fit_wg_all(
+    path,
+    pix_pairs: list = None,
+    window: float = 5e3,
+    step: int = 1,
+    workers: int = 1,
+    plot: bool = False,
+    path_out: str = None,
+    fit_mode: str = "ls",
+):
+    """Fit with Gaussian function for many pairs of pixels.
+
+    Fits timestamp differences of each pair of pixels with Gaussian
+    function in the same way as 'fit_wg'. Histograms of all pairs are
+    loaded at once, see 'hist_update', and the fits are done in a pool
+    of processes if requested. Parameters of the fits are returned as
+    a table and saved as a '.csv' file in the 'results/fits' folder.
+    Pairs for which there is no data or the fit does not converge are
+    kept in the table with NaN values.
 
-    # Calculate histogram of timestamp differences for primary guess
-    # of fit parameters and selecting a narrower window for the fit
-    # n, b, p = plt.hist(data_to_plot, bins=bins, color="teal")
-    # plt.close("all")
-    n, b = np.histogram(data_to_plot, bins)
+    Parameters
+    ----------
+    path : str
+        Path to datafiles.
+    pix_pairs : list, optional
+        Pairs of pixel numbers for which fit is done. The default is
+        None, in which case all pairs with timestamp differences are
+        fitted.
+    window : float, optional
+        Time range in which timestamp differences are fitted. The
+        default is 5e3.
+    step : int, optional
+        Bins of delta t histogram should be in units of 17.857 (average
+        LinoSPAD2 TDC bin width). Default is 1.
+    workers : int, optional
+        Number of processes for fitting in parallel. The default is 1.
+    plot : bool, optional
+        Switch for plotting each fit and saving it in the
+        'results/fits' folder, as 'fit_wg' does. The default is False.
+    path_out : str, optional
+        Path to the folder with the timestamp differences, where the
+        results are saved as well. The default is None, in which case
+        'path' is used.
+    fit_mode : str, optional
+        Fitting method: "ls" for least squares or "poisson" for the
+        maximum likelihood fit of Poisson-distributed counts, which is
+        more accurate for bins with few counts. The default is "ls".
 
-    #
-    try:
-        n_argmax = np.argmax(n)
-        cp_pos = (bins[n_argmax] + bins[n_argmax + 1]) / 2
-    except ValueError:
-        print("Couldn't find position of histogram max")
+    Raises
+    ------
+    TypeError
+        Raised when 'plot' is not boolean or 'fit_mode' is not a
+        string.
+    ValueError
+        Raised when 'fit_mode' is not recognized.
+    FileNotFoundError
+        Raised when no '.dat' data files are found.
+    FileNotFoundError
+        Raised when no '.npz' or '.csv' file with timestamp differences
+        is found.
+    ValueError
+        Raised when no data for one of the requested pairs of pixels
+        was found in the '.npz' or '.csv' file.
+
+    Returns
+    -------
+    fit_data : pandas.DataFrame
+        Parameters of the fits and their errors for each pair of
+        pixels; sigma and mu in ps, visibility in %.
+
+    """
+    import pandas as pd
+
+    # parameter type check
+    if isinstance(plot, bool) is not True:
+        raise TypeError("'plot' should be boolean")
+    if isinstance(fit_mode, str) is not True:
+        raise TypeError("'fit_mode' should be string, 'ls' or 'poisson'")
+    if fit_mode not in ("ls", "poisson"):
+        raise ValueError("Fitting method is not recognized.")
+    if path_out is None:
+        path_out = path
+
+    file_name = _deltas_name(path)
+    path_deltas = os.path.join(path_out, "delta_ts_data")
+    hist_file = hist_update(path_deltas, file_name)
+
+    # histograms of all pairs are read from the file at once
+    with np.load(hist_file) as hist:
+        if pix_pairs is None:
+            pix_pairs = [
+                [int(pix) for pix in pair.split(",")]
+                for pair in hist.files
+                if pair != "bin_edges" and not pair.endswith("_sample")
+            ]
+        bin_edges = hist["bin_edges"]
+        counts_all = []
+        for pix_pair in pix_pairs:
+            pair = "{},{}".format(pix_pair[0], pix_pair[1])
+            if pair not in hist.files:
+                raise ValueError(
+                    "No data for the pixel pair {} in {}".format(
+                        pair, hist_file
+                    )
+                )
+            counts_all.append(hist[pair])
+
+    fit_pair = partial(
+        _fit_hist_safe,
+        bin_edges=bin_edges,
+        window=window,
+        step=step,
+        fit_mode=fit_mode,
+    )
+    # Pairs are fitted in a pool of processes if requested, results
+    # come back in the order of the pairs
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            fits = list(executor.map(fit_pair, counts_all))
+    else:
+        fits = [fit_pair(counts) for counts in counts_all]
+
+    path_plot = os.path.join(path_out, "results", "fits")
+    os.makedirs(path_plot, exist_ok=True)
+
+    rows = []
+    for pix_pair, (par, perr, n, b) in zip(pix_pairs, fits):
+        rows.append(
+            {
+                "Pixel 1": pix_pair[0],
+                "Pixel 2": pix_pair[1],
+                **_fit_row(par, perr),
+            }
+        )
+        if plot is True and n is not None:
+            from matplotlib import pyplot as plt
+
+            fig = _fit_plot(path, n, b, par, perr)
+            fig.savefig(
+                os.path.join(
+                    path_plot,
+                    "{file}_pixels_"
+                    "{pix1},{pix2}_fit.png".format(
+                        file=file_name, pix1=pix_pair[0], pix2=pix_pair[1]
+                    ),
+                )
+            )
+            plt.close(fig)
+
+    fit_data = pd.DataFrame(rows)
+    fit_data.to_csv(
+        os.path.join(path_plot, "{}_fits.csv".format(file_name)), index=False
+    )
+
+    return fit_data
+
+
+def fit_wg_track(
+    path,
+    pix_pairs: list,
+    board_number: str,
+    fw_ver: str,
+    timestamps: int = 512,
+    delta_window: float = 10e3,
+    window: float = 5e3,
+    step: int = 1,
+    chunk_cycles: int = None,
+    fit_mode: str = "poisson",
+    workers: int = 1,
+    cache_dir: str = None,
+    path_out: str = None,
+):
+    """Follow the peak of timestamp differences in time.
+
+    Data files are unpacked one by one and split into chunks of
+    acquisition cycles. For each chunk, timestamp differences of the
+    requested pairs of pixels are calculated and histogrammed in bins
+    of 17.857 ps right away, and each histogram is fitted with Gaussian
+    function in the same way as in 'fit_wg'. Only the fit parameters
+    and the centroid and RMS of the peak are kept, so that the
+    timestamp differences are never saved. The time series is saved as
+    a '.csv' file in the 'results/fits' folder, which is updated after
+    each data file.
+
+    Parameters
+    ----------
+    path : str
+        Path to datafiles.
+    pix_pairs : list
+        Pairs of pixel numbers for which the peak is followed.
+    board_number : str
+        The LinoSPAD2 daughterboard number.
+    fw_ver : str
+        LinoSPAD2 firmware version. Versions "2212s" (skip) and "2212b"
+        (block) are recognized.
+    timestamps : int, optional
+        Number of timestamps per acquisition cycle per pixel. The
+        default is 512.
+    delta_window : float, optional
+        Size of a window to which timestamp differences are compared.
+        The default is 10e3 (10 ns).
+    window : float, optional
+        Time range in which timestamp differences are fitted. The
+        default is 5e3.
+    step : int, optional
+        Bins of delta t histogram should be in units of 17.857 (average
+        LinoSPAD2 TDC bin width). Default is 1.
+    chunk_cycles : int, optional
+        Number of acquisition cycles in each point of the time series.
+        The default is None, in which case each data file is a single
+        point.
+    fit_mode : str, optional
+        Fitting method, "ls" or "poisson", see 'fit_wg'. The default is
+        "poisson", as histograms of short chunks have few counts.
+    workers : int, optional
+        Number of processes for processing data files in parallel. The
+        default is 1.
+    cache_dir : str, optional
+        Folder for caching unpacked data files, see 'unpack_bin_sparse'.
+        The default is None, in which case no cache is used.
+    path_out : str, optional
+        Path to the folder where the results are saved. The default is
+        None, in which case 'path' is used.
 
-    data_to_plot = np.delete(
-        data_to_plot, np.argwhere(data_to_plot < b[n_argmax] - window / 2)
+    Raises
+    ------
+    TypeError
+        Raised when 'board_number', 'fw_ver' or 'fit_mode' is not a
+        string.
+    ValueError
+        Raised when the firmware version or the fitting method is not
+        recognized, or 'chunk_cycles' is lower than 1.
+    FileNotFoundError
+        Raised when no '.dat' data files are found.
+
+    Returns
+    -------
+    track_data : pandas.DataFrame
+        Time series of the peak for each pair of pixels: data file,
+        first acquisition cycle of the chunk, number of timestamp
+        differences, centroid and RMS of the peak and parameters of
+        the fit, see 'fit_wg_all'.
+
+    """
+    import pandas as pd
+    from tqdm import tqdm
+
+    # parameter type check
+    if isinstance(board_number, str) is not True:
+        raise TypeError(
+            "'board_number' should be string, either 'NL11' or 'A5'"
+        )
+    if isinstance(fw_ver, str) is not True:
+        raise TypeError("'fw_ver' should be string, '2212b' or '2212s'")
+    if fw_ver not in ("2212s", "2212b"):
+        raise ValueError("Firmware version is not recognized.")
+    if isinstance(fit_mode, str) is not True:
+        raise TypeError("'fit_mode' should be string, 'ls' or 'poisson'")
+    if fit_mode not in ("ls", "poisson"):
+        raise ValueError("Fitting method is not recognized.")
+    if chunk_cycles is not None and chunk_cycles < 1:
+        raise ValueError("'chunk_cycles' should be at least 1")
+    if path_out is None:
+        path_out = path
+
+    # files in the order of acquisition
+    files_all = sorted(
+        glob.glob(os.path.abspath(os.path.join(path, "*.dat*")))
     )
-    data_to_plot = np.delete(
-        data_to_plot, np.argwhere(data_to_plot > b[n_argmax] + window / 2)
+    if files_all == []:
+        raise FileNotFoundError("No data files found in {}".format(path))
+    file_name = _deltas_name(path)
+
+    path_plot = os.path.join(path_out, "results", "fits")
+    os.makedirs(path_plot, exist_ok=True)
+    track_file = os.path.join(path_plot, "{}_track.csv".format(file_name))
+
+    # Files are processed in a pool of processes if requested, results
+    # come back in the order of the files
+    rows_files = f_up.map_files(
+        partial(
+            _track_file,
+            pix_pairs=pix_pairs,
+            board_number=board_number,
+            fw_ver=fw_ver,
+            timestamps=timestamps,
+            delta_window=delta_window,
+            window=window,
+            step=step,
+            chunk_cycles=chunk_cycles,
+            fit_mode=fit_mode,
+            cache_dir=cache_dir,
+        ),
+        files_all,
+        workers,
     )
 
-    # bins must be in units of 17.857 ps
-    bins = np.arange(np.min(data_to_plot), np.max(data_to_plot), 17.857 * step)
+    track_data = []
+    for i, rows in enumerate(
+        tqdm(rows_files, total=len(files_all), desc="Fitting data")
+    ):
+        track_data.append(pd.DataFrame(rows))
+        # Save the time series after each file so data is not lost in
+        # the case of failure close to the end
+        track_data[-1].to_csv(
+            track_file, mode="w" if i == 0 else "a", header=i == 0, index=False
+        )
+
+    return pd.concat(track_data, ignore_index=True)
+
 
-    # n, b, p = plt.hist(data_to_plot, bins=bins, color="teal")
-    # plt.close("all")
+def _track_file(
+    file,
+    pix_pairs: list,
+    board_number: str,
+    fw_ver: str,
+    timestamps: int,
+    delta_window: float,
+    window: float,
+    step: int,
+    chunk_cycles: int,
+    fit_mode: str,
+    cache_dir: str = None,
+):
+    """Fit the peak of timestamp differences in chunks of a data file.
 
-    n, b = np.histogram(data_to_plot, bins)
+    See 'fit_wg_track' for the parameters.
+
+    Returns
+    -------
+    rows : list
+        Rows of the time series, one per chunk and pair of pixels.
+
+    """
+    pixels = np.unique(np.asarray(pix_pairs).ravel())
+    tmsp, offsets = f_up.unpack_bin_sparse(
+        file,
+        board_number,
+        fw_ver,
+        timestamps,
+        pixels=pixels,
+        cache_dir=cache_dir,
+    )
+    cycles = offsets.shape[1] - 1
+    if chunk_cycles is None:
+        chunk_cycles = cycles
+
+    rows = []
+    for start in range(0, cycles, chunk_cycles):
+        # offsets of the chunk of cycles, timestamps are not copied
+        deltas_pairs = calc_diff_2212_pairs(
+            tmsp,
+            offsets[:, start : min(start + chunk_cycles, cycles) + 1],
+            pixels,
+            delta_window,
+        )
+        for pix_pair in pix_pairs:
+            q, w = min(pix_pair), max(pix_pair)
+            deltas = deltas_pairs[(q, w)]
+            counts, bin_edges = calc_hist_2212(deltas, delta_window)
+
+            centroid, rms = np.nan, np.nan
+            try:
+                n, b = _fit_window(counts, bin_edges, window, step)
+                _, centroid, rms, _ = _gauss_guess((b[:-1] + b[1:]) / 2, n)
+            except ValueError:
+                pass
+            par, perr, _, _ = _fit_hist_safe(
+                counts, bin_edges, window, step, fit_mode
+            )
+
+            rows.append(
+                {
+                    "File": os.path.basename(file),
+                    "Cycle": start,
+                    "Pixel 1": q,
+                    "Pixel 2": w,
+                    "Counts": len(deltas),
+                    "Centroid": centroid,
+                    "RMS": rms,
+                    **_fit_row(par, perr),
+                }
+            )
+
+    return rows
+
+
+def _fit_row(par, perr):
+    """Parameters of a fit and their errors as a row of a table.
 
-    b1 = (b - (b[-1] - b[-2]) / 2)[1:]
+    Parameters
+    ----------
+    par : ndarray
+        Amplitude, position, sigma and background of the fit.
+    perr : ndarray
+        Errors of the parameters.
 
-    sigma = 150
+    Returns
+    -------
+    row : dict
+        Sigma, mu, visibility, background and amplitude with errors;
+        sigma and mu in ps, visibility in %.
 
-    av_bkg = np.average(n)
+    """
+    return {
+        "Sigma": par[2],
+        "Sigma error": perr[2],
+        "Mu": par[1],
+        "Mu error": perr[1],
+        "Visibility": par[0] / par[3] * 100,
+        "Visibility error": par[0] / par[3] ** 2 * 100 * perr[3],
+        "Background": par[3],
+        "Background error": perr[3],
+        "Amplitude": par[0],
+        "Amplitude error": perr[0],
+    }
+
+
+def _gauss(x, A, x0, sigma, C):
+    """Gaussian function on a constant background."""
+    return A * np.exp(-((x - x0) ** 2) / (2 * sigma**2)) + C
+
+
+def _gauss_jac(x, A, x0, sigma, C):
+    """Derivatives of '_gauss' by its parameters.
+
+    Returns
+    -------
+    jac : ndarray
+        Derivatives by A, x0, sigma and C for each point, one point per
+        row.
+
+    """
+    exp = np.exp(-((x - x0) ** 2) / (2 * sigma**2))
+
+    return np.stack(
+        (
+            exp,
+            A * exp * (x - x0) / sigma**2,
+            A * exp * (x - x0) ** 2 / sigma**3,
+            np.ones_like(x),
+        ),
+        axis=-1,
+    )
+
+
+def _gauss_guess(x, n):
+    """Initial guess of the parameters of '_gauss' from the histogram.
+
+    Background is the average of the outer quarters of the window, the
+    peak height is the maximum above it, and the position and width
+    are the centroid and RMS of the counts above the background.
+
+    Parameters
+    ----------
+    x : ndarray
+        Bin centers.
+    n : ndarray
+        Number of counts in each bin.
+
+    Raises
+    ------
+    ValueError
+        Raised when there are fewer than 2 bins.
+
+    Returns
+    -------
+    p0 : list
+        Initial guess of A, x0, sigma and C.
+
+    """
+    if len(n) < 2:
+        raise ValueError(
+            "\nFit window holds fewer than 2 bins, 'window' should be "
+            "wider or 'step' smaller"
+        )
 
-    par, pcov = curve_fit(gauss, b1, n, p0=[max(n), cp_pos, sigma, av_bkg])
+    side = max(1, len(n) // 4)
+    bkg = np.mean(np.concatenate((n[:side], n[-side:])))
+
+    signal = np.clip(n - bkg, 0, None)
+    if signal.sum() == 0:
+        return [np.max(n) - bkg, x[np.argmax(n)], x[1] - x[0], bkg]
+
+    x0 = np.average(x, weights=signal)
+    sigma = np.sqrt(np.average((x - x0) ** 2, weights=signal))
+
+    return [signal.max(), x0, max(sigma, x[1] - x[0]), bkg]
+
+
+def _deltas_name(path):
+    """Name of the files with timestamp differences for the data files.
+
+    Parameters
+    ----------
+    path : str
+        Path to datafiles.
+
+    Raises
+    ------
+    FileNotFoundError
+        Raised when no '.dat' data files are found.
+
+    Returns
+    -------
+    file_name : str
+        Names of the first and the last data files joined with '-'.
+
+    """
+    files = glob.glob(os.path.join(path, "*.dat*"))
+    if files == []:
+        raise FileNotFoundError("No data files found in {}".format(path))
+
+    return (
+        os.path.basename(files[0])[:-4]
+        + "-"
+        + os.path.basename(files[-1])[:-4]
+    )
+
+
+def _fit_window(counts, bin_edges, window: float, step: int):
+    """Cut the histogram of timestamp differences around the peak.
+
+    Parameters
+    ----------
+    counts : ndarray
+        Number of timestamp differences in bins of 17.857 ps.
+    bin_edges : ndarray
+        Edges of the bins in ps.
+    window : float
+        Time range around the peak that is kept.
+    step : int
+        Number of bins of 17.857 ps merged into one.
+
+    Raises
+    ------
+    ValueError
+        Raised when there are no timestamp differences in the range.
+
+    Returns
+    -------
+    n : ndarray
+        Histogram in the window.
+    b : ndarray
+        Edges of the bins of the histogram in ps.
+
+    """
+    # Use window of 40 ns for primary guess of fit parameters and
+    # selecting a narrower window for the fit; bins are in units of
+    # 17.857 ps
+    n, b = rebin_hist_2212(counts, bin_edges, step, (-20e3, 20e3))
+    # Check if there any timestamp differences
+    if n.sum() == 0:
+        raise ValueError("\nNo data for the requested pixel pair available")
+
+    n_argmax = np.argmax(n)
+
+    return rebin_hist_2212(
+        counts,
+        bin_edges,
+        step,
+        (b[n_argmax] - window / 2, b[n_argmax] + window / 2),
+    )
+
+
+def _fit_hist(
+    counts, bin_edges, window: float, step: int, fit_mode: str = "ls"
+):
+    """Fit the histogram of timestamp differences with Gaussian function.
+
+    Parameters
+    ----------
+    counts : ndarray
+        Number of timestamp differences in bins of 17.857 ps.
+    bin_edges : ndarray
+        Edges of the bins in ps.
+    window : float
+        Time range in which timestamp differences are fitted.
+    step : int
+        Number of bins of 17.857 ps merged into one.
+    fit_mode : str, optional
+        Fitting method, "ls" or "poisson", see 'fit_wg'.
+        The default is "ls".
+
+    Raises
+    ------
+    ValueError
+        Raised when there are no timestamp differences in the range or
+        the fit window holds fewer than 2 bins.
+
+    Returns
+    -------
+    par : ndarray
+        Amplitude, position, sigma and background of the fit.
+    perr : ndarray
+        Errors of the parameters.
+    n : ndarray
+        Histogram that was fitted.
+    b : ndarray
+        Edges of the bins of the histogram in ps.
+
+    """
+    from scipy.optimize import curve_fit
+
+    n, b = _fit_window(counts, bin_edges, window, step)
+
+    # bin centers
+    b1 = (b[:-1] + b[1:]) / 2
+
+    p0 = _gauss_guess(b1, n)
+
+    if fit_mode == "poisson":
+        par, pcov = _fit_poisson(b1, n, p0)
+    else:
+        par, pcov = curve_fit(_gauss, b1, n, p0=p0, jac=_gauss_jac)
+    perr = np.sqrt(np.diag(pcov))
+
+    return par, perr, n, b
+
+
+def _fit_poisson(x, n, p0, max_iter: int = 100):
+    """Fit the histogram by maximum likelihood of Poisson counts.
+
+    The negative log-likelihood of the counts is minimized by Fisher
+    scoring, i.e., Gauss-Newton steps with the variance of each bin
+    given by the model, halving each step until the likelihood grows,
+    so that the model stays positive.
+
+    Parameters
+    ----------
+    x : ndarray
+        Bin centers.
+    n : ndarray
+        Number of counts in each bin.
+    p0 : list
+        Initial guess of A, x0, sigma and C.
+    max_iter : int, optional
+        Maximum number of steps. The default is 100.
+
+    Raises
+    ------
+    RuntimeError
+        Raised when the fit does not converge.
+
+    Returns
+    -------
+    par : ndarray
+        Amplitude, position, sigma and background of the fit.
+    pcov : ndarray
+        Covariance of the parameters, the inverse of the Fisher
+        information.
+
+    """
+
+    def nll(par):
+        mu = _gauss(x, *par)
+        if np.any(mu <= 0):
+            return np.inf
+        return np.sum(mu - n * np.log(mu))
+
+    # background should be positive for the likelihood to be defined
+    par = np.array(p0, dtype=float)
+    par[3] = max(par[3], 0.01 * np.max(n))
+    nll_par = nll(par)
+
+    for _ in range(max_iter):
+        mu = _gauss(x, *par)
+        jac = _gauss_jac(x, *par)
+        fisher = jac.T @ (jac / mu[:, np.newaxis])
+        step = np.linalg.lstsq(fisher, jac.T @ (n / mu - 1), rcond=None)[0]
+
+        scale = 1
+        while nll(par + scale * step) > nll_par and scale > 1e-6:
+            scale /= 2
+        par_new = par + scale * step
+        nll_new = nll(par_new)
+        if not nll_new <= nll_par:
+            raise RuntimeError("Maximum likelihood fit did not converge")
+
+        converged = nll_par - nll_new < 1e-9 * (1 + abs(nll_par))
+        par, nll_par = par_new, nll_new
+        if converged:
+            break
+    else:
+        raise RuntimeError("Maximum likelihood fit did not converge")
+
+    mu = _gauss(x, *par)
+    jac = _gauss_jac(x, *par)
+
+    return par, np.linalg.pinv(jac.T @ (jac / mu[:, np.newaxis]))
+
+
+def _fit_hist_safe(
+    counts, bin_edges, window: float, step: int, fit_mode: str = "ls"
+):
+    """Fit the histogram, with NaN parameters if the fit fails.
+
+    Used in 'fit_wg_all', so that a single pair without data or with
+    a fit that does not converge does not stop fitting the others. See
+    '_fit_hist' for the parameters.
+
+    Returns
+    -------
+    par : ndarray
+        Amplitude, position, sigma and background of the fit.
+    perr : ndarray
+        Errors of the parameters.
+    n : ndarray or None
+        Histogram that was fitted, None if the fit failed.
+    b : ndarray or None
+        Edges of the bins of the histogram in ps, None if the fit
+        failed.
+
+    """
+    try:
+        return _fit_hist(counts, bin_edges, window, step, fit_mode)
+    except (ValueError, RuntimeError):
+        return np.full(4, np.nan), np.full(4, np.nan), None, None
+
+
+def _fit_plot(path, n, b, par, perr):
+    """Plot the histogram of timestamp differences and the fit.
+
+    Parameters
+    ----------
+    path : str
+        Path to datafiles, used for choosing the color.
+    n : ndarray
+        Histogram that was fitted.
+    b : ndarray
+        Edges of the bins of the histogram in ps.
+    par : ndarray
+        Amplitude, position, sigma and background of the fit.
+    perr : ndarray
+        Errors of the parameters.
+
+    Returns
+    -------
+    fig : matplotlib.figure.Figure
+        Figure with the plot.
+
+    """
+    from matplotlib import pyplot as plt
+
+    # bin centers
+    b1 = (b[:-1] + b[1:]) / 2
 
     # interpolate for smoother fit plot
     to_fit_b = np.linspace(np.min(b1), np.max(b1), len(b1) * 100)
-    to_fit_n = gauss(to_fit_b, par[0], par[1], par[2], par[3])
+    to_fit_n = _gauss(to_fit_b, par[0], par[1], par[2], par[3])
 
-    perr = np.sqrt(np.diag(pcov))
     vis_er = par[0] / par[3] ** 2 * 100 * perr[-1]
-    # fit_plot = gauss(to_fit_b, par[0], par[1], par[2], par[3])
 
     if "Ne" and "540" in path:
         chosen_color = "seagreen"
@@ -153,7 +899,9 @@ def fit_wg(path, pix_pair: list, window: float = 5e3, step: int = 1):
     else:
         chosen_color = "salmon"
 
-    plt.figure(figsize=(16, 10))
+    plt.rcParams.update({"font.size": 22})
+
+    fig = plt.figure(figsize=(16, 10))
     plt.xlabel(r"$\Delta$t [ps]")
     plt.ylabel("# of coincidences [-]")
     plt.step(
@@ -163,8 +911,6 @@ def fit_wg(path, pix_pair: list, window: float = 5e3, step: int = 1):
         label="data",
     )
     plt.plot(
-        # b,
-        # fit_plot,
         to_fit_b,
         to_fit_n,
         "-",
@@ -174,7 +920,6 @@ def fit_wg(path, pix_pair: list, window: float = 5e3, step: int = 1):
         "\u03BC={p2}\u00B1{pe2} ps\n"
         "vis={vis}\u00B1{vis_er} %\n"
         "bkg={bkg}\u00B1{bkg_er}".format(
-            # "\u03C3_s={p3} ps".format(
             p1=format(par[2], ".1f"),
             p2=format(par[1], ".1f"),
             pe1=format(perr[2], ".1f"),
@@ -182,24 +927,9 @@ def fit_wg(path, pix_pair: list, window: float = 5e3, step: int = 1):
             bkg=format(par[3], ".1f"),
             bkg_er=format(perr[3], ".1f"),
             vis=format(par[0] / par[3] * 100, ".1f"),
-            vis_er=format(vis_er, ".1f")
-            # p3=format(st_dev, ".2f"),
+            vis_er=format(vis_er, ".1f"),
         ),
     )
     plt.legend(loc="best")
 
-    try:
-        os.chdir("results/fits")
-    except Exception:
-        os.makedirs("results/fits")
-        os.chdir("results/fits")
-
-    plt.savefig(
-        "{file}_pixels_"
-        "{pix1},{pix2}_fit.png".format(
-            file=file_name, pix1=pix_pair[0], pix2=pix_pair[1]
-        )
-    )
-
-    plt.pause(0.1)
-    os.chdir("../..")
+    return fig
@@ -24,11 +24,11 @@ functions:
 import glob
 import os
 import sys
+from functools import partial
 
 import numpy as np
-from matplotlib import pyplot as plt
-from tqdm import tqdm
 
+# matplotlib and tqdm are imported on first use
 from LinoSPAD2.functions import unpack as f_up
 
 
@@ -39,11 +39,16 @@ def plot_pixel_hist(
     board_number: str,
     timestamps: int = 512,
     show_fig: bool = False,
+    workers: int = 1,
+    cache_dir: str = None,
+    path_out: str = None,
 ):
     """Plot a histogram for each pixel in the given range.
 
     Used mainly for checking the homogeneity of the LinoSPAD2 output
-    (mainly clock and acquisition window size settings).
+    (mainly clock and acquisition window size settings). The plots are
+    saved in the "results/single pixel histograms" folder, which is
+    created if it does not exist, in 'path_out'.
 
     Parameters
     ----------
@@ -60,12 +65,23 @@ def plot_pixel_hist(
         default is 512.
     show_fig : bool, optional
         Switch for showing the output figure. The default is False.
+    workers : int, optional
+        Number of processes for unpacking data files in parallel. The
+        default is 1.
+    cache_dir : str, optional
+        Folder for caching unpacked data files, see 'unpack_bin_sparse'.
+        The default is None, in which case no cache is used.
+    path_out : str, optional
+        Path to the folder where the output is saved. The default is
+        None, in which case 'path' is used.
 
     Returns
     -------
     None.
 
     """
+    from matplotlib import pyplot as plt
+
     # parameter type check
     if isinstance(fw_ver, str) is not True:
         raise TypeError("'fw_ver' should be a string")
@@ -73,56 +89,68 @@ def plot_pixel_hist(
     if type(pixels) is int:
         pixels = [pixels]
 
-    os.chdir(path)
+    if pixels is None:
+        pixels = np.arange(145, 165, 1)
+
+    if path_out is None:
+        path_out = path
 
-    DATA_FILES = glob.glob("*.dat*")
+    DATA_FILES = glob.glob(os.path.join(path, "*.dat*"))
 
     if show_fig is True:
         plt.ion()
     else:
         plt.ioff()
-    for i, num in enumerate(DATA_FILES):
+
+    if fw_ver not in ("2212s", "2212b"):
+        print("\nFirmware version is not recognized, exiting.")
+        sys.exit()
+
+    # Files are unpacked in a pool of processes if requested, results
+    # come back in the order of the files
+    tmsp_files = f_up.map_files(
+        partial(
+            _pixel_tmsp,
+            pixels=pixels,
+            board_number=board_number,
+            fw_ver=fw_ver,
+            timestamps=timestamps,
+            cache_dir=cache_dir,
+        ),
+        DATA_FILES,
+        workers,
+    )
+
+    path_plot = os.path.join(path_out, "results", "single pixel histograms")
+
+    for num, tmsp_pixels in zip(DATA_FILES, tmsp_files):
+        num = os.path.basename(num)
         print(
             "> > > Plotting pixel histograms, Working on {} < < <\n".format(
                 num
             )
         )
 
-        data = f_up.unpack_bin(num, board_number, timestamps=timestamps)
-
-        if pixels is None:
-            pixels = np.arange(145, 165, 1)
-
         for i in range(len(pixels)):
             plt.figure(figsize=(16, 10))
             plt.rcParams.update({"font.size": 22})
             # bins = np.arange(0, 4e9, 17.867 * 1e6)  # bin size of 17.867 us
             bins = np.linspace(0, 4e9, 200)
-            if fw_ver == "2212s":
-                pix_coor = np.arange(256).reshape(4, 64).T
-            elif fw_ver == "2212b":
-                pix_coor = np.arange(256).reshape(64, 4)
-            else:
-                print("\nFirmware version is not recognized, exiting.")
-                sys.exit()
-            tdc, pix = np.argwhere(pix_coor == i)[0]
-            ind = np.where(data[tdc].T[0] == pix)[0]
-            ind1 = np.where(data[tdc].T[1][ind] > 0)[0]
-            data_to_plot = data[tdc].T[1][ind[ind1]]
+            data_to_plot = tmsp_pixels[i]
 
             plt.hist(data_to_plot, bins=bins, color="teal")
             plt.xlabel("Time [ms]")
             plt.ylabel("Counts [-]")
             plt.title("Pixel {}".format(pixels[i]))
-            try:
-                os.chdir("results/single pixel histograms")
-            except Exception:
-                os.makedirs("results/single pixel histograms")
-                os.chdir("results/single pixel histograms")
+            os.makedirs(path_plot, exist_ok=True)
             plt.savefig(
-                "{file}, pixel {pixel}.png".format(file=num, pixel=pixels[i])
+                os.path.join(
+                    path_plot,
+                    "{file}, pixel {pixel}.png".format(
+                        file=num, pixel=pixels[i]
+                    ),
+                )
             )
-            os.chdir("../..")
 
 
 def plot_sen_pop(
@@ -134,14 +162,17 @@ def plot_sen_pop(
     style: str = "-o",
     show_fig: bool = False,
     app_mask: bool = True,
+    workers: int = 1,
+    path_out: str = None,
 ):
     """Plot number of timestamps in each pixel for all datafiles.
 
     Plot sensor population as number of timestamps vs. pixel number.
     Analyzes all data files in the given folder. The output figure is saved
     in the "results" folder, which is created if it does not exist, in
-    the same folder where datafiles are. Works with the firmware version
-    '2212'.
+    'path_out'. Works with the firmware version '2212'. Valid timestamps
+    are counted straight from the raw data with 'count_valid', as
+    calibrated times are not needed.
 
     Parameters
     ----------
@@ -166,12 +197,21 @@ def plot_sen_pop(
     app_mask : bool, optional
         Switch for applying the mask on warm/hot pixels. The default is
         True.
+    workers : int, optional
+        Number of processes for counting timestamps in data files in
+        parallel. The default is 1.
+    path_out : str, optional
+        Path to the folder where the output is saved. The default is
+        None, in which case 'path' is used.
 
     Returns
     -------
     None.
 
     """
+    from matplotlib import pyplot as plt
+    from tqdm import tqdm
+
     # parameter type check
     if isinstance(fw_ver, str) is not True:
         raise TypeError("'fw_ver' should be string, '2212b' or '2212s'")
@@ -182,11 +222,16 @@ def plot_sen_pop(
     else:
         plt.ioff()
 
-    os.chdir(path)
+    if path_out is None:
+        path_out = path
 
-    files = glob.glob("*.dat*")
+    files = glob.glob(os.path.join(path, "*.dat*"))
 
-    plot_name = files[0][:-4] + "-" + files[-1][:-4]
+    plot_name = (
+        os.path.basename(files[0])[:-4]
+        + "-"
+        + os.path.basename(files[-1])[:-4]
+    )
 
     if "Ne" and "540" in path:
         chosen_color = "seagreen"
@@ -206,32 +251,23 @@ def plot_sen_pop(
         "Working in {} < < <\n".format(path)
     )
 
-    for i in tqdm(range(len(files)), desc="Collecting data"):
-        if fw_ver == "2212s":
-            pix_coor = np.arange(256).reshape(4, 64).T
-        elif fw_ver == "2212b":
-            pix_coor = np.arange(256).reshape(64, 4)
-        else:
-            print("\nFirmware version is not recognized, exiting.")
-            sys.exit()
+    if fw_ver not in ("2212s", "2212b"):
+        print("\nFirmware version is not recognized, exiting.")
+        sys.exit()
 
-        data = f_up.unpack_bin(files[i], board_number, timestamps)
-        for i in range(256):
-            tdc, pix = np.argwhere(pix_coor == i)[0]
-            ind = np.where(data[tdc].T[0] == pix)[0]
-            ind1 = np.where(data[tdc].T[1][ind] > 0)[0]
-            valid_per_pixel[i] += len(data[tdc].T[1][ind[ind1]])
+    valid_files = f_up.map_files(
+        partial(f_up.count_valid, fw_ver=fw_ver, timestamps=timestamps),
+        files,
+        workers,
+    )
+    for valid in tqdm(valid_files, total=len(files), desc="Collecting data"):
+        valid_per_pixel += valid
 
     print("\n> > > Plotting < < <\n")
     # Apply mask if requested
     if app_mask is True:
-        path_to_back = os.getcwd()
-        path_to_mask = os.path.realpath(__file__) + "/../.." + "/params/masks"
-        os.chdir(path_to_mask)
-        file_mask = glob.glob("*{}*".format(board_number))[0]
-        mask = np.genfromtxt(file_mask).astype(int)
+        mask = _load_mask(board_number)
         valid_per_pixel[mask] = 0
-        os.chdir(path_to_back)
 
     plt.rcParams.update({"font.size": 22})
     fig = plt.figure(figsize=(16, 10))
@@ -239,30 +275,34 @@ def plot_sen_pop(
     plt.xlabel("Pixel number [-]")
     plt.ylabel("Timestamps [-]")
 
-    try:
-        os.chdir("results/sensor_population")
-    except FileNotFoundError:
-        os.makedirs("results/sensor_population")
-        os.chdir("results/sensor_population")
+    path_plot = os.path.join(path_out, "results", "sensor_population")
+    os.makedirs(path_plot, exist_ok=True)
     fig.tight_layout()
-    plt.savefig("{}.png".format(plot_name))
+    plt.savefig(os.path.join(path_plot, "{}.png".format(plot_name)))
     print(
         "> > > The plot is saved as '{file}.png' in {path} < < <".format(
-            file=plot_name, path=os.getcwd()
+            file=plot_name, path=path_plot
         )
     )
-    os.chdir("../..")
 
 
 def plot_spdc(
-    path, board_number: str, timestamps: int = 512, show_fig: bool = False
+    path,
+    board_number: str,
+    timestamps: int = 512,
+    show_fig: bool = False,
+    workers: int = 1,
+    path_out: str = None,
 ):
     """Plot sensor population for SPDC data.
 
     Plots SPDC data subtracting the background (data with the SPDC
     output turned off). Due to the low sensitivity of the LinoSPAD2
     sensor to light at 810 nm of Thorlabs SPDC output, subtracting
-    background is required to show any meaningful signal.
+    background is required to show any meaningful signal. Background
+    data files are taken from the "bckg" folder in 'path'. Valid
+    timestamps are counted straight from the raw data with
+    'count_valid'.
 
     Parameters
     ----------
@@ -276,6 +316,12 @@ def plot_spdc(
         default is 512.
     show_fig : bool, optional
         Switch for showing the plot. The default is False.
+    workers : int, optional
+        Number of processes for counting timestamps in data files in
+        parallel. The default is 1.
+    path_out : str, optional
+        Path to the folder where the output is saved. The default is
+        None, in which case 'path' is used.
 
     Raises
     ------
@@ -290,6 +336,9 @@ def plot_spdc(
     None.
 
     """
+    from matplotlib import pyplot as plt
+    from tqdm import tqdm
+
     # parameter type check
     if isinstance(board_number, str) is not True:
         raise TypeError(
@@ -301,15 +350,14 @@ def plot_spdc(
     else:
         plt.ioff()
 
-    os.chdir(path)
+    if path_out is None:
+        path_out = path
 
-    files = glob.glob("*.dat*")
+    files = glob.glob(os.path.join(path, "*.dat*"))
 
     # background data for subtracting
-    path_bckg = path + "/bckg"
-    os.chdir(path_bckg)
-    files_bckg = glob.glob("*.dat*")
-    os.chdir("..")
+    path_bckg = os.path.join(path, "bckg")
+    files_bckg = glob.glob(os.path.join(path_bckg, "*.dat*"))
 
     if len(files) != len(files_bckg):
         raise ValueError(
@@ -317,51 +365,38 @@ def plot_spdc(
             "number of actual data, exiting."
         )
 
-    plot_name = files[0][:-4] + "-" + files[-1][:-4]
+    plot_name = (
+        os.path.basename(files[0])[:-4]
+        + "-"
+        + os.path.basename(files[-1])[:-4]
+    )
 
     valid_per_pixel = np.zeros(256)
     valid_per_pixel_bckg = np.zeros(256)
 
-    pix_coor = np.arange(256).reshape(64, 4)
+    # Data and background files are processed in a single pool of
+    # processes if requested
+    valid_files = f_up.map_files(
+        partial(f_up.count_valid, fw_ver="2212b", timestamps=timestamps),
+        files + files_bckg,
+        workers,
+    )
 
-    # Collect SPDC data
-    for i in tqdm(range(len(files)), desc="Going through datafiles"):
-        data_all = f_up.unpack_bin(
-            files[i], board_number="A5", timestamps=timestamps
+    # Collect SPDC data, then background data for subtracting
+    for i, valid in enumerate(
+        tqdm(
+            valid_files,
+            total=len(files) + len(files_bckg),
+            desc="Going through datafiles",
         )
-
-        for i in np.arange(0, 256):
-            tdc, pix = np.argwhere(pix_coor == i)[0]
-            ind = np.where(data_all[tdc].T[0] == pix)[0]
-            ind1 = ind[np.where(data_all[tdc].T[1][ind] > 0)[0]]
-            valid_per_pixel[i] += len(data_all[tdc].T[1][ind1])
-
-    # Collect background data for subtracting
-    os.chdir(path_bckg)
-
-    for i in tqdm(
-        range(len(files_bckg)), desc="Going through background datafiles"
     ):
-        data_all_bckg = f_up.unpack_bin(
-            files_bckg[i], board_number="A5", timestamps=timestamps
-        )
-
-        # Fot plotting counts
-        for i in np.arange(0, 256):
-            tdc, pix = np.argwhere(pix_coor == i)[0]
-            ind = np.where(data_all_bckg[tdc].T[0] == pix)[0]
-            ind1 = ind[np.where(data_all_bckg[tdc].T[1][ind] > 0)[0]]
-            valid_per_pixel_bckg[i] += len(data_all_bckg[tdc].T[1][ind1])
-
-    os.chdir("..")
+        if i < len(files):
+            valid_per_pixel += valid
+        else:
+            valid_per_pixel_bckg += valid
 
     # Mask the hot/warm pixels
-    path_to_back = os.getcwd()
-    path_to_mask = os.path.realpath(__file__) + "/../.." + "/params/masks"
-    os.chdir(path_to_mask)
-    file_mask = glob.glob("*{}*".format(board_number))[0]
-    mask = np.genfromtxt(file_mask).astype(int)
-    os.chdir(path_to_back)
+    mask = _load_mask(board_number)
 
     for i in mask:
         valid_per_pixel[i] = 0
@@ -375,11 +410,91 @@ def plot_spdc(
     plt.plot(valid_per_pixel - valid_per_pixel_bckg, "o-", color="teal")
     plt.tight_layout()
 
-    try:
-        os.chdir("results/sensor_population")
-    except Exception:
-        os.makedirs("results/sensor_population")
-        os.chdir("results/sensor_population")
-    plt.savefig("{}_SPDC_counts.png".format(plot_name))
+    path_plot = os.path.join(path_out, "results", "sensor_population")
+    os.makedirs(path_plot, exist_ok=True)
+    plt.savefig(
+        os.path.join(path_plot, "{}_SPDC_counts.png".format(plot_name))
+    )
     plt.pause(0.1)
-    os.chdir("../..")
+
+
+def _pixel_tmsp(
+    file,
+    pixels,
+    board_number: str,
+    fw_ver: str,
+    timestamps: int,
+    cache_dir: str = None,
+):
+    """Collect valid timestamps of the given pixels from a data file.
+
+    Parameters
+    ----------
+    file : str
+        Path to the data file.
+    pixels : array-like
+        Array of pixels indices.
+    board_number : str
+        LinoSPAD2 daughterboard number.
+    fw_ver : str
+        LinoSPAD2 firmware version.
+    timestamps : int
+        Number of timestamps per pixel per acquisition cycle.
+    cache_dir : str, optional
+        Folder for caching unpacked data files. The default is None, in
+        which case no cache is used.
+
+    Returns
+    -------
+    tmsp_pixels : list
+        Array of valid timestamps for each pixel.
+
+    """
+    tmsp, offsets = f_up.unpack_bin_sparse(
+        file,
+        board_number,
+        fw_ver,
+        timestamps=timestamps,
+        pixels=pixels,
+        cache_dir=cache_dir,
+    )
+
+    return [tmsp[offsets[pix, 0] : offsets[pix, -1]] for pix in pixels]
+
+
+def _load_mask(board_number: str):
+    """Load the mask of warm/hot pixels of the board.
+
+    Parameters
+    ----------
+    board_number : str
+        LinoSPAD2 daughterboard number.
+
+    Raises
+    ------
+    FileNotFoundError
+        Raised when no mask for the board was found.
+
+    Returns
+    -------
+    mask : ndarray
+        Numbers of the masked pixels.
+
+    """
+    # path to the folder of the current script, one level up and two
+    # levels down to the masks
+    path_mask = os.path.join(
+        os.path.dirname(os.path.realpath(__file__)), "..", "params", "masks"
+    )
+
+    file_mask = sorted(
+        glob.glob(os.path.join(path_mask, "*{}*".format(board_number)))
+    )
+    if file_mask == []:
+        raise FileNotFoundError(
+            "No mask for the board {} found in {}".format(
+                board_number, path_mask
+            )
+        )
+
+    return np.genfromtxt(file_mask[0]).astype(int)
@@ -0,0 +1,259 @@
+"""Module for generating synthetic LinoSPAD2 data.
+
+Writes binary data files in the format of the LinoSPAD2 firmware
+version 2212, both block and skip, that can be analyzed with the rest
+of the package without the sensor, e.g., for testing the throughput of
+the analysis on large data sets or checking that a coincidence peak of
+known position and width is recovered.
+
+This file can also be imported as a module and contains the following
+functions:
+
+    * generate_data - generate a data file with dark counts, hot pixels
+    and correlated pairs of photons. Data are generated in chunks of
+    acquisition cycles and streamed to the disk, so that the size of
+    the file is not limited by memory.
+
+"""
+
+import numpy as np
+
+
+def generate_data(
+    file,
+    fw_ver: str = "2212b",
+    cycles: int = 1000,
+    timestamps: int = 512,
+    dark_rate=1e3,
+    hot_pixels=None,
+    hot_rate: float = 1e6,
+    pairs=None,
+    pair_rate: float = 1e3,
+    pair_offset: float = 0,
+    pair_jitter: float = 100,
+    cycle_length: float = 4e9,
+    chunk_cycles: int = 100,
+    seed=None,
+):
+    """Generate a synthetic data file.
+
+    In each acquisition cycle, each pixel registers dark counts at
+    random times, Poisson-distributed with the given rate; hot pixels
+    register counts at a higher rate. For each pair of pixels,
+    correlated photons arrive at both pixels, with the arrival in the
+    second pixel delayed by 'pair_offset' and smeared by a Gaussian
+    with the width of 'pair_jitter', so that the timestamp differences
+    of the pair show a peak at 'pair_offset' on a flat background.
+
+    Timestamps of the four pixels of each TDC are sorted in time and,
+    as in the sensor, only the first 'timestamps' per cycle are kept.
+    Times are written as TDC codes of 17.857 ps, so that after
+    calibration they are recovered up to the calibration of the board.
+
+    Parameters
+    ----------
+    file : str
+        Path to the output '.dat' file.
+    fw_ver : str, optional
+        LinoSPAD2 firmware version, "2212b" (block) or "2212s" (skip).
+        The default is "2212b".
+    cycles : int, optional
+        Number of acquisition cycles. The default is 1000.
+    timestamps : int, optional
+        Number of timestamps per TDC per acquisition cycle. The default
+        is 512.
+    dark_rate : float or array-like, optional
+        Rate of dark counts in Hz, either the same for all pixels or
+        one for each of the 256 pixels. The default is 1e3.
+    hot_pixels : array-like, optional
+        Numbers of hot pixels. The default is None.
+    hot_rate : float, optional
+        Rate of counts in hot pixels in Hz. The default is 1e6.
+    pairs : array-like, optional
+        Pairs of pixel numbers that register correlated photons. The
+        default is None.
+    pair_rate : float, optional
+        Rate of correlated pairs of photons in Hz for each pair of
+        pixels. The default is 1e3.
+    pair_offset : float, optional
+        Delay of the second pixel of a pair in ps. The default is 0.
+    pair_jitter : float, optional
+        Standard deviation of the delay in ps. The default is 100.
+    cycle_length : float, optional
+        Length of the acquisition cycle in ps. The default is 4e9
+        (4 ms).
+    chunk_cycles : int, optional
+        Number of acquisition cycles generated at once. The default is
+        100.
+    seed : int, optional
+        Seed of the random number generator. The default is None.
+
+    Raises
+    ------
+    TypeError
+        Raised when 'fw_ver' is not a string.
+    ValueError
+        Raised when the firmware version is not recognized or the
+        acquisition cycle is longer than the range of the TDC codes.
+
+    Returns
+    -------
+    None.
+
+    """
+    # parameter type check
+    if isinstance(fw_ver, str) is not True:
+        raise TypeError("'fw_ver' should be string, '2212b' or '2212s'")
+    if fw_ver not in ("2212b", "2212s"):
+        raise ValueError("Firmware version is not recognized.")
+    # timestamps are stored in the lowest 28 bits
+    if cycle_length / 17.857 >= 2**28:
+        raise ValueError(
+            "'cycle_length' should be shorter than {} ps".format(
+                2**28 * 17.857
+            )
+        )
+
+    rng = np.random.default_rng(seed)
+
+    # expected number of counts per cycle in each pixel
+    rate = np.broadcast_to(np.asarray(dark_rate, dtype=float), 256).copy()
+    if hot_pixels is not None:
+        rate[np.asarray(hot_pixels, dtype=int)] = hot_rate
+    counts_mean = rate * cycle_length * 1e-12
+
+    if pairs is None:
+        pairs = np.empty((0, 2), dtype=int)
+    pairs = np.asarray(pairs, dtype=int).reshape(-1, 2)
+    pairs_mean = pair_rate * cycle_length * 1e-12
+
+    with open(file, "wb") as f:
+        for start in range(0, cycles, chunk_cycles):
+            chunk = min(chunk_cycles, cycles - start)
+            cycle, pix, tmsp = _events(
+                rng,
+                chunk,
+                counts_mean,
+                pairs,
+                pairs_mean,
+                pair_offset,
+                pair_jitter,
+                cycle_length,
+            )
+            _words(cycle, pix, tmsp, chunk, timestamps, fw_ver).tofile(f)
+
+
+def _events(
+    rng,
+    cycles: int,
+    counts_mean,
+    pairs,
+    pairs_mean: float,
+    pair_offset: float,
+    pair_jitter: float,
+    cycle_length: float,
+):
+    """Generate counts of all pixels in a chunk of acquisition cycles.
+
+    Parameters
+    ----------
+    rng : numpy.random.Generator
+        Random number generator.
+    cycles : int
+        Number of acquisition cycles.
+    counts_mean : ndarray
+        Expected number of uncorrelated counts per cycle in each pixel.
+    pairs : ndarray
+        Pairs of pixel numbers with correlated photons.
+    pairs_mean : float
+        Expected number of correlated pairs per cycle for each pair.
+    pair_offset : float
+        Delay of the second pixel of a pair in ps.
+    pair_jitter : float
+        Standard deviation of the delay in ps.
+    cycle_length : float
+        Length of the acquisition cycle in ps.
+
+    Returns
+    -------
+    cycle : ndarray
+        Cycle number of each count.
+    pix : ndarray
+        Pixel number of each count.
+    tmsp : ndarray
+        Time of each count in ps.
+
+    """
+    # uncorrelated counts
+    counts = rng.poisson(counts_mean, (cycles, 256)).ravel()
+    cycle = np.repeat(np.repeat(np.arange(cycles), 256), counts)
+    pix = np.repeat(np.tile(np.arange(256), cycles), counts)
+    tmsp = rng.random(len(pix)) * cycle_length
+
+    # correlated pairs, the second photon is delayed and smeared
+    counts = rng.poisson(pairs_mean, (cycles, len(pairs))).ravel()
+    pair_cycle = np.repeat(np.repeat(np.arange(cycles), len(pairs)), counts)
+    pair_pix = np.repeat(np.tile(pairs, (cycles, 1)), counts, axis=0)
+    tmsp1 = rng.random(len(pair_cycle)) * cycle_length
+    tmsp2 = tmsp1 + rng.normal(pair_offset, pair_jitter, len(pair_cycle))
+
+    cycle = np.concatenate((cycle, pair_cycle, pair_cycle))
+    pix = np.concatenate((pix, pair_pix[:, 0], pair_pix[:, 1]))
+    tmsp = np.concatenate((tmsp, tmsp1, tmsp2))
+
+    # delayed photons out of the cycle are lost
+    inside = (tmsp >= 0) & (tmsp < cycle_length)
+
+    return cycle[inside], pix[inside], tmsp[inside]
+
+
+def _words(cycle, pix, tmsp, cycles: int, timestamps: int, fw_ver: str):
+    """Encode counts into the raw 32-bit words of firmware 2212.
+
+    Parameters
+    ----------
+    cycle : ndarray
+        Cycle number of each count.
+    pix : ndarray
+        Pixel number of each count.
+    tmsp : ndarray
+        Time of each count in ps.
+    cycles : int
+        Number of acquisition cycles.
+    timestamps : int
+        Number of timestamps per TDC per acquisition cycle.
+    fw_ver : str
+        LinoSPAD2 firmware version, "2212b" or "2212s".
+
+    Returns
+    -------
+    words : ndarray
+        Raw words of 'cycles' x 65 TDCs x 'timestamps'.
+
+    """
+    # TDC and pixel coordinate in the TDC, see 'unpack_bin'
+    if fw_ver == "2212b":
+        tdc, pix_coor = pix // 4, pix % 4
+    else:
+        tdc, pix_coor = pix % 64, pix // 64
+
+    # sort by TDC and time in each cycle, then keep the first
+    # 'timestamps' in each TDC, as the sensor does
+    order = np.lexsort((tmsp, tdc, cycle))
+    cycle, tdc = cycle[order], tdc[order]
+    pix_coor, tmsp = pix_coor[order], tmsp[order]
+    group = cycle * 65 + tdc
+    first = np.searchsorted(group, group, side="left")
+    rank = np.arange(len(group)) - first
+    keep = rank < timestamps
+
+    # validity bit, 2 bits of pixel coordinate and the 28-bit TDC code;
+    # the 65th TDC and unused positions stay empty
+    words = np.zeros((cycles, 65, timestamps), dtype=np.uint32)
+    words[cycle[keep], tdc[keep], rank[keep]] = (
+        0x80000000
+        | (pix_coor[keep].astype(np.uint32) << 28)
+        | (tmsp[keep] / 17.857).astype(np.uint32)
+    )
+
+    return words
@@ -7,16 +7,43 @@ functions:
     firmware version 2212. Utilizes the numpy library to speed up the
     process.
 
+    * unpack_bin_chunks - function for unpacking data from LinoSPAD2,
+    firmware version 2212, in chunks of acquisition cycles from a
+    memory-mapped file.
+
+    * unpack_bin_sparse - function for unpacking data from LinoSPAD2,
+    firmware version 2212, into a flat array of valid timestamps
+    grouped by pixel and acquisition cycle, with offsets for each
+    pixel and cycle.
+
+    * count_valid - function for counting valid timestamps in each
+    pixel straight from the raw data, without unpacking and
+    calibration.
+
+    * map_files - function for applying a function to each data file,
+    optionally in a pool of processes. Results are returned in the
+    order of the files.
+
 """
 
+import glob
+import hashlib
 import os
+from concurrent.futures import ProcessPoolExecutor
 
 import numpy as np
 
 from LinoSPAD2.functions.calibrate import calibrate_load
 
 
-def unpack_bin(file, board_number: str, timestamps: int = 512):
+def unpack_bin(
+    file,
+    board_number: str,
+    timestamps: int = 512,
+    compact: bool = False,
+    pixels=None,
+    fw_ver: str = "2212b",
+):
     """Unpack data from firmware version 2212.
 
     Unpacks binary-encoded data from LinoSPAD2 firmware version 2212.
@@ -35,6 +62,23 @@ def unpack_bin(file, board_number: str, timestamps: int = 512):
     timestamps : int, optional
         Number of timestamps per TDC per acquisition cycle. The default
         is 512.
+    compact : bool, optional
+        Switch for returning the data in a compact layout: a 2D
+        structured array (TDCs x data) with the fields "pix" (int8,
+        pixel number in the TDC) and "tmsp" (uint32, timestamp in ps).
+        In this layout, invalid timestamps and ends of cycles have a
+        timestamp of 0, and ends of cycles have a pixel number of '-2'.
+        The default is False.
+    pixels : array-like, optional
+        Pixel numbers for which data should be unpacked. Only TDCs that
+        hold these pixels are read from the file, and only timestamps
+        of these pixels are calibrated, all other timestamps are marked
+        as invalid. The default is None, in which case data from all
+        pixels are unpacked.
+    fw_ver : str, optional
+        LinoSPAD2 firmware version, used for finding the TDCs that hold
+        the requested 'pixels'. Versions '2212b' (block) and '2212s'
+        (skip) are recognized. The default is "2212b".
 
     Raises
     ------
@@ -43,93 +87,858 @@ def unpack_bin(file, board_number: str, timestamps: int = 512):
         be a string. FileNotFoundError
         Controller for stopping the script in the case no calibration
         data were found.
+    ValueError
+        Raised when the firmware version is not recognized.
 
     Returns
     -------
     data_all : array-like
-        3D array of pixel coordinates in the TDC and the timestamps.
+        3D array of pixel coordinates in the TDC and the timestamps, or
+        a 2D structured array if 'compact' is True.
 
     """
     # parameter type check
     if isinstance(board_number, str) is not True:
         raise TypeError("'board_number' should be string, 'NL11' or 'A5'")
 
-    # unpack binary data
-    rawFile = np.fromfile(file, dtype=np.uint32)
-    # timestamps are lower 28 bits
-    data_t = (rawFile & 0xFFFFFFF).astype(np.longlong)
-    # pix adress in the given TDC is 2 bits above timestamp
-    data_p = ((rawFile >> 28) & 0x3).astype(np.longlong)
-    data_t[np.where(rawFile < 0x80000000)] = -1
-    # number of acquisition cycle in each datafile
-    cycles = int(len(data_t) / timestamps / 65)
-    # transofrm into matrix 65 by cycles*timestamps
-    data_matrix_p = (
-        data_p.reshape(cycles, 65, timestamps)
-        .transpose((1, 0, 2))
-        .reshape(65, timestamps * cycles)
-    )
+    if pixels is not None:
+        pixels = _block_pixels(pixels, fw_ver)
 
-    data_matrix_t = (
-        data_t.reshape(cycles, 65, timestamps)
-        .transpose((1, 0, 2))
-        .reshape(65, timestamps * cycles)
-    )
-    # cut the 65th TDC that does not hold any actual data from pixels
-    data_matrix_p = data_matrix_p[:-1]
-    data_matrix_t = data_matrix_t[:-1]
-    # insert '-2' at the end of each cycle
-    data_matrix_p = np.insert(
-        data_matrix_p,
-        np.linspace(timestamps, cycles * timestamps, cycles).astype(
-            np.longlong
-        ),
-        -2,
-        1,
+    cal_mat = _load_cal_mat(board_number)
+
+    # unpack binary data, only a chunk of cycles is read at a time
+    raw = _read_raw(file, timestamps, mmap=True)
+
+    data_all = _unpack_cycles(raw, cal_mat, compact, pixels)
+
+    return data_all
+
+
+def unpack_bin_chunks(
+    file,
+    board_number: str,
+    timestamps: int = 512,
+    chunk_cycles: int = 100,
+    compact: bool = False,
+    pixels=None,
+    fw_ver: str = "2212b",
+):
+    """Unpack data from firmware version 2212 in chunks of cycles.
+
+    Memory-friendly version of 'unpack_bin': the data file is
+    memory-mapped and only whole acquisition cycles are read, unpacked
+    and calibrated, a chunk at a time, when the next chunk is requested.
+    Each chunk has the same layout as the output of 'unpack_bin', and
+    concatenating all chunks along the data axis gives the output of
+    'unpack_bin' for the whole file. Incomplete cycles at the end of the
+    file are skipped.
+
+    Parameters
+    ----------
+    file : str
+        '.dat' data file.
+    board_number : str
+        LinoSPAD2 daughterboard number. Either 'A5' or 'NL11' are
+        recognized.
+    timestamps : int, optional
+        Number of timestamps per TDC per acquisition cycle. The default
+        is 512.
+    chunk_cycles : int, optional
+        Number of acquisition cycles in each chunk. The default is 100.
+    compact : bool, optional
+        Switch for returning the data in the compact layout, see
+        'unpack_bin'. The default is False.
+    pixels : array-like, optional
+        Pixel numbers for which data should be unpacked, see
+        'unpack_bin'. The default is None, in which case data from all
+        pixels are unpacked.
+    fw_ver : str, optional
+        LinoSPAD2 firmware version, used for finding the TDCs that hold
+        the requested 'pixels'. The default is "2212b".
+
+    Raises
+    ------
+    TypeError
+        Controller for the type of 'board_number' parameter which should
+        be a string.
+    FileNotFoundError
+        Controller for stopping the script in the case no calibration
+        data were found.
+    ValueError
+        Raised when the firmware version is not recognized.
+
+    Yields
+    ------
+    data_all : array-like
+        3D array of pixel coordinates in the TDC and the timestamps, or
+        a 2D structured array if 'compact' is True, for 'chunk_cycles'
+        acquisition cycles.
+
+    """
+    # parameter type check
+    if isinstance(board_number, str) is not True:
+        raise TypeError("'board_number' should be string, 'NL11' or 'A5'")
+
+    if pixels is not None:
+        pixels = _block_pixels(pixels, fw_ver)
+
+    cal_mat = _load_cal_mat(board_number)
+
+    raw = _read_raw(file, timestamps, mmap=True)
+
+    for start in range(0, len(raw), chunk_cycles):
+        yield _unpack_cycles(
+            raw[start : start + chunk_cycles], cal_mat, compact, pixels
+        )
+
+
+def unpack_bin_sparse(
+    file,
+    board_number: str,
+    fw_ver: str,
+    timestamps: int = 512,
+    pixels=None,
+    cache_dir: str = None,
+    cache_size: float = 10e9,
+):
+    """Unpack data from firmware version 2212 into a per-pixel index.
+
+    Unpacks and calibrates data as 'unpack_bin' does, but keeps only
+    valid timestamps, grouped by pixel and by acquisition cycle: a flat
+    array of timestamps and a matrix of offsets, so that the timestamps
+    of pixel 'p' in cycle 'c' are
+
+        tmsp[offsets[p, c] : offsets[p, c + 1]]
+
+    and all timestamps of pixel 'p' are
+
+        tmsp[offsets[p, 0] : offsets[p, -1]].
+
+    Parameters
+    ----------
+    file : str
+        '.dat' data file.
+    board_number : str
+        LinoSPAD2 daughterboard number. Either 'A5' or 'NL11' are
+        recognized.
+    fw_ver : str
+        LinoSPAD2 firmware version. Versions '2212b' (block) and
+        '2212s' (skip) are recognized.
+    timestamps : int, optional
+        Number of timestamps per TDC per acquisition cycle. The default
+        is 512.
+    pixels : array-like, optional
+        Pixel numbers for which data should be unpacked. Only TDCs that
+        hold these pixels are read from the file, and only timestamps
+        of these pixels are calibrated and kept; other pixels have no
+        timestamps in the output. The default is None, in which case
+        data from all pixels are unpacked.
+    cache_dir : str, optional
+        Folder for caching the unpacked data. Data from all pixels are
+        saved there as memory-mappable '.npy' files, keyed by the data
+        file path, modification time and size, 'board_number',
+        'fw_ver', 'timestamps' and the calibration matrix, and loaded
+        instead of unpacking the file again. On a cache miss, data from
+        all pixels are unpacked even when 'pixels' are given, which
+        takes about as long as unpacking the file without pixel
+        selection and memory of about the size of the cached data.
+        The default is None, in which case no cache is used.
+    cache_size : float, optional
+        Maximum size of the cache in bytes. When exceeded, least
+        recently used data are removed from the cache. The default is
+        10e9 (10 GB).
+
+    Raises
+    ------
+    TypeError
+        Controller for the type of 'board_number' and 'fw_ver'
+        parameters which should be strings.
+    ValueError
+        Raised when the firmware version is not recognized.
+    FileNotFoundError
+        Controller for stopping the script in the case no calibration
+        data were found.
+
+    Returns
+    -------
+    tmsp : ndarray
+        Valid timestamps in ps, grouped by pixel and cycle.
+    offsets : ndarray
+        Matrix of 256 pixels x (cycles + 1) of positions in 'tmsp'
+        where data of each pixel and cycle start.
+
+    """
+    # parameter type check
+    if isinstance(board_number, str) is not True:
+        raise TypeError("'board_number' should be string, 'NL11' or 'A5'")
+    if isinstance(fw_ver, str) is not True:
+        raise TypeError("'fw_ver' should be string, '2212b' or '2212s'")
+    if fw_ver not in ("2212b", "2212s"):
+        raise ValueError("Firmware version is not recognized.")
+
+    cal_mat = _load_cal_mat(board_number)
+
+    if cache_dir is None:
+        if pixels is not None:
+            pixels = _block_pixels(pixels, fw_ver)
+        return _sparse(file, cal_mat, fw_ver, timestamps, pixels)
+
+    key = _cache_key(file, board_number, fw_ver, timestamps, cal_mat)
+    try:
+        tmsp = np.load(
+            os.path.join(cache_dir, "{}_tmsp.npy".format(key)), mmap_mode="r"
+        )
+        offsets = np.load(
+            os.path.join(cache_dir, "{}_offsets.npy".format(key)),
+            mmap_mode="r",
+        )
+        # mark as recently used
+        os.utime(os.path.join(cache_dir, "{}_tmsp.npy".format(key)))
+    except FileNotFoundError:
+        # all pixels are cached, so that later calls with any pixels
+        # are hits; the file is unpacked in chunks of cycles
+        tmsp, offsets = _sparse(file, cal_mat, fw_ver, timestamps)
+        _cache_save(cache_dir, key, tmsp, offsets, cache_size)
+
+    if pixels is not None:
+        tmsp, offsets = _select_pixels(tmsp, offsets, pixels)
+
+    return tmsp, offsets
+
+
+def _sparse(file, cal_mat, fw_ver: str, timestamps: int, pixels=None):
+    """Unpack data into a per-pixel index, see 'unpack_bin_sparse'.
+
+    Parameters
+    ----------
+    file : str
+        '.dat' data file.
+    cal_mat : ndarray
+        Calibration matrix of 256x140.
+    fw_ver : str
+        LinoSPAD2 firmware version.
+    timestamps : int
+        Number of timestamps per TDC per acquisition cycle.
+    pixels : array-like, optional
+        Pixel numbers in block numbering for which data should be
+        unpacked. The default is None, in which case data from all
+        pixels are unpacked.
+
+    Returns
+    -------
+    tmsp : ndarray
+        Valid timestamps in ps, grouped by pixel and cycle.
+    offsets : ndarray
+        Matrix of 256 pixels x (cycles + 1) of positions in 'tmsp'
+        where data of each pixel and cycle start.
+
+    """
+    raw = _read_raw(file, timestamps, mmap=True)
+    cycles = len(raw)
+    chunk = _chunk_cycles(timestamps)
+
+    # first pass: number of timestamps of each pixel in each cycle,
+    # which give the offsets
+    counts = np.zeros((256, cycles), dtype=np.longlong)
+    for start in range(0, cycles, chunk):
+        tdcs, counts_chunk, _, _ = _sparse_chunk(
+            raw[start : start + chunk], cal_mat, pixels
+        )
+        pix = _tdc_pixels(tdcs, fw_ver)
+        counts[pix, start : start + counts_chunk.shape[2]] = counts_chunk
+
+    # pixels follow each other in the output
+    offsets = np.zeros((256, cycles + 1), dtype=np.longlong)
+    offsets[:, 1:] = np.cumsum(counts).reshape(counts.shape)
+    offsets[1:, 0] = offsets[:-1, -1]
+    del counts
+
+    # second pass: counting sort of timestamps in each chunk by pixel
+    # coordinate, after which timestamps of each pixel are contiguous
+    # both in the chunk and in the output, where they start at the
+    # offset of the first cycle of the chunk
+    tmsp = np.empty(offsets[-1, -1], dtype=np.longlong)
+    for start in range(0, cycles, chunk):
+        tdcs, counts_chunk, data_p, tmsp_chunk = _sparse_chunk(
+            raw[start : start + chunk], cal_mat, pixels
+        )
+        # stable sort of 8-bit keys is a radix sort in numpy
+        tmsp_chunk = tmsp_chunk[np.argsort(data_p, kind="stable")]
+        pix = _tdc_pixels(tdcs, fw_ver).ravel()
+        lengths = counts_chunk.sum(axis=2).ravel()
+        ends = np.cumsum(lengths)
+        for pixel, length, end in zip(pix, lengths, ends):
+            pos = offsets[pixel, start]
+            tmsp[pos : pos + length] = tmsp_chunk[end - length : end]
+
+    return tmsp, offsets
+
+
+def _sparse_chunk(raw, cal_mat, pixels=None):
+    """Decode a chunk of cycles into valid timestamps and their counts.
+
+    Parameters
+    ----------
+    raw : ndarray
+        Raw 32-bit words as a matrix of cycles x 65 TDCs x timestamps.
+    cal_mat : ndarray
+        Calibration matrix of 256x140.
+    pixels : array-like, optional
+        Pixel numbers in block numbering for which data should be
+        unpacked. The default is None, in which case data from all
+        pixels are unpacked.
+
+    Returns
+    -------
+    tdcs : ndarray
+        Numbers of TDCs that were decoded.
+    counts : ndarray
+        Number of valid timestamps for each of 4 pixel coordinates,
+        TDC and cycle.
+    data_p : ndarray
+        Pixel coordinate in the TDC of each timestamp.
+    tmsp : ndarray
+        Valid timestamps in ps, ordered by TDC, cycle and position in
+        the cycle.
+
+    """
+    tdcs, valid, data_p, tmsp = _decode(raw, cal_mat, pixels)
+
+    # same truncation to integer ps as in 'unpack_bin', timestamps
+    # that are not positive are dropped
+    tmsp = tmsp.astype(np.longlong)
+    ind = tmsp > 0
+    valid[valid] = ind
+
+    counts = np.stack(
+        [np.count_nonzero(valid & (data_p == p), axis=2) for p in range(4)]
     )
 
-    data_matrix_t = np.insert(
-        data_matrix_t,
-        np.linspace(timestamps, cycles * timestamps, cycles).astype(
-            np.longlong
-        ),
-        -2,
-        1,
+    return tdcs, counts, data_p[valid].astype(np.uint8), tmsp[ind]
+
+
+def _tdc_pixels(tdcs, fw_ver: str):
+    """Return pixel numbers of 4 pixel coordinates in the given TDCs.
+
+    Parameters
+    ----------
+    tdcs : ndarray
+        TDC numbers.
+    fw_ver : str
+        LinoSPAD2 firmware version.
+
+    Returns
+    -------
+    pix : ndarray
+        Pixel numbers, 4 pixel coordinates x TDCs.
+
+    """
+    if fw_ver == "2212b":
+        return tdcs * 4 + np.arange(4).reshape(-1, 1)
+    return np.arange(4).reshape(-1, 1) * 64 + tdcs
+
+
+def _select_pixels(tmsp, offsets, pixels):
+    """Keep timestamps of the given pixels only in a per-pixel index.
+
+    Parameters
+    ----------
+    tmsp : ndarray
+        Valid timestamps, grouped by pixel and cycle.
+    offsets : ndarray
+        Matrix of 256 pixels x (cycles + 1) of positions in 'tmsp'.
+    pixels : array-like
+        Pixel numbers to keep.
+
+    Returns
+    -------
+    tmsp : ndarray
+        Valid timestamps of the given pixels.
+    offsets : ndarray
+        Matrix of 256 pixels x (cycles + 1) of positions in 'tmsp';
+        other pixels have no timestamps.
+
+    """
+    requested = np.zeros(256, dtype=bool)
+    requested[pixels] = True
+
+    counts = np.diff(offsets, axis=1) * requested.reshape(-1, 1)
+    tmsp = tmsp[np.repeat(requested, offsets[:, -1] - offsets[:, 0])]
+
+    cycles = counts.shape[1]
+    offsets = np.zeros(256 * cycles + 1, dtype=np.longlong)
+    np.cumsum(counts.ravel(), out=offsets[1:])
+    offsets = offsets[
+        np.arange(256).reshape(-1, 1) * cycles + np.arange(cycles + 1)
+    ]
+
+    return tmsp, offsets
+
+
+def _cache_key(file, board_number: str, fw_ver: str, timestamps: int, cal_mat):
+    """Calculate the cache key of the unpacked data.
+
+    Parameters
+    ----------
+    file : str
+        '.dat' data file.
+    board_number : str
+        LinoSPAD2 daughterboard number.
+    fw_ver : str
+        LinoSPAD2 firmware version.
+    timestamps : int
+        Number of timestamps per TDC per acquisition cycle.
+    cal_mat : ndarray
+        Calibration matrix of 256x140.
+
+    Returns
+    -------
+    key : str
+        Hash of the data file path, modification time and size, the
+        unpacking parameters and the calibration matrix.
+
+    """
+    stat = os.stat(file)
+    key = hashlib.sha1(
+        repr(
+            (
+                os.path.abspath(file),
+                stat.st_mtime_ns,
+                stat.st_size,
+                board_number,
+                fw_ver,
+                timestamps,
+            )
+        ).encode()
     )
-    # combine both matrices into a single one, where each cell holds pix
-    # coordinates in the TDC and the timestamp
-    data_all = np.stack((data_matrix_p, data_matrix_t), axis=2).astype(
-        np.longlong
+    key.update(np.ascontiguousarray(cal_mat).tobytes())
+
+    return key.hexdigest()
+
+
+def _cache_save(cache_dir: str, key: str, tmsp, offsets, cache_size: float):
+    """Save unpacked data into the cache and evict old data.
+
+    Files are written under temporary names first, so that other
+    processes never load partially written data.
+
+    Parameters
+    ----------
+    cache_dir : str
+        Folder for caching the unpacked data.
+    key : str
+        Cache key of the data.
+    tmsp : ndarray
+        Valid timestamps, grouped by pixel and cycle.
+    offsets : ndarray
+        Matrix of 256 pixels x (cycles + 1) of positions in 'tmsp'.
+    cache_size : float
+        Maximum size of the cache in bytes.
+
+    Returns
+    -------
+    None.
+
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    # offsets are saved first, as the timestamps file marks the entry
+    # as complete
+    for name, data in (("offsets", offsets), ("tmsp", tmsp)):
+        file_tmp = os.path.join(
+            cache_dir, "{}_{}.{}.tmp.npy".format(key, name, os.getpid())
+        )
+        np.save(file_tmp, data)
+        os.replace(
+            file_tmp, os.path.join(cache_dir, "{}_{}.npy".format(key, name))
+        )
+
+    # least recently used entries are removed first
+    entries = {}
+    for file in glob.glob(os.path.join(cache_dir, "*_tmsp.npy")):
+        entry = file[: -len("_tmsp.npy")]
+        try:
+            size = os.path.getsize(file)
+            size += os.path.getsize(entry + "_offsets.npy")
+            entries[entry] = (os.path.getmtime(file), size)
+        except FileNotFoundError:
+            continue
+
+    total = sum(size for _, size in entries.values())
+    for entry in sorted(entries, key=lambda entry: entries[entry][0]):
+        if total <= cache_size:
+            break
+        if os.path.basename(entry) == key:
+            continue
+        for name in ("tmsp", "offsets"):
+            # files can be removed by another process or still be
+            # memory-mapped
+            try:
+                os.remove("{}_{}.npy".format(entry, name))
+            except OSError:
+                pass
+        total -= entries[entry][1]
+
+
+def count_valid(
+    file, fw_ver: str, timestamps: int = 512, chunk_cycles: int = 1000
+):
+    """Count valid timestamps in each pixel of a data file.
+
+    Counts are collected from the raw 32-bit words of a memory-mapped
+    file in chunks of acquisition cycles, without calibration. The top
+    4 bits of each word (validity bit and pixel coordinates) together
+    with the TDC number are counted with a single 'np.bincount' per
+    chunk.
+
+    Parameters
+    ----------
+    file : str
+        '.dat' data file.
+    fw_ver : str
+        LinoSPAD2 firmware version. Versions '2212b' (block) and
+        '2212s' (skip) are recognized.
+    timestamps : int, optional
+        Number of timestamps per TDC per acquisition cycle. The default
+        is 512.
+    chunk_cycles : int, optional
+        Number of acquisition cycles read at once. The default is 1000.
+
+    Raises
+    ------
+    TypeError
+        Raised when 'fw_ver' is not a string.
+    ValueError
+        Raised when the firmware version is not recognized.
+
+    Returns
+    -------
+    valid_per_pixel : ndarray
+        Number of valid timestamps in each of the 256 pixels.
+
+    """
+    # parameter type check
+    if isinstance(fw_ver, str) is not True:
+        raise TypeError("'fw_ver' should be string, '2212b' or '2212s'")
+    if fw_ver not in ("2212b", "2212s"):
+        raise ValueError("Firmware version is not recognized.")
+
+    rawFile = np.memmap(file, dtype=np.uint32, mode="r")
+    cycles = int(len(rawFile) / timestamps / 65)
+    rawFile = rawFile[: cycles * 65 * timestamps].reshape(
+        cycles, 65, timestamps
     )
 
-    # path to the current script, two levels up (the script itself is in
-    # the path) and two levels down to the calibration data
-    pix_coor = np.arange(256).reshape(64, 4)
-    path_calib_data = (
-        os.path.realpath(__file__) + "/../.." + "/params/calibration_data"
+    # 16 values of the top 4 bits for each of the 64 TDCs
+    tdc_bins = (np.arange(64, dtype=np.uint32) * 16).reshape(1, -1, 1)
+    counts = np.zeros(64 * 16, dtype=np.longlong)
+    for start in range(0, cycles, chunk_cycles):
+        # cut the 65th TDC that does not hold any actual data from
+        # pixels
+        raw = rawFile[start : start + chunk_cycles, :-1]
+        counts += np.bincount(
+            ((raw >> 28) + tdc_bins).ravel(), minlength=64 * 16
+        )
+
+    # valid words have the 31st bit set; pix adress in the given TDC
+    # is the two lowest of the 4 bits
+    counts = counts.reshape(64, 2, 2, 4)[:, 1].sum(axis=1)
+
+    if fw_ver == "2212b":
+        return counts.ravel()
+    return counts.T.ravel()
+
+
+def map_files(func, files, workers: int = 1):
+    """Apply a function to each data file.
+
+    With more than one worker, files are processed in a pool of
+    processes. Results are yielded in the order of the files either
+    way, so that they can be merged deterministically.
+
+    Parameters
+    ----------
+    func : callable
+        Function that takes a path to a data file. Should be picklable,
+        e.g., a module-level function or a 'functools.partial' of one.
+    files : list
+        Paths to data files. Should be absolute when working with a
+        pool of processes.
+    workers : int, optional
+        Number of processes. The default is 1, in which case files are
+        processed in the current process.
+
+    Yields
+    ------
+    result
+        Output of 'func' for each file.
+
+    """
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            yield from executor.map(func, files)
+    else:
+        yield from map(func, files)
+
+
+def _load_cal_mat(board_number: str):
+    """Load the calibration matrix for the given board.
+
+    Parameters
+    ----------
+    board_number : str
+        LinoSPAD2 daughterboard number.
+
+    Raises
+    ------
+    FileNotFoundError
+        Raised when no calibration data were found.
+
+    Returns
+    -------
+    cal_mat : ndarray
+        Calibration matrix of 256x140.
+
+    """
+    # path to the folder of the current script, one level up and two
+    # levels down to the calibration data
+    path_calib_data = os.path.join(
+        os.path.dirname(os.path.realpath(__file__)),
+        "..",
+        "params",
+        "calibration_data",
     )
 
     try:
-        cal_mat = calibrate_load(path_calib_data, board_number)
+        return calibrate_load(path_calib_data, board_number)
     except FileNotFoundError:
         raise FileNotFoundError(
             "No .csv file with the calibration data was found, check the path "
             "or run the calibration."
         )
 
-    for i in range(256):
-        # transform pixel number to TDC number and pixel coordinates in
-        # that TDC (from 0 to 3)
-        tdc, pix = np.argwhere(pix_coor == i)[0]
-        # find data from that pixel
-        ind = np.where(data_all[tdc].T[0] == pix)[0]
-        # cut non-valid timestamps ('-1's)
-        ind = ind[np.where(data_all[tdc].T[1][ind] >= 0)[0]]
-        if not np.any(ind):
-            continue
-        # apply calibration
-        data_all[tdc].T[1][ind] = (
-            data_all[tdc].T[1][ind] - data_all[tdc].T[1][ind] % 140
-        ) * 17.857 + cal_mat[i, (data_all[tdc].T[1][ind] % 140)]
 
-    return data_all
+def _unpack_cycles(raw, cal_mat, compact: bool = False, pixels=None):
+    """Unpack and calibrate raw words into a preallocated output matrix.
+
+    The output is allocated once with the '-2' columns, which indicate
+    the end of each acquisition cycle, already in place. Raw words are
+    then decoded and calibrated in chunks of cycles, and pixel
+    coordinates and timestamps of each chunk are written directly into
+    the output.
+
+    Parameters
+    ----------
+    raw : ndarray
+        Raw 32-bit words as a matrix of cycles x 65 TDCs x timestamps,
+        can be memory-mapped.
+    cal_mat : ndarray
+        Calibration matrix of 256x140.
+    compact : bool, optional
+        Switch for the compact output layout, see 'unpack_bin'. The
+        default is False.
+    pixels : array-like, optional
+        Pixel numbers, as 4 * TDC + pixel coordinates in that TDC, for
+        which data should be unpacked. The default is None, in which
+        case data from all pixels are unpacked.
+
+    Raises
+    ------
+    ValueError
+        Raised when timestamps do not fit into the compact layout.
+
+    Returns
+    -------
+    data_all : ndarray
+        3D array of pixel coordinates in the TDC and the timestamps, or
+        a 2D structured array for the compact layout.
+
+    """
+    cycles, _, timestamps = raw.shape
+
+    if compact is True:
+        data_all = np.empty(
+            (64, cycles, timestamps + 1),
+            dtype=[("pix", np.int8), ("tmsp", np.uint32)],
+        )
+        data_p_all, data_t_all = data_all["pix"], data_all["tmsp"]
+        # timestamps are unsigned, invalid ones and ends of cycles are 0
+        invalid, cycle_end = 0, 0
+    else:
+        data_all = np.empty((64, cycles, timestamps + 1, 2), dtype=np.longlong)
+        data_p_all, data_t_all = data_all[..., 0], data_all[..., 1]
+        invalid, cycle_end = -1, -2
+
+    # '-2' at the end of each cycle
+    data_p_all[:, :, -1] = -2
+    data_t_all[:, :, -1] = cycle_end
+    if pixels is not None:
+        # TDCs that were not read hold no data
+        data_p_all[:, :, :-1] = -1
+    data_t_all[:, :, :-1] = invalid
+
+    # decode and calibrate a chunk of cycles at a time, so that only
+    # the output and a single chunk are held in memory
+    chunk = _chunk_cycles(timestamps)
+    for start in range(0, cycles, chunk):
+        stop = start + chunk
+        tdcs, valid, data_p, tmsp = _decode(raw[start:stop], cal_mat, pixels)
+
+        if compact is True and len(tmsp):
+            if np.nanmax(tmsp) > np.iinfo(np.uint32).max:
+                raise ValueError(
+                    "Timestamps do not fit into the compact layout, use "
+                    "'compact=False'."
+                )
+
+        if pixels is None:
+            data_p_all[:, start:stop, :-1] = data_p
+            data_t_all[:, start:stop, :-1][valid] = tmsp
+        else:
+            data_p_all[tdcs, start:stop, :-1] = data_p
+            data_t = np.full(valid.shape, invalid, dtype=data_t_all.dtype)
+            data_t[valid] = tmsp
+            data_t_all[tdcs, start:stop, :-1] = data_t
+
+    return data_all.reshape(
+        (64, cycles * (timestamps + 1)) + data_all.shape[3:]
+    )
+
+
+def _decode(raw, cal_mat, pixels=None):
+    """Decode raw words and calibrate all valid timestamps.
+
+    The calibration is applied to all valid timestamps in a single pass,
+    where pixel numbers (rows of the calibration matrix) are derived
+    as 4 * TDC + pixel coordinates in that TDC.
+
+    Parameters
+    ----------
+    raw : ndarray
+        Raw 32-bit words as a matrix of cycles x 65 TDCs x timestamps.
+    cal_mat : ndarray
+        Calibration matrix of 256x140.
+    pixels : array-like, optional
+        Pixel numbers, as 4 * TDC + pixel coordinates in that TDC, for
+        which data should be decoded. Only TDCs that hold these pixels
+        are read and only timestamps of these pixels are valid. The
+        default is None, in which case data from all pixels are decoded.
+
+    Returns
+    -------
+    tdcs : ndarray
+        Numbers of TDCs that were decoded.
+    valid : ndarray
+        Mask of valid timestamps, TDCs x cycles x timestamps.
+    data_p : ndarray
+        Pixel coordinates in the TDC, TDCs x cycles x timestamps.
+    tmsp : ndarray
+        Calibrated valid timestamps in ps, in the order of 'valid'.
+
+    """
+    if pixels is None:
+        tdcs = np.arange(64)
+        # cut the 65th TDC that does not hold any actual data from pixels
+        raw = raw[:, :-1]
+    else:
+        tdcs = np.unique(pixels // 4)
+        # read only the TDCs that hold the requested pixels
+        raw = raw[:, tdcs]
+    raw = raw.transpose((1, 0, 2))
+
+    # only valid timestamps are calibrated
+    valid = raw >= 0x80000000
+    # pix adress in the given TDC is 2 bits above timestamp
+    data_p = (raw >> 28) & 0x3
+    if pixels is not None:
+        requested = np.zeros(256, dtype=bool)
+        requested[pixels] = True
+        valid &= requested[tdcs.reshape(-1, 1, 1) * 4 + data_p]
+    # timestamps are lower 28 bits
+    tmsp = raw[valid] & 0xFFFFFFF
+    pixels = tdcs[np.nonzero(valid)[0]] * 4 + data_p[valid]
+    tmsp = (tmsp - tmsp % 140) * 17.857 + cal_mat[pixels, tmsp % 140]
+
+    return tdcs, valid, data_p, tmsp
+
+
+def _chunk_cycles(timestamps: int):
+    """Return the number of cycles that are decoded at a time.
+
+    Chunks hold about 2**18 raw words, so that temporary arrays of the
+    decoding take about 10 MB regardless of the file size.
+
+    Parameters
+    ----------
+    timestamps : int
+        Number of timestamps per TDC per acquisition cycle.
+
+    Returns
+    -------
+    int
+        Number of acquisition cycles in a chunk, at least 1.
+
+    """
+    return max(1, 2**18 // (65 * timestamps))
+
+
+def _read_raw(file, timestamps: int, mmap: bool = False):
+    """Read raw words from a data file as a matrix of whole cycles.
+
+    Parameters
+    ----------
+    file : str
+        '.dat' data file.
+    timestamps : int
+        Number of timestamps per TDC per acquisition cycle.
+    mmap : bool, optional
+        Switch for memory-mapping the file instead of reading it
+        completely, so that only the parts that are used are read. The
+        default is False.
+
+    Returns
+    -------
+    raw : ndarray
+        Raw 32-bit words as a matrix of cycles x 65 TDCs x timestamps.
+
+    """
+    if mmap is True:
+        rawFile = np.memmap(file, dtype=np.uint32, mode="r")
+        # number of acquisition cycle in each datafile
+        cycles = int(len(rawFile) / timestamps / 65)
+        rawFile = np.asarray(rawFile[: cycles * 65 * timestamps])
+    else:
+        rawFile = np.fromfile(file, dtype=np.uint32)
+        cycles = int(len(rawFile) / timestamps / 65)
+
+    return rawFile.reshape(cycles, 65, timestamps)
+
+
+def _block_pixels(pixels, fw_ver: str):
+    """Convert pixel numbers to 4 * TDC + pixel coordinates in that TDC.
+
+    Parameters
+    ----------
+    pixels : array-like
+        Pixel numbers.
+    fw_ver : str
+        LinoSPAD2 firmware version. Versions '2212b' (block) and
+        '2212s' (skip) are recognized.
+
+    Raises
+    ------
+    ValueError
+        Raised when the firmware version is not recognized.
+
+    Returns
+    -------
+    pixels : ndarray
+        Pixel numbers as 4 * TDC + pixel coordinates in that TDC.
+
+    """
+    pixels = np.asarray(pixels, dtype=np.longlong).ravel()
+    if fw_ver == "2212b":
+        return pixels
+    elif fw_ver == "2212s":
+        return pixels % 64 * 4 + pixels // 64
+    else:
+        raise ValueError("Firmware version is not recognized.")
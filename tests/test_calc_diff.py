@@ -0,0 +1,114 @@
+import unittest
+
+import numpy as np
+
+from LinoSPAD2.functions.calc_diff import (
+    calc_diff_2212,
+    calc_diff_2212_pairs,
+    calc_hist_2212,
+    rebin_hist_2212,
+)
+
+
+class TestCalcDiff(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        self.data1 = rng.integers(-1, 100000, 300)
+        self.data2 = rng.integers(-1, 100000, 300)
+        self.cycle_ends = np.array([0, 50, 120, 121, 300])
+        self.delta_window = 10e3
+
+    def test_calc_diff_2212(self):
+        # Compare with all differences calculated cycle by cycle
+        deltas_expected = []
+        for cyc in range(len(self.cycle_ends) - 1):
+            start, end = self.cycle_ends[cyc], self.cycle_ends[cyc + 1]
+            tmsp1 = self.data1[start:end][self.data1[start:end] > 0]
+            tmsp2 = self.data2[start:end][self.data2[start:end] > 0]
+            deltas = (tmsp2.reshape(1, -1) - tmsp1.reshape(-1, 1)).ravel()
+            deltas_expected.extend(deltas[np.abs(deltas) < self.delta_window])
+
+        deltas = calc_diff_2212(
+            self.data1, self.data2, self.cycle_ends, self.delta_window
+        )
+
+        self.assertTrue(
+            np.array_equal(np.sort(deltas), np.sort(deltas_expected))
+        )
+
+    def test_calc_diff_2212_empty(self):
+        # No valid timestamps in the first pixel
+        deltas = calc_diff_2212(
+            -np.ones(300), self.data2, self.cycle_ends, self.delta_window
+        )
+
+        self.assertEqual(len(deltas), 0)
+
+    def test_calc_diff_2212_pairs(self):
+        # Compare with timestamp differences calculated pair by pair
+        rng = np.random.default_rng(1)
+        counts = rng.integers(0, 20, (256, 10))
+        counts[7] = 0
+        offsets = np.zeros((256, 11), dtype=np.int64)
+        offsets[:, 1:] = np.cumsum(counts.ravel()).reshape(256, 10)
+        offsets[1:, 0] = offsets[:-1, -1]
+        tmsp = rng.integers(1, 50000, offsets[-1, -1])
+        pixels = [5, 3, 7, 200]
+
+        deltas_pairs = calc_diff_2212_pairs(
+            tmsp, offsets, pixels, self.delta_window
+        )
+
+        self.assertEqual(
+            list(deltas_pairs),
+            [(5, 7), (5, 200), (3, 5), (3, 7), (3, 200), (7, 200)],
+        )
+        for (q, w), deltas in deltas_pairs.items():
+            deltas_expected = calc_diff_2212(
+                tmsp,
+                tmsp,
+                offsets[q],
+                self.delta_window,
+                cycle_ends2=offsets[w],
+            )
+            self.assertTrue(
+                np.array_equal(np.sort(deltas), np.sort(deltas_expected))
+            )
+
+    def test_calc_hist_2212(self):
+        # Compare with numpy histogram in the same bins
+        deltas = calc_diff_2212(
+            self.data1, self.data2, self.cycle_ends, self.delta_window
+        )
+
+        counts, bin_edges = calc_hist_2212(deltas, self.delta_window)
+
+        self.assertTrue(np.allclose(np.diff(bin_edges), 17.857))
+        self.assertTrue(bin_edges[0] <= -self.delta_window)
+        self.assertTrue(bin_edges[-1] >= self.delta_window)
+        self.assertTrue(
+            np.array_equal(counts, np.histogram(deltas, bins=bin_edges)[0])
+        )
+
+    def test_rebin_hist_2212(self):
+        # Compare with numpy histogram in the merged bins of the range
+        deltas = calc_diff_2212(
+            self.data1, self.data2, self.cycle_ends, self.delta_window
+        )
+        counts, bin_edges = calc_hist_2212(deltas, self.delta_window)
+
+        counts, bin_edges = rebin_hist_2212(
+            counts, bin_edges, 3, hist_range=(-5e3, 2e3)
+        )
+
+        self.assertTrue(np.allclose(np.diff(bin_edges), 3 * 17.857))
+        self.assertTrue(bin_edges[0] >= -5e3)
+        self.assertTrue(bin_edges[-1] <= 2e3)
+        self.assertTrue(bin_edges[-1] > 2e3 - 3 * 17.857)
+        self.assertTrue(
+            np.array_equal(counts, np.histogram(deltas, bins=bin_edges)[0])
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,139 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from LinoSPAD2.functions.calibrate import (
+    calibrate_load,
+    calibrate_save,
+    calibrate_update,
+)
+
+
+class TestCalibrate(unittest.TestCase):
+    def setUp(self):
+        self.path = os.path.join(
+            os.path.dirname(os.path.realpath(__file__)),
+            "..",
+            "src",
+            "LinoSPAD2",
+            "params",
+            "calibration_data",
+        )
+        self.board_number = "A5"
+
+    def test_calibrate_load(self):
+        # Matrix should be parsed once and reused
+        cal_mat = calibrate_load(self.path, self.board_number)
+
+        self.assertEqual(cal_mat.shape, (256, 140))
+        self.assertIs(calibrate_load(self.path, self.board_number), cal_mat)
+        self.assertFalse(cal_mat.flags.writeable)
+
+    def test_calibrate_load_updated(self):
+        # Modified table or a binary copy should be loaded again
+        with tempfile.TemporaryDirectory() as path:
+            file = os.path.join(path, "Calibration_data_A5.csv")
+            shutil.copy(
+                os.path.join(self.path, "Calibration_data_A5.csv"), file
+            )
+            cal_mat = calibrate_load(path, self.board_number)
+
+            os.utime(file, (0, 0))
+            cal_mat_csv = calibrate_load(path, self.board_number)
+            self.assertIsNot(cal_mat_csv, cal_mat)
+            self.assertTrue(
+                np.array_equal(cal_mat_csv, cal_mat, equal_nan=True)
+            )
+
+            np.save(os.path.join(path, "Calibration_data_A5.npy"), cal_mat)
+            os.utime(file, (1, 1))
+            cal_mat_npy = calibrate_load(path, self.board_number)
+            self.assertIsNot(cal_mat_npy, cal_mat_csv)
+            self.assertTrue(
+                np.array_equal(cal_mat_npy, cal_mat, equal_nan=True)
+            )
+
+    def test_calibrate_save(self):
+        # Compare with histograms of TDC codes collected pixel by pixel
+        rng = np.random.default_rng(0)
+        timestamps = 10
+        raw = rng.integers(0, 2**32, (2, 7, 256, timestamps), dtype=np.uint64)
+        raw = raw.astype(np.uint32)
+
+        data = (raw & 0xFFFFFFF) % 140
+        data = data.transpose((2, 0, 1, 3)).reshape(256, -1)
+        valid = (raw >= 0x80000000).transpose((2, 0, 1, 3)).reshape(256, -1)
+        cal_mat_expected = np.zeros((256, 140))
+        for i in range(256):
+            counts, _ = np.histogram(data[i][valid[i]], bins=np.arange(141))
+            cal_mat_expected[i] = (
+                np.cumsum(counts) / np.cumsum(counts).max() * 2500
+            )
+
+        with tempfile.TemporaryDirectory() as path:
+            # two data files, read in chunks of cycles
+            raw[0].tofile(os.path.join(path, "data_1.dat"))
+            raw[1].tofile(os.path.join(path, "data_2.dat"))
+            calibrate_save(path, timestamps, chunk_cycles=3)
+            cal_mat = np.load(os.path.join(path, "Calibration_data.npy"))
+
+        self.assertTrue(np.array_equal(cal_mat, cal_mat_expected))
+
+    def test_calibrate_update(self):
+        # New versions are saved only with enough new data
+        rng = np.random.default_rng(1)
+        timestamps = 10
+        raw = rng.integers(0, 2**32, (4, 5, 65, timestamps), dtype=np.uint64)
+        raw = raw.astype(np.uint32)
+        # about half of the random words are valid
+        threshold = raw[:2, :, :-1].size // 2 * 0.9
+
+        with tempfile.TemporaryDirectory() as path:
+            path_state = os.path.join(path, "state")
+            raw[0].tofile(os.path.join(path, "data_1.dat"))
+            file_v1 = calibrate_update(
+                path, path_state, "A5", timestamps, threshold=threshold
+            )
+            self.assertIsNone(file_v1)
+
+            # first file is not used again
+            raw[1].tofile(os.path.join(path, "data_2.dat"))
+            file_v1 = calibrate_update(
+                path, path_state, "A5", timestamps, threshold=threshold
+            )
+            self.assertTrue(file_v1.endswith("Calibration_data_A5_v0001.csv"))
+            self.assertIsNone(
+                calibrate_update(
+                    path, path_state, "A5", timestamps, threshold=threshold
+                )
+            )
+
+            raw[2].tofile(os.path.join(path, "data_3.dat"))
+            raw[3].tofile(os.path.join(path, "data_4.dat"))
+            file_v2 = calibrate_update(
+                path, path_state, "A5", timestamps, threshold=threshold
+            )
+            self.assertTrue(file_v2.endswith("Calibration_data_A5_v0002.csv"))
+
+            # latest version is loaded, same as from all data at once
+            calibrate_save(path, timestamps, "2212b")
+            cal_mat = np.load(os.path.join(path, "Calibration_data.npy"))
+            self.assertTrue(
+                np.array_equal(
+                    calibrate_load(path_state, "A5"),
+                    cal_mat,
+                    equal_nan=True,
+                )
+            )
+
+    def test_calibrate_load_negative(self):
+        # No calibration data for the board
+        with self.assertRaises(FileNotFoundError):
+            calibrate_load(self.path, "B7")
+
+
+if __name__ == "__main__":
+    unittest.main()
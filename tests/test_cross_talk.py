@@ -12,17 +12,20 @@ from LinoSPAD2.functions.cross_talk import collect_ct, plot_ct
 class TestCTFull(unittest.TestCase):
     def setUp(self):
         # Set up test variables
-        self.path = "tests/test_data"
+        self.path = os.path.join(
+            os.path.dirname(os.path.realpath(__file__)), "test_data"
+        )
         self.pixels = np.arange(0, 20, 1)
         self.board_number = "A5"
         self.timestamps = 200
         self.delta_window = 10e3
         self.pix1 = 0
         self.scale = "linear"
+        self.ct_files = os.path.join(
+            self.path, "cross_talk_data", "*CT_data_*.csv*"
+        )
 
     def test_a_collect_ct_positive(self):
-        work_dir = r"{}".format(os.path.realpath(__file__) + "../../..")
-        os.chdir(work_dir)
         # Test positive case of collect_ct function
         collect_ct(
             self.path,
@@ -32,13 +35,32 @@ class TestCTFull(unittest.TestCase):
             self.delta_window,
         )
         # Check if the output file is created and has the correct number of rows
-        file = glob.glob("*CT_data_*.csv*")[0]
+        file = glob.glob(self.ct_files)[0]
         data = pd.read_csv(file, header=None)
         self.assertEqual(len(data), 20)
 
+    def test_a_collect_ct_workers(self):
+        # Test that a pool of processes gives the same output
+        collect_ct(
+            self.path,
+            self.pixels,
+            self.board_number,
+            self.timestamps,
+            self.delta_window,
+        )
+        data = pd.read_csv(glob.glob(self.ct_files)[0])
+        collect_ct(
+            self.path,
+            self.pixels,
+            self.board_number,
+            self.timestamps,
+            self.delta_window,
+            workers=2,
+        )
+        data_workers = pd.read_csv(glob.glob(self.ct_files)[0])
+        self.assertTrue(data.equals(data_workers))
+
     def test_b_collect_ct_negative(self):
-        work_dir = r"{}".format(os.path.realpath(__file__) + "../../..")
-        os.chdir(work_dir)
         # Test negative case of collect_ct function
         with self.assertRaises(TypeError):
             collect_ct(
@@ -47,12 +69,14 @@ class TestCTFull(unittest.TestCase):
 
     def test_c_plot_ct_positive(self):
         # Test positive case of plot_ct function
-        work_dir = r"{}".format(os.path.realpath(__file__) + "../../..")
-        os.chdir(work_dir)
         plot_ct(self.path, self.pix1, self.scale)
         # Check if the plot file is created
         plot_name = "test_data_2212b.dat_test_data_2212b.dat"
-        plot_file = "{plot}_{pix}.png".format(plot=plot_name, pix=self.pix1)
+        plot_file = os.path.join(
+            self.path,
+            "results/cross_talk",
+            "{plot}_{pix}.png".format(plot=plot_name, pix=self.pix1),
+        )
         self.assertTrue(os.path.exists(plot_file))
 
     def test_d_plot_ct_negative(self):
@@ -62,9 +86,11 @@ class TestCTFull(unittest.TestCase):
 
     def tearDownClass():
         # Clean up after tests
-        os.chdir(r"{}".format(os.path.realpath(__file__) + "/.."))
-        shutil.rmtree("test_data/cross_talk_data")
-        shutil.rmtree("test_data/results")
+        path = os.path.join(
+            os.path.dirname(os.path.realpath(__file__)), "test_data"
+        )
+        shutil.rmtree(os.path.join(path, "cross_talk_data"))
+        shutil.rmtree(os.path.join(path, "results"))
 
 
 if __name__ == "__main__":
@@ -2,15 +2,26 @@ import unittest
 import numpy as np
 import os
 import shutil
+import tempfile
+import time
 
-from LinoSPAD2.functions.delta_t import deltas_save, delta_cp
+from LinoSPAD2.functions.delta_t import (
+    deltas_save,
+    deltas_load,
+    delta_cp,
+    hist_load,
+    hist_update,
+)
 from LinoSPAD2.functions.fits import fit_wg
+from LinoSPAD2.functions.synthetic import generate_data
 
 
 class TestDeltasFull(unittest.TestCase):
     def setUp(self):
         # Set up test variables
-        self.path = "tests/test_data"
+        self.path = os.path.join(
+            os.path.dirname(os.path.realpath(__file__)), "test_data"
+        )
         self.pixels = np.arange(0, 5, 1)
         self.board_number = "A5"
         self.fw_ver = "2212b"
@@ -23,8 +34,7 @@ class TestDeltasFull(unittest.TestCase):
 
     def test_a_deltas_save_positive(self):
         # Test positive case for deltas_save function
-        work_dir = r"{}".format(os.path.realpath(__file__) + "../../..")
-        os.chdir(work_dir)
+        work_dir = os.getcwd()
         deltas_save(
             self.path,
             self.pixels,
@@ -35,16 +45,95 @@ class TestDeltasFull(unittest.TestCase):
             self.delta_window,
         )
 
-        # Check if the csv file is created
+        # Check if the csv file is created and the working directory
+        # is not changed
         self.assertTrue(
-            os.path.isfile("delta_ts_data/test_data_2212b-test_data_2212b.csv")
+            os.path.isfile(
+                os.path.join(
+                    self.path,
+                    "delta_ts_data/test_data_2212b-test_data_2212b.csv",
+                )
+            )
+        )
+        self.assertEqual(os.getcwd(), work_dir)
+
+    def test_a_deltas_save_hist(self):
+        # Test saving histograms of timestamp differences
+        deltas_save(
+            self.path,
+            self.pixels,
+            self.rewrite,
+            self.board_number,
+            self.fw_ver,
+            self.timestamps,
+            self.delta_window,
+            save_hist=True,
+            reservoir=10,
         )
 
+        # Check if the npz file is created with all pairs of pixels
+        hist_file = os.path.join(
+            self.path, "delta_ts_data/test_data_2212b-test_data_2212b_hist.npz"
+        )
+        self.assertTrue(os.path.isfile(hist_file))
+        with np.load(hist_file) as hist:
+            self.assertIn("0,4", hist.files)
+            self.assertIn("0,4_sample", hist.files)
+            self.assertEqual(len(hist["bin_edges"]), len(hist["0,4"]) + 1)
+            self.assertLessEqual(len(hist["0,4_sample"]), 10)
+
+    def test_a_deltas_save_hist_no_pairs(self):
+        # A single pixel gives no pairs, only the bins are saved
+        with tempfile.TemporaryDirectory() as path:
+            generate_data(
+                os.path.join(path, "data.dat"),
+                self.fw_ver,
+                5,
+                self.timestamps,
+                seed=0,
+            )
+            deltas_save(
+                path,
+                [3],
+                self.rewrite,
+                self.board_number,
+                self.fw_ver,
+                self.timestamps,
+                self.delta_window,
+                save_hist=True,
+            )
+
+            with np.load(
+                os.path.join(path, "delta_ts_data", "data-data_hist.npz")
+            ) as hist:
+                self.assertEqual(hist.files, ["bin_edges"])
+
+    def test_a_deltas_save_npz(self):
+        # Test saving timestamp differences into a binary file
+        deltas_save(
+            self.path,
+            self.pixels,
+            self.rewrite,
+            self.board_number,
+            self.fw_ver,
+            self.timestamps,
+            self.delta_window,
+            save_npz=True,
+        )
+
+        # Check if the npz file is created and data for a pair is loaded
+        npz_file = os.path.join(
+            self.path, "delta_ts_data/test_data_2212b-test_data_2212b.npz"
+        )
+        self.assertTrue(os.path.isfile(npz_file))
+        deltas = deltas_load(npz_file, [0, 4])
+        self.assertTrue(np.all(np.abs(deltas) < self.delta_window))
+        with self.assertRaises(ValueError):
+            deltas_load(npz_file, [4, 0])
+
     # Negative test case
     # Invalid firmware version
     def test_b_deltas_save_negative(self):
-        work_dir = r"{}".format(os.path.realpath(__file__) + "../../..")
-        os.chdir(work_dir)
         # Test negative case for deltas_save function
         with self.assertRaises(TypeError):
             deltas_save(
@@ -60,7 +149,6 @@ class TestDeltasFull(unittest.TestCase):
     def test_c_delta_cp(self):
         # Test case for delta_cp function
         # Positive test case
-        os.chdir(r"{}".format(os.path.realpath(__file__) + "/../.."))
         delta_cp(
             self.path,
             self.pixels,
@@ -73,14 +161,101 @@ class TestDeltasFull(unittest.TestCase):
         # Check if the plot file is created
         self.assertTrue(
             os.path.isfile(
-                "results/delta_t/test_data_2212b-test_data_2212b_delta_t_grid.png"
+                os.path.join(
+                    self.path,
+                    "results/delta_t/"
+                    "test_data_2212b-test_data_2212b_delta_t_grid.png",
+                )
             )
         )
 
+    def test_c_hist_update(self):
+        # Histograms are kept up to date with the timestamp differences
+        path_deltas = os.path.join(self.path, "delta_ts_data")
+        file_name = "test_data_2212b-test_data_2212b"
+        npz_file = os.path.join(path_deltas, "{}.npz".format(file_name))
+        os.utime(npz_file)
+
+        hist_file = hist_update(path_deltas, file_name)
+        self.assertGreaterEqual(
+            os.path.getmtime(hist_file), os.path.getmtime(npz_file)
+        )
+
+        deltas = deltas_load(npz_file, [0, 4])
+        counts, bin_edges = hist_load(hist_file, [0, 4])
+        self.assertTrue(np.allclose(np.diff(bin_edges), 17.857))
+        self.assertTrue(
+            np.array_equal(counts, np.histogram(deltas, bins=bin_edges)[0])
+        )
+        with self.assertRaises(ValueError):
+            hist_load(hist_file, [4, 0])
+
+    def test_c_hist_update_saved(self):
+        # Histograms saved with 'save_hist' are not replaced by the
+        # cache built from timestamp differences saved later
+        with tempfile.TemporaryDirectory() as path_out:
+            for save_hist in (True, False):
+                deltas_save(
+                    self.path,
+                    self.pixels,
+                    self.rewrite,
+                    self.board_number,
+                    self.fw_ver,
+                    self.timestamps,
+                    self.delta_window,
+                    save_hist=save_hist,
+                    reservoir=10,
+                    path_out=path_out,
+                )
+            path_deltas = os.path.join(path_out, "delta_ts_data")
+            file_name = "test_data_2212b-test_data_2212b"
+
+            hist_file = hist_update(path_deltas, file_name)
+            self.assertTrue(hist_file.endswith("_hist_cache.npz"))
+
+            with np.load(
+                os.path.join(path_deltas, "{}_hist.npz".format(file_name))
+            ) as hist:
+                self.assertIn("0,4_sample", hist.files)
+                self.assertGreaterEqual(
+                    hist["bin_edges"][-1], self.delta_window
+                )
+
+    def test_c_hist_update_newest(self):
+        # Histograms are built from the timestamp differences saved
+        # last, and rebuilt when either file is newer than the cache
+        with tempfile.TemporaryDirectory() as path_out:
+            for pixels, save_npz in (([0, 1, 4], True), ([0, 4], False)):
+                deltas_save(
+                    self.path,
+                    pixels,
+                    self.rewrite,
+                    self.board_number,
+                    self.fw_ver,
+                    self.timestamps,
+                    self.delta_window,
+                    save_npz=save_npz,
+                    path_out=path_out,
+                )
+            path_deltas = os.path.join(path_out, "delta_ts_data")
+            file_name = "test_data_2212b-test_data_2212b"
+            npz_file = os.path.join(path_deltas, "{}.npz".format(file_name))
+            csv_file = os.path.join(path_deltas, "{}.csv".format(file_name))
+            now = time.time()
+
+            os.utime(npz_file, (now - 100, now - 100))
+            os.utime(csv_file, (now - 200, now - 200))
+            with np.load(hist_update(path_deltas, file_name)) as hist:
+                self.assertIn("0,1", hist.files)
+
+            os.utime(csv_file, (now + 100, now + 100))
+            with np.load(hist_update(path_deltas, file_name)) as hist:
+                self.assertNotIn("0,1", hist.files)
+                self.assertIn("0,4", hist.files)
+
     # TODO: need larger data set to get more delta ts
     # def test_d_fit_wg_positive(self):
     #     # Test with valid input
-    #     os.chdir(r"{}".format(os.path.realpath(__file__) + "/../.."))
     #     pix_pair = [2, 4]
     #     window = 5e3
     #     step = 1
@@ -91,15 +266,21 @@ class TestDeltasFull(unittest.TestCase):
     #     # Assert that the function runs without raising any exceptions
     #     self.assertTrue(
     #         os.path.isfile(
-    #             "results/fits/test_data_2212b-test_data_2212b_pixels_2,4_fit.png"
+    #             os.path.join(
+    #                 self.path,
+    #                 "results/fits/"
+    #                 "test_data_2212b-test_data_2212b_pixels_2,4_fit.png",
+    #             )
     #         )
     #     )
 
     def tearDownClass():
         # Clean up after tests
-        os.chdir(r"{}".format(os.path.realpath(__file__) + "/.."))
-        shutil.rmtree("test_data/delta_ts_data")
-        shutil.rmtree("test_data/results")
+        path = os.path.join(
+            os.path.dirname(os.path.realpath(__file__)), "test_data"
+        )
+        shutil.rmtree(os.path.join(path, "delta_ts_data"))
+        shutil.rmtree(os.path.join(path, "results"))
 
 
 if __name__ == "__main__":
@@ -0,0 +1,209 @@
+import glob
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+from LinoSPAD2.functions.delta_t import deltas_save
+from LinoSPAD2.functions.fits import fit_wg, fit_wg_all, fit_wg_track
+from LinoSPAD2.functions.synthetic import generate_data
+
+
+class TestFits(unittest.TestCase):
+    def setUp(self):
+        self.board_number = "A5"
+        self.fw_ver = "2212b"
+        self.timestamps = 100
+
+    def test_fit_wg_all(self):
+        # Peaks of correlated pairs should be recovered, pairs without
+        # a peak are kept in the table
+        with tempfile.TemporaryDirectory() as path:
+            generate_data(
+                os.path.join(path, "data.dat"),
+                self.fw_ver,
+                100,
+                self.timestamps,
+                dark_rate=1e3,
+                pairs=[[3, 70], [5, 6]],
+                pair_rate=2e4,
+                pair_offset=2000,
+                seed=0,
+            )
+            deltas_save(
+                path,
+                [3, 5, 6, 70],
+                False,
+                self.board_number,
+                self.fw_ver,
+                self.timestamps,
+                10e3,
+                save_hist=True,
+            )
+
+            fit_data = fit_wg_all(
+                path, [[3, 70], [5, 6], [3, 5]], workers=2, plot=True
+            )
+            fit_data_ml = fit_wg_all(
+                path, [[3, 70], [5, 6]], fit_mode="poisson"
+            )
+
+            self.assertTrue(
+                os.path.isfile(
+                    os.path.join(path, "results", "fits", "data-data_fits.csv")
+                )
+            )
+            self.assertTrue(
+                os.path.isfile(
+                    os.path.join(
+                        path,
+                        "results",
+                        "fits",
+                        "data-data_pixels_3,70_fit.png",
+                    )
+                )
+            )
+
+        self.assertEqual(len(fit_data), 3)
+        self.assertTrue(np.allclose(fit_data["Mu"][:2], 2000, atol=3 * 17.857))
+        # jitter of 100 ps is widened by the calibration of the board
+        sigma = fit_data["Sigma"][:2].abs()
+        self.assertTrue(np.all((sigma > 100) & (sigma < 300)))
+        # maximum likelihood fit
+        self.assertTrue(np.allclose(fit_data_ml["Mu"], 2000, atol=3 * 17.857))
+        self.assertTrue(np.all(fit_data_ml["Mu error"] > 0))
+
+    def test_fit_wg_narrow(self):
+        # Fit windows narrower than 2 bins are rejected with a clear
+        # error, pairs in a batch get NaN values
+        with tempfile.TemporaryDirectory() as path:
+            generate_data(
+                os.path.join(path, "data.dat"),
+                self.fw_ver,
+                50,
+                self.timestamps,
+                pairs=[[3, 70]],
+                pair_rate=2e4,
+                pair_offset=2000,
+                seed=0,
+            )
+            deltas_save(
+                path,
+                [3, 70],
+                False,
+                self.board_number,
+                self.fw_ver,
+                self.timestamps,
+                10e3,
+                save_hist=True,
+            )
+
+            # empty window and a single bin
+            for window, step in ((10, 1), (40, 2)):
+                with self.assertRaises(ValueError):
+                    fit_wg(path, [3, 70], window=window, step=step)
+            fit_data = fit_wg_all(path, [[3, 70]], window=40, step=2)
+
+        self.assertTrue(np.isnan(fit_data["Mu"][0]))
+
+    def test_fit_wg_track(self):
+        # Shift of the peak between files should be followed
+        with tempfile.TemporaryDirectory() as path:
+            for i, offset in enumerate((2000, 3000)):
+                generate_data(
+                    os.path.join(path, "data_{}.dat".format(i)),
+                    self.fw_ver,
+                    100,
+                    self.timestamps,
+                    dark_rate=1e3,
+                    pairs=[[3, 70]],
+                    pair_rate=2e4,
+                    pair_offset=offset,
+                    seed=i,
+                )
+
+            track_data = fit_wg_track(
+                path,
+                [[3, 70]],
+                self.board_number,
+                self.fw_ver,
+                self.timestamps,
+                chunk_cycles=50,
+            )
+
+            self.assertEqual(
+                len(
+                    glob.glob(
+                        os.path.join(path, "results", "fits", "*_track.csv")
+                    )
+                ),
+                1,
+            )
+
+        self.assertEqual(len(track_data), 4)
+        self.assertEqual(list(track_data["Cycle"]), [0, 50, 0, 50])
+        self.assertTrue(
+            np.allclose(
+                track_data["Mu"], [2000, 2000, 3000, 3000], atol=3 * 17.857
+            )
+        )
+        self.assertTrue(
+            np.allclose(
+                track_data["Centroid"],
+                [2000, 2000, 3000, 3000],
+                atol=3 * 17.857,
+            )
+        )
+
+    def test_fit_wg_track_narrow(self):
+        # Fit windows of a single bin give NaN values instead of
+        # stopping the time series
+        with tempfile.TemporaryDirectory() as path:
+            generate_data(
+                os.path.join(path, "data.dat"),
+                self.fw_ver,
+                50,
+                self.timestamps,
+                pairs=[[3, 70]],
+                pair_rate=2e4,
+                pair_offset=2000,
+                seed=0,
+            )
+            track_data = fit_wg_track(
+                path,
+                [[3, 70]],
+                self.board_number,
+                self.fw_ver,
+                self.timestamps,
+                window=40,
+                step=2,
+            )
+
+        self.assertEqual(len(track_data), 1)
+        self.assertTrue(np.isnan(track_data["Centroid"][0]))
+        self.assertTrue(np.isnan(track_data["Mu"][0]))
+
+    def test_fit_wg_all_negative(self):
+        # Only boolean values of 'plot' are accepted
+        with self.assertRaises(TypeError):
+            fit_wg_all(".", plot="True")
+        # Only known fitting methods are accepted
+        with self.assertRaises(ValueError):
+            fit_wg_all(".", fit_mode="chi2")
+
+    def test_fit_wg_track_negative(self):
+        # Chunks should hold at least one acquisition cycle
+        for chunk_cycles in (0, -10):
+            with self.assertRaises(ValueError):
+                fit_wg_track(
+                    ".",
+                    [[3, 70]],
+                    self.board_number,
+                    self.fw_ver,
+                    chunk_cycles=chunk_cycles,
+                )
+
+
+if __name__ == "__main__":
+    unittest.main()
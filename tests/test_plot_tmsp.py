@@ -11,15 +11,15 @@ from LinoSPAD2.functions.plot_tmsp import (
 
 class TestPlotScripts(unittest.TestCase):
     def setUp(self):
-        self.path = "tests/test_data"
+        self.path = os.path.join(
+            os.path.dirname(os.path.realpath(__file__)), "test_data"
+        )
         self.board_number = "A5"
         self.fw_ver = "2212b"
         self.timestamps = 200
 
     def test_a_plot_pixel_hist(self):
         # Positive test case
-        os.chdir(r"{}".format(os.path.realpath(__file__) + "/../.."))
-
         pix = 15
         plot_pixel_hist(
             self.path,
@@ -31,13 +31,16 @@ class TestPlotScripts(unittest.TestCase):
         )
         self.assertTrue(
             os.path.exists(
-                "results/single pixel histograms/test_data_2212b.dat, pixel 15.png"
+                os.path.join(
+                    self.path,
+                    "results/single pixel histograms",
+                    "test_data_2212b.dat, pixel 15.png",
+                )
             )
         )
 
     def test_b_plot_sen_pop(self):
         # Positive test case
-        os.chdir(r"{}".format(os.path.realpath(__file__) + "/../.."))
         plot_sen_pop(
             self.path,
             self.board_number,
@@ -50,14 +53,17 @@ class TestPlotScripts(unittest.TestCase):
         )
         self.assertTrue(
             os.path.isfile(
-                "results/sensor_population/test_data_2212b-test_data_2212b.png"
+                os.path.join(
+                    self.path,
+                    "results/sensor_population",
+                    "test_data_2212b-test_data_2212b.png",
+                )
             )
         )
 
     # TODO: data for SPDC with background needed
     # def test_c_plot_spdc(self):
     #     # Positive test case
-    #     os.chdir(r"{}".format(os.path.realpath(__file__) + "/../.."))
     #     plot_spdc(self.path, self.board_number, self.timestamps, show_fig=True)
     #     self.assertTrue(
     #         os.path.exists(
@@ -73,8 +79,10 @@ class TestPlotScripts(unittest.TestCase):
 
     def tearDownClass():
         # Clean up after tests
-        os.chdir(r"{}".format(os.path.realpath(__file__) + "/.."))
-        shutil.rmtree("test_data/results")
+        path = os.path.join(
+            os.path.dirname(os.path.realpath(__file__)), "test_data"
+        )
+        shutil.rmtree(os.path.join(path, "results"))
 
 
 if __name__ == "__main__":
@@ -0,0 +1,71 @@
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+from LinoSPAD2.functions.calc_diff import calc_diff_2212
+from LinoSPAD2.functions.synthetic import generate_data
+from LinoSPAD2.functions.unpack import unpack_bin_sparse
+
+
+class TestGenerateData(unittest.TestCase):
+    def setUp(self):
+        self.board_number = "A5"
+        self.cycles = 50
+        self.timestamps = 100
+
+    def test_generate_data(self):
+        # Peak of correlated pairs and hot pixel should be recovered
+        # for both firmware versions
+        for fw_ver in ("2212b", "2212s"):
+            with tempfile.TemporaryDirectory() as path:
+                file = os.path.join(path, "data.dat")
+                generate_data(
+                    file,
+                    fw_ver,
+                    self.cycles,
+                    self.timestamps,
+                    dark_rate=1e3,
+                    hot_pixels=[20],
+                    pairs=[[3, 70]],
+                    pair_rate=2e4,
+                    pair_offset=2000,
+                    chunk_cycles=20,
+                    seed=0,
+                )
+                self.assertEqual(
+                    os.path.getsize(file),
+                    self.cycles * 65 * self.timestamps * 4,
+                )
+                tmsp, offsets = unpack_bin_sparse(
+                    file, self.board_number, fw_ver, self.timestamps
+                )
+
+            counts = offsets[:, -1] - offsets[:, 0]
+            self.assertEqual(np.argmax(counts), 20)
+            # hot pixel fills almost all positions of its TDC
+            self.assertGreater(counts[20], 0.9 * self.cycles * self.timestamps)
+
+            deltas = calc_diff_2212(
+                tmsp, tmsp, offsets[3], 10e3, cycle_ends2=offsets[70]
+            )
+            self.assertAlmostEqual(np.median(deltas), 2000, delta=100)
+            # number of correlated pairs, 2e4 Hz in 50 cycles of 4 ms,
+            # some are lost at the ends of cycles and full TDCs
+            self.assertAlmostEqual(
+                np.sum(np.abs(deltas - 2000) < 1000),
+                2e4 * self.cycles * 4e-3,
+                delta=0.1 * 2e4 * self.cycles * 4e-3,
+            )
+
+    def test_generate_data_negative(self):
+        # Firmware version 2208 has a different data format
+        with self.assertRaises(ValueError):
+            generate_data("data.dat", "2208")
+        with self.assertRaises(TypeError):
+            generate_data("data.dat", 2212)
+
+
+if __name__ == "__main__":
+    unittest.main()
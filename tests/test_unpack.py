@@ -1,17 +1,28 @@
 import unittest
 import os
+import subprocess
+import sys
+import tempfile
 
 import numpy as np
 
-from LinoSPAD2.functions.unpack import unpack_bin
+from LinoSPAD2.functions.unpack import (
+    count_valid,
+    unpack_bin,
+    unpack_bin_chunks,
+    unpack_bin_sparse,
+)
 
 
 class TestUnpackBin(unittest.TestCase):
+    def setUp(self):
+        self.path = os.path.join(
+            os.path.dirname(os.path.realpath(__file__)), "test_data"
+        )
+
     def test_valid_input(self):
         # Positive test case with valid inputs
-        work_dir = r"{}".format(os.path.realpath(__file__) + "../../..")
-        os.chdir(work_dir)
-        file = r"tests/test_data/test_data_2212b.dat"
+        file = os.path.join(self.path, "test_data_2212b.dat")
         board_number = "A5"
         timestamps = 200
 
@@ -22,6 +33,170 @@ class TestUnpackBin(unittest.TestCase):
         # Assert the data type of the output data
         self.assertEqual(data_all.dtype, np.longlong)
 
+    def test_compact(self):
+        # Compact layout should hold the same data as the default one
+        file = os.path.join(self.path, "test_data_2212b.dat")
+        board_number = "A5"
+        timestamps = 200
+
+        data_all = unpack_bin(file, board_number, timestamps)
+        data_compact = unpack_bin(file, board_number, timestamps, compact=True)
+
+        self.assertEqual(data_compact.shape, (64, 4020))
+        pix, tmsp = data_compact["pix"], data_compact["tmsp"]
+        self.assertTrue(np.array_equal(pix, data_all[..., 0]))
+        self.assertTrue(np.array_equal(tmsp > 0, data_all[..., 1] > 0))
+        self.assertTrue(
+            np.array_equal(tmsp[tmsp > 0], data_all[..., 1][tmsp > 0])
+        )
+
+    def test_chunks(self):
+        # Chunks put together should be the same as the whole file
+        file = os.path.join(self.path, "test_data_2212b.dat")
+        board_number = "A5"
+        timestamps = 200
+
+        data_all = unpack_bin(file, board_number, timestamps)
+        chunks = list(
+            unpack_bin_chunks(file, board_number, timestamps, chunk_cycles=7)
+        )
+
+        self.assertEqual(len(chunks), 3)
+        self.assertTrue(
+            np.array_equal(np.concatenate(chunks, axis=1), data_all)
+        )
+
+    def test_sparse(self):
+        # Per-pixel index should hold the same valid timestamps
+        file = os.path.join(self.path, "test_data_2212b.dat")
+        board_number = "A5"
+        timestamps = 200
+
+        data_all = unpack_bin(file, board_number, timestamps)
+        tmsp, offsets = unpack_bin_sparse(
+            file, board_number, "2212b", timestamps
+        )
+
+        self.assertEqual(offsets.shape, (256, 21))
+        for pixel in (0, 15, 130):
+            tdc, pix = divmod(pixel, 4)
+            data = data_all[tdc][201 * 3 : 201 * 4]
+            data = data[(data.T[0] == pix) & (data.T[1] > 0)].T[1]
+            self.assertTrue(
+                np.array_equal(
+                    tmsp[offsets[pixel, 3] : offsets[pixel, 4]], data
+                )
+            )
+
+    def test_pixels(self):
+        # Only the requested pixels should be unpacked
+        file = os.path.join(self.path, "test_data_2212b.dat")
+        board_number = "A5"
+        timestamps = 200
+
+        for fw_ver in ("2212b", "2212s"):
+            tmsp, offsets = unpack_bin_sparse(
+                file, board_number, fw_ver, timestamps
+            )
+            tmsp_cut, offsets_cut = unpack_bin_sparse(
+                file, board_number, fw_ver, timestamps, pixels=[3, 70]
+            )
+
+            self.assertEqual(offsets_cut[-1, -1], len(tmsp_cut))
+            for pixel in (3, 70):
+                self.assertTrue(
+                    np.array_equal(
+                        tmsp[offsets[pixel, 0] : offsets[pixel, -1]],
+                        tmsp_cut[
+                            offsets_cut[pixel, 0] : offsets_cut[pixel, -1]
+                        ],
+                    )
+                )
+            self.assertEqual(
+                len(tmsp_cut),
+                offsets[3, -1]
+                - offsets[3, 0]
+                + offsets[70, -1]
+                - offsets[70, 0],
+            )
+
+    def test_cache(self):
+        # Cached data should be the same as unpacked from the file
+        file = os.path.join(self.path, "test_data_2212b.dat")
+        board_number = "A5"
+        timestamps = 200
+
+        with tempfile.TemporaryDirectory() as cache_dir:
+            for pixels in (None, [3, 70]):
+                data = unpack_bin_sparse(
+                    file, board_number, "2212b", timestamps, pixels=pixels
+                )
+                for _ in range(2):
+                    # copies, so that no memory-mapped files stay open
+                    data_cached = [
+                        np.array(arr)
+                        for arr in unpack_bin_sparse(
+                            file,
+                            board_number,
+                            "2212b",
+                            timestamps,
+                            pixels=pixels,
+                            cache_dir=cache_dir,
+                        )
+                    ]
+                    for arr, arr_cached in zip(data, data_cached):
+                        self.assertTrue(np.array_equal(arr, arr_cached))
+
+            # A single entry for all pixels
+            self.assertEqual(len(os.listdir(cache_dir)), 2)
+
+    def test_count_valid(self):
+        # Counts from raw words should match counting pixel by pixel
+        file = os.path.join(self.path, "test_data_2212b.dat")
+        timestamps = 200
+
+        raw = np.fromfile(file, dtype=np.uint32).reshape(-1, 65, timestamps)
+        expected = np.zeros((64, 4), dtype=np.longlong)
+        for tdc in range(64):
+            for pix in range(4):
+                expected[tdc, pix] = np.sum(
+                    (raw[:, tdc] >= 0x80000000)
+                    & ((raw[:, tdc] >> 28 & 0x3) == pix)
+                )
+
+        self.assertTrue(
+            np.array_equal(
+                count_valid(file, "2212b", timestamps, chunk_cycles=3),
+                expected.ravel(),
+            )
+        )
+        self.assertTrue(
+            np.array_equal(
+                count_valid(file, "2212s", timestamps), expected.T.ravel()
+            )
+        )
+        with self.assertRaises(ValueError):
+            count_valid(file, "2208", timestamps)
+
+    def test_import_light(self):
+        # Unpacking and calculating differences should not load the
+        # plotting and fitting packages
+        code = (
+            "import sys\n"
+            "import LinoSPAD2.functions.unpack\n"
+            "import LinoSPAD2.functions.calc_diff\n"
+            "import LinoSPAD2.functions.delta_t\n"
+            "heavy = ('matplotlib', 'pandas', 'scipy', 'tqdm')\n"
+            "print(','.join(m for m in heavy if m in sys.modules))\n"
+        )
+        loaded = subprocess.run(
+            [sys.executable, "-c", code],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+        self.assertEqual(loaded, "")
+
 
 if __name__ == "__main__":
     unittest.main()